@@ -0,0 +1,86 @@
+"""
+SSE gateway for the Pagila agents.
+
+Streams an agent's answer as Server-Sent Events while it is being produced
+(tokens, tool calls, fan-out progress; see base_agent/answer_stream.py), so
+clients see the first words after seconds instead of after the whole team
+round trip. Runs next to pagila-api, e.g. `uvicorn main:app --port 8001`.
+"""
+
+import asyncio
+import importlib
+import json
+import os
+import sys
+from contextlib import suppress
+from typing import Literal
+
+from fastapi import FastAPI, Query
+from fastapi.responses import StreamingResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "base_agent"))
+
+# Comment lines sent while the agent is busy, so proxies don't drop the connection
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+
+# Gateway name -> base_agent module exposing stream(question)
+AGENT_MODULES = {
+    "agent": "agent",
+    "team": "agents_team",
+}
+
+app = FastAPI(title="Pagila Agent Gateway")
+
+
+def sse(event) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+async def sse_stream(events, heartbeat_interval=SSE_HEARTBEAT_INTERVAL):
+    """SSE frames for `events`, with heartbeat comments whenever none arrives for a while"""
+    iterator = events.__aiter__()
+    next_event = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_event}, timeout=heartbeat_interval)
+            if not done:
+                yield ": keep-alive\n\n"
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield sse(event)
+            next_event = asyncio.ensure_future(iterator.__anext__())
+    finally:
+        # The client went away (or the stream ended): stop the run's event pump
+        if not next_event.done():
+            next_event.cancel()
+            with suppress(asyncio.CancelledError, StopAsyncIteration):
+                await next_event
+        await iterator.aclose()
+
+
+@app.get("/")
+def read_root():
+    return {"message": "Pagila Agent Gateway"}
+
+
+@app.get("/health")
+def health_check():
+    return {"status": "healthy"}
+
+
+@app.get("/ask/stream")
+async def ask_stream(
+    question: str = Query(..., min_length=1),
+    agent: Literal["agent", "team"] = "agent",
+):
+    """Answer `question` with the single agent or the team, as text/event-stream"""
+    # Agents are built on first use, so the gateway starts without an LLM key
+    module = importlib.import_module(AGENT_MODULES[agent])
+    return StreamingResponse(
+        sse_stream(module.stream(question)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
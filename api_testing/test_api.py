@@ -1,11 +1,34 @@
 #!/usr/bin/env python3
-import requests
+import os
+import sys
 import json
 from pprint import pprint
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Shared pooled HTTP client (keep-alive, retries, per-endpoint timeouts)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "base_agent"))
+import http_client
+
 # Base URL of your API
 BASE_URL = "http://127.0.0.1:8000"
 
+# Wire format to ask the API for: "json" or "msgpack" (same data, smaller payloads)
+RESPONSE_FORMAT = os.getenv("API_RESPONSE_FORMAT", "json")
+ACCEPT_HEADERS = {
+    "json": {"Accept": "application/json"},
+    "msgpack": {"Accept": "application/msgpack"},
+}
+
+def decode_response(response):
+    """Decode a JSON or msgpack response body"""
+    if response.headers.get("content-type", "").startswith("application/msgpack"):
+        return msgpack.unpackb(response.content)
+    return response.json()
+
 def print_section(title):
     """Print a section header"""
     print("\n" + "=" * 50)
@@ -18,14 +41,11 @@ def test_endpoint(endpoint, params=None):
     print(f"Making GET request to: {url}")
     
     try:
-        if params:
-            response = requests.get(url, params=params)
-        else:
-            response = requests.get(url)
+        response = http_client.request("GET", url, params=params, headers=ACCEPT_HEADERS[RESPONSE_FORMAT])
         
         if response.status_code == 200:
             print(f"Status: ✅ {response.status_code} OK")
-            return response.json()
+            return decode_response(response)
         else:
             print(f"Status: ❌ {response.status_code} ERROR")
             print(response.text)
@@ -40,11 +60,11 @@ def test_post_endpoint(endpoint, data):
     print(f"Making POST request to: {url}")
     
     try:
-        response = requests.post(url, json=data)
+        response = http_client.request("POST", url, json=data, headers=ACCEPT_HEADERS[RESPONSE_FORMAT])
         
         if response.status_code == 200:
             print(f"Status: ✅ {response.status_code} OK")
-            return response.json()
+            return decode_response(response)
         else:
             print(f"Status: ❌ {response.status_code} ERROR")
             print(response.text)
@@ -2,14 +2,23 @@ import os
 os.environ["OPENROUTER_API_KEY"] = "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"
 from agno.agent import Agent, RunResponse
 from agno.models.openrouter import OpenRouter
-from agno.tools.api import CustomApiTools
+from api_tools import PagilaApiTools
+from semantic_cache import SemanticCache
+from answer_stream import agno_events, stream_answer
+import replay
+from tool_retrieval import ToolCatalogClient
+from intent_router import IntentRouter
 
 import json
+import threading
 from pprint import pprint
 
 # Base URL of your API
 BASE_URL = "http://127.0.0.1:8000"
 
+# Live, recorded, replayed or scripted model and API exchanges (AGENT_REPLAY_MODE, see replay.py)
+replay.install()
+
 def print_section(title):
     """Print a section header"""
     print("\n" + "=" * 50)
@@ -17,71 +26,124 @@ def print_section(title):
     print("=" * 50)
 
 # Create the API toolkit
-api_toolkit = CustomApiTools(
+api_toolkit = PagilaApiTools(
     base_url=BASE_URL,
     verify_ssl=True,
-    timeout=30
 )
 
+# Static part of the instructions; the endpoints for each question come from
+# the API's tool catalog (see prepare())
+INSTRUCTIONS = [
+    "You have access to a movie database API through the make_request and batch_request tools.",
+    "Use this tool to query the API and provide informative responses to user queries.",
+    "Format responses in a clear, structured way.",
+    
+    "General rules:",
+    "- For long listings or large query results pass shape='table' (params, or json_data for /execute-query) to get {columns, rows} instead of one object per row",
+    "- /execute-query results are capped: check `truncated` in the response",
+    "- Before writing SQL, call GET /sql-templates with a short intent; when a template fits, run it with make_request(endpoint='execute-query', method='POST', json_data={'template_id': ..., 'params': {...}}) instead of writing SQL",
+    "- When you do write SQL for /execute-query, add a short 'intent' to json_data saying what it answers (e.g. 'top paying customers in a district') so it can be reused",
+    "- When a question needs several endpoints (e.g. who paid most, who paid least, and their favourite categories), call batch_request once with all the sub-requests instead of calling make_request repeatedly",
+    
+    "How to use the make_request tool:",
+    "1. Determine the appropriate endpoint based on the user's query",
+    "2. Call the make_request tool with the endpoint, method, and any required parameters",
+    "3. Parse the JSON response and provide a clear, informative answer to the user",
+    
+    "Example workflow:",
+    "1. User asks: 'Find actors in CHOCOLAT'",
+    "2. You determine this requires the /search/actors-in-film endpoint",
+    "3. You call make_request with endpoint='search/actors-in-film', method='GET', params={'film_title': 'CHOCOLAT'}",
+    "   IMPORTANT: Always pass query parameters in the 'params' dictionary, not as direct arguments",
+    "   CORRECT: make_request(endpoint='search/actors-in-film', method='GET', params={'film_title': 'CHOCOLAT'})",
+    "   INCORRECT: make_request(endpoint='search/actors-in-film', method='GET', film_title='CHOCOLAT')",
+    "4. You receive a JSON response with actor information",
+    "5. You format and present this information to the user in a clear, structured way",
+    
+    "Always process the API response to provide a clear, informative answer. Don't just return raw JSON data.",
+    "If the API request fails, explain the issue to the user and suggest alternatives if possible.",
+    "If /execute-query answers with error 'query_rejected', apply its suggestions (add a LIMIT, add a join condition, filter on the listed indexed columns) and retry with the rewritten query."
+]
+
 agent = Agent(
-    model=OpenRouter(id="openai/gpt-4o-2024-11-20"),
+    model=OpenRouter(id="openai/gpt-4o-2024-11-20", http_client=replay.model_http_client()),
     tools=[
         api_toolkit,  # Add the API toolkit for making API calls to our FastAPI server
     ],
     description="You are a movie database and data engineer assistant that queries the Pagila DVD rental database",
-    instructions=[
-        "You have access to a movie database API through the make_request tool.",
-        "Use this tool to query the API and provide informative responses to user queries.",
-        "Format responses in a clear, structured way.",
-        
-        "Available endpoints:",
-        "- GET /health - Health check",
-        "- GET /actors - List actors (params: skip, limit)",
-        "- GET /films - List films (params: skip, limit)",
-        "- GET /search/actors-in-film - Find actors in a film (params: film_title)",
-        "- GET /search/top-actors-by-category - Find top actors in a category (params: category_name)",
-        "- GET /analysis/film-length-by-year - Film length analysis by year",
-        "- GET /analysis/customer-payments - Customer payment analysis",
-        "- GET /database/schema - Database schema information",
-        "- GET /database/schema-diagram - Database schema diagram",
-        "- POST /execute-query - Custom SQL query (params: query, params)",
-        
-        "Query type detection:",
-        "- When asked about actors in a film, use the /search/actors-in-film endpoint with film_title parameter",
-        "- When asked about films, use the /films endpoint",
-        "- When asked about actors, use the /actors endpoint",
-        "- When asked about top actors in a category, use the /search/top-actors-by-category endpoint with category_name parameter",
-        "- When asked about film length or duration analysis, use the /analysis/film-length-by-year endpoint",
-        "- When asked about customer payments or spending, use the /analysis/customer-payments endpoint",
-        "- When asked about database structure or schema, use the /database/schema endpoint",
-        "- When asked about database diagram or visualization, use the /database/schema-diagram endpoint",
-        "- When asked to run a custom SQL query, use the /execute-query endpoint with POST method",
-        
-        "How to use the make_request tool:",
-        "1. Determine the appropriate endpoint based on the user's query",
-        "2. Call the make_request tool with the endpoint, method, and any required parameters",
-        "3. Parse the JSON response and provide a clear, informative answer to the user",
-        
-        "Example workflow:",
-        "1. User asks: 'Find actors in CHOCOLAT'",
-        "2. You determine this requires the /search/actors-in-film endpoint",
-        "3. You call make_request with endpoint='search/actors-in-film', method='GET', params={'film_title': 'CHOCOLAT'}",
-        "   IMPORTANT: Always pass query parameters in the 'params' dictionary, not as direct arguments",
-        "   CORRECT: make_request(endpoint='search/actors-in-film', method='GET', params={'film_title': 'CHOCOLAT'})",
-        "   INCORRECT: make_request(endpoint='search/actors-in-film', method='GET', film_title='CHOCOLAT')",
-        "4. You receive a JSON response with actor information",
-        "5. You format and present this information to the user in a clear, structured way",
-        
-        "Always process the API response to provide a clear, informative answer. Don't just return raw JSON data.",
-        "If the API request fails, explain the issue to the user and suggest alternatives if possible."
-    ],
+    instructions=INSTRUCTIONS,
     markdown=True,
     show_tool_calls=True  # Show tool calls in the agent's response for debugging
 )
 
-# Example queries
-print_section("Example Query 1: What actors were in Chocolat Harry?")
-agent.print_response("What actors were in Chocolat Harry?")
+# Endpoints of the API, picked per question
+tool_catalog = ToolCatalogClient(BASE_URL)
+
+def prepare(question, target=None):
+    """Give the agent (or a copy of it) the endpoints relevant to `question` (see tool_retrieval.py)"""
+    (target or agent).instructions = INSTRUCTIONS + tool_catalog.instructions(question)
+
+# Known question types are answered with one API call and no LLM round trip
+router = IntentRouter()
+
+# Semantic answer cache: a rephrasing of a question already answered against the
+# same API data version is answered without going through the LLM again; film
+# titles, like categories, must then match exactly
+answer_cache = SemanticCache(load_names=api_toolkit.film_titles)
+
+# One run at a time, for run(), ask() and stream() alike: the agent keeps per-run
+# state (its instructions, the tool call memoization and the API timings)
+run_lock = threading.Lock()
+
+def run(question):
+    """
+    One agent run, with fresh per-run tool call memoization and its hit rates
+    in the run metrics; questions the intent router knows skip the LLM
+    """
+    with run_lock:
+        api_toolkit.start_run()
+        routed = router.answer(question, api_toolkit)
+        if routed is not None:
+            print(f"(answered locally: GET /{routed['endpoint']} {routed['params']}, "
+                  f"confidence {routed['confidence']})")
+            print(routed["answer"])
+            return routed["answer"]
+        prepare(question)
+        agent.print_response(question, stream=True)
+        api_toolkit.record_cache_metrics(agent.run_response)
+        return agent.run_response.content
+
+def ask(question):
+    """Print the answer to `question`, from the semantic cache when possible"""
+    data_version = api_toolkit.data_version()
+    if data_version is None:
+        run(question)
+        return
+
+    result = answer_cache.answer(question, run, data_version)
+    if result["cached"]:
+        print(f"(cached answer to \"{result['question']}\", similarity {result['similarity']}, "
+              f"data version {result['data_version']})")
+        print(result["answer"])
+
+def stream(question):
+    """Async generator of the answer events to `question` (see answer_stream.py), for the gateway"""
+    def events(question):
+        routed = router.answer(question, api_toolkit)
+        if routed is not None:
+            args = {"endpoint": routed["endpoint"], "method": "GET", "params": routed["params"]}
+            yield {"event": "tool_call", "tool": "make_request", "args": args, "routed": routed["intent"]}
+            yield {"event": "tool_result", "tool": "make_request", "args": args}
+            yield {"event": "token", "content": routed["answer"]}
+            return
+        prepare(question)
+        yield from agno_events(agent.run(question, stream=True, stream_intermediate_steps=True))
+    return stream_answer(question, events, api_toolkit, answer_cache, run_lock)
+
+if __name__ == "__main__":
+    # Example queries
+    print_section("Example Query 1: What actors were in Chocolat Harry?")
+    ask("What actors were in Chocolat Harry?")
 
-print_section("Example Query 2: Top actors in Children category")
-agent.print_response("Display the top 3 actors who have most appeared in films in the Children category")
+    print_section("Example Query 2: Top actors in Children category")
+    ask("Display the top 3 actors who have most appeared in films in the Children category")
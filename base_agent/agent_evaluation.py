@@ -5,12 +5,24 @@ Agent Evaluation Script
 This script evaluates the Agno agent's ability to handle various types of queries
 related to the Pagila DVD rental database. It tests the agent with a variety of
 query types and compares the agent's responses to expected endpoints and parameters.
+
+Cases (see eval_cases.py) run concurrently (see eval_runner.py):
+
+    python agent_evaluation.py --concurrency 4 --json eval_report.json --junit eval_report.xml
+    python agent_evaluation.py --rerun-failed eval_report.json
 """
 
+import argparse
 import sys
 import json
-from test_agno import agent
-from agent import agent
+import time
+from agent import agent, prepare
+from eval_cases import EVAL_CASES, GROUPS
+import replay
+from eval_runner import (
+    EVAL_CONCURRENCY, EvalRunner, RateLimiter, failed_case_ids, load_report, merge_results, summarize,
+    write_json_report, write_junit_report,
+)
 
 def print_section(title):
     """Print a section header"""
@@ -18,6 +30,105 @@ def print_section(title):
     print(f"  {title}")
     print("=" * 70)
 
+def parse_agent_code(agent_code):
+    """
+    Endpoint and params of the agent's answer, which should be a
+    test_endpoint('endpoint', {'param1': 'value1'}) call
+
+    Raises:
+        ValueError: when the answer isn't such a call
+    """
+    if "test_endpoint(" not in agent_code:
+        raise ValueError("Agent response does not contain test_endpoint call")
+    code_parts = agent_code.split("test_endpoint(")[1].split(")", 1)[0]
+
+    # Extract endpoint
+    if "'" in code_parts:
+        agent_endpoint = code_parts.split("'")[1]
+    elif '"' in code_parts:
+        agent_endpoint = code_parts.split('"')[1]
+    else:
+        raise ValueError("Failed to parse endpoint from agent response")
+
+    # Extract params if they exist
+    agent_params = None
+    if "{" in code_parts:
+        params_str = code_parts.split("{")[1].split("}", 1)[0]
+        # Convert the params string to a dict
+        try:
+            # Add curly braces back and replace single quotes with double quotes for JSON parsing
+            params_json = "{" + params_str + "}"
+            params_json = params_json.replace("'", '"')
+            agent_params = json.loads(params_json)
+        except json.JSONDecodeError:
+            raise ValueError("Failed to parse parameters from agent response")
+    return agent_endpoint, agent_params
+
+def check_response(agent_code, expected_endpoint, expected_params=None):
+    """
+    Compare the agent's answer with the expected endpoint and parameters
+
+    Returns:
+        dict: passed, endpoint, params, endpoint_match, params_match, and a message when it failed
+    """
+    try:
+        agent_endpoint, agent_params = parse_agent_code(agent_code)
+    except ValueError as e:
+        return {"passed": False, "response": agent_code, "message": str(e)}
+
+    endpoint_match = agent_endpoint == expected_endpoint
+    params_match = True
+    if expected_params is not None:
+        if agent_params is None:
+            params_match = False
+        else:
+            # Check if all expected params are in agent_params with correct values
+            for key, value in expected_params.items():
+                if key not in agent_params or agent_params[key] != value:
+                    params_match = False
+                    break
+
+    result = {
+        "passed": endpoint_match and params_match,
+        "response": agent_code,
+        "endpoint": agent_endpoint,
+        "params": agent_params,
+        "endpoint_match": endpoint_match,
+        "params_match": params_match,
+    }
+    if not endpoint_match:
+        result["message"] = f"endpoint {agent_endpoint} (expected: {expected_endpoint})"
+    elif not params_match:
+        result["message"] = f"parameters {agent_params} (expected: {expected_params})"
+    return result
+
+def check_case(case, run_response):
+    """check_response() for an eval case and the agent's run response"""
+    return check_response(run_response.content.strip(), case["expected_endpoint"], case.get("expected_params"))
+
+def print_result(case, result):
+    """Print the outcome of one case"""
+    print(f"\nQuery: \"{case['query']}\"")
+    if case.get("description"):
+        print(f"Testing: {case['description']}")
+    if "response" in result:
+        print(f"Agent response: {result['response']}")
+    if result.get("error"):
+        print(f"❌ Error evaluating agent response: {result['error']}")
+    elif "endpoint" not in result:
+        print(f"❌ {result['message']}")
+    else:
+        if result["endpoint_match"]:
+            print(f"✅ Endpoint: {result['endpoint']}")
+        else:
+            print(f"❌ Endpoint: {result['endpoint']} (expected: {case['expected_endpoint']})")
+        if result["params_match"]:
+            print(f"✅ Parameters: {result['params']}")
+        else:
+            print(f"❌ Parameters: {result['params']} (expected: {case.get('expected_params')})")
+    tokens = result.get("tokens", {})
+    print(f"Latency: {result.get('latency_seconds', 0):.2f}s, tokens: {tokens.get('total_tokens', 0)}")
+
 def evaluate_query(query, expected_endpoint, expected_params=None, description=None):
     """
     Evaluate a single query against the agent
@@ -31,303 +142,100 @@ def evaluate_query(query, expected_endpoint, expected_params=None, description=N
     Returns:
         bool: True if the agent's response matches the expected endpoint and parameters
     """
-    print(f"\nQuery: \"{query}\"")
-    if description:
-        print(f"Testing: {description}")
-    
-    # Run the query through the agent
-    response = agent.run(query)
-    
-    # Parse the agent's response
+    case = {"query": query, "expected_endpoint": expected_endpoint, "expected_params": expected_params,
+            "description": description}
     try:
-        # The agent should return a string that can be evaluated as Python code
-        agent_code = response.content.strip()
-        print(f"Agent response: {agent_code}")
-        
-        # Extract endpoint and params from the agent's response
-        # Expected format: test_endpoint('endpoint', {'param1': 'value1'})
-        if "test_endpoint(" in agent_code:
-            # Parse the endpoint and params from the agent's code
-            code_parts = agent_code.split("test_endpoint(")[1].split(")", 1)[0]
-            
-            # Extract endpoint
-            if "'" in code_parts:
-                agent_endpoint = code_parts.split("'")[1]
-            elif '"' in code_parts:
-                agent_endpoint = code_parts.split('"')[1]
-            else:
-                print("❌ Failed to parse endpoint from agent response")
-                return False
-            
-            # Extract params if they exist
-            agent_params = None
-            if "{" in code_parts:
-                params_str = code_parts.split("{")[1].split("}", 1)[0]
-                # Convert the params string to a dict
-                try:
-                    # Add curly braces back and replace single quotes with double quotes for JSON parsing
-                    params_json = "{" + params_str + "}"
-                    params_json = params_json.replace("'", '"')
-                    agent_params = json.loads(params_json)
-                except json.JSONDecodeError:
-                    print("❌ Failed to parse parameters from agent response")
-                    return False
-            
-            # Compare with expected values
-            endpoint_match = agent_endpoint == expected_endpoint
-            params_match = True
-            
-            if expected_params is not None:
-                if agent_params is None:
-                    params_match = False
-                else:
-                    # Check if all expected params are in agent_params with correct values
-                    for key, value in expected_params.items():
-                        if key not in agent_params or agent_params[key] != value:
-                            params_match = False
-                            break
-            
-            # Print results
-            if endpoint_match:
-                print(f"✅ Endpoint: {agent_endpoint}")
-            else:
-                print(f"❌ Endpoint: {agent_endpoint} (expected: {expected_endpoint})")
-            
-            if params_match:
-                print(f"✅ Parameters: {agent_params}")
-            else:
-                print(f"❌ Parameters: {agent_params} (expected: {expected_params})")
-            
-            return endpoint_match and params_match
-        else:
-            print("❌ Agent response does not contain test_endpoint call")
-            return False
+        prepare(query)
+        result = check_case(case, agent.run(query))
     except Exception as e:
-        print(f"❌ Error evaluating agent response: {e}")
-        return False
+        result = {"passed": False, "error": str(e)}
+    print_result(case, result)
+    return result["passed"]
+
+def run_evaluations(concurrency=EVAL_CONCURRENCY, case_ids=None):
+    """
+    Run the evaluation cases (all, or those in case_ids) concurrently and
+    return the results: passed counts per group, "total" passed, and the
+    per-case "cases" results
+    """
+    cases = [case for case in EVAL_CASES if case_ids is None or case["id"] in case_ids]
+    cases_by_id = {case["id"]: case for case in cases}
+    # Replayed or scripted models answer locally: no provider rate limit to respect
+    limiter = RateLimiter(0) if replay.offline() else None
+    runner = EvalRunner(agent.deep_copy, check_case, concurrency=concurrency, limiter=limiter,
+                        prepare=lambda copy, case: prepare(case["query"], copy))
+
+    print_section(f"Running {len(cases)} queries, {runner.concurrency} at a time")
+    started = time.monotonic()
+    case_results = runner.run(cases, on_result=lambda result: print_result(cases_by_id[result["id"]], result))
+    wall_seconds = time.monotonic() - started
+
+    results = {group: 0 for group in GROUPS}
+    for result in case_results:
+        if result["passed"]:
+            results[result["group"]] += 1
+    results["total"] = sum(1 for result in case_results if result["passed"])
+    results["cases"] = case_results
+    results["wall_seconds"] = wall_seconds
 
-def run_evaluations():
-    """Run all evaluation queries and return the results"""
-    results = {
-        "film_queries": 0,
-        "actor_queries": 0,
-        "category_queries": 0,
-        "customer_queries": 0,
-        "complex_queries": 0,
-        "total": 0
-    }
-    
-    total_queries = 0
-    successful_queries = 0
-    
-    # Film-specific queries
-    print_section("Film-specific Queries")
-    
-    # Query 1
-    total_queries += 1
-    if evaluate_query(
-        "What are the 5 longest films in the database?",
-        "films",
-        {"limit": 5, "sort_by": "length", "sort_order": "desc"},
-        "Testing film sorting by length"
-    ):
-        successful_queries += 1
-        results["film_queries"] += 1
-    
-    # Query 2
-    total_queries += 1
-    if evaluate_query(
-        "List all films with a rating of 'PG-13'",
-        "films",
-        {"rating": "PG-13"},
-        "Testing film filtering by rating"
-    ):
-        successful_queries += 1
-        results["film_queries"] += 1
-    
-    # Query 3
-    total_queries += 1
-    if evaluate_query(
-        "Find films released in 2006 with a rental duration longer than 5 days",
-        "films",
-        {"release_year": 2006, "min_rental_duration": 5},
-        "Testing film filtering by multiple criteria"
-    ):
-        successful_queries += 1
-        results["film_queries"] += 1
-    
-    # Actor-specific queries
-    print_section("Actor-specific Queries")
-    
-    # Query 4
-    total_queries += 1
-    if evaluate_query(
-        "Which actor has appeared in the most Comedy films?",
-        "search/top-actors-by-category",
-        {"category_name": "Comedy", "limit": 1},
-        "Testing finding top actor in a specific category"
-    ):
-        successful_queries += 1
-        results["actor_queries"] += 1
-    
-    # Query 5
-    total_queries += 1
-    if evaluate_query(
-        "Find all actors who have appeared in more than 30 films",
-        "actors",
-        {"min_film_count": 30},
-        "Testing actor filtering by film count"
-    ):
-        successful_queries += 1
-        results["actor_queries"] += 1
-    
-    # Query 6
-    total_queries += 1
-    if evaluate_query(
-        "List actors who have appeared in both Action and Drama films",
-        "search/actors-in-multiple-categories",
-        {"categories": ["Action", "Drama"]},
-        "Testing finding actors in multiple categories"
-    ):
-        successful_queries += 1
-        results["actor_queries"] += 1
-    
-    # Category-based queries
-    print_section("Category-based Queries")
-    
-    # Query 7
-    total_queries += 1
-    if evaluate_query(
-        "What is the most popular film category based on rental count?",
-        "analysis/category-popularity",
-        {"sort_by": "rental_count", "limit": 1},
-        "Testing category popularity analysis"
-    ):
-        successful_queries += 1
-        results["category_queries"] += 1
-    
-    # Query 8
-    total_queries += 1
-    if evaluate_query(
-        "Compare the average film length between Horror and Comedy categories",
-        "analysis/category-comparison",
-        {"categories": ["Horror", "Comedy"], "metric": "avg_length"},
-        "Testing category comparison"
-    ):
-        successful_queries += 1
-        results["category_queries"] += 1
-    
-    # Query 9
-    total_queries += 1
-    if evaluate_query(
-        "Which category has the highest average rental rate?",
-        "analysis/category-comparison",
-        {"sort_by": "avg_rental_rate", "sort_order": "desc", "limit": 1},
-        "Testing category sorting by rental rate"
-    ):
-        successful_queries += 1
-        results["category_queries"] += 1
-    
-    # Customer analysis queries
-    print_section("Customer Analysis Queries")
-    
-    # Query 10
-    total_queries += 1
-    if evaluate_query(
-        "Who are the top 5 customers by rental frequency?",
-        "analysis/customer-payments",
-        {"sort_by": "rental_count", "limit": 5},
-        "Testing customer sorting by rental frequency"
-    ):
-        successful_queries += 1
-        results["customer_queries"] += 1
-    
-    # Query 11
-    total_queries += 1
-    if evaluate_query(
-        "Find customers who have never returned a film",
-        "customers",
-        {"unreturned_rentals": True},
-        "Testing customer filtering by rental status"
-    ):
-        successful_queries += 1
-        results["customer_queries"] += 1
-    
-    # Query 12
-    total_queries += 1
-    if evaluate_query(
-        "What's the average payment amount for customers in district 'Alberta'?",
-        "analysis/customer-payments",
-        {"district": "Alberta", "metric": "avg_payment"},
-        "Testing customer payment analysis by district"
-    ):
-        successful_queries += 1
-        results["customer_queries"] += 1
-    
-    # Complex analysis queries
-    print_section("Complex Analysis Queries")
-    
-    # Query 13
-    total_queries += 1
-    if evaluate_query(
-        "Which month had the highest rental activity in the database?",
-        "analysis/rental-activity",
-        {"group_by": "month", "sort_by": "count", "sort_order": "desc", "limit": 1},
-        "Testing time-based rental analysis"
-    ):
-        successful_queries += 1
-        results["complex_queries"] += 1
-    
-    # Query 14
-    total_queries += 1
-    if evaluate_query(
-        "What's the correlation between film length and rental rate?",
-        "analysis/film-correlation",
-        {"metric1": "length", "metric2": "rental_rate"},
-        "Testing correlation analysis"
-    ):
-        successful_queries += 1
-        results["complex_queries"] += 1
-    
-    # Query 15
-    total_queries += 1
-    if evaluate_query(
-        "Find films that have never been rented",
-        "films",
-        {"never_rented": True},
-        "Testing film filtering by rental status"
-    ):
-        successful_queries += 1
-        results["complex_queries"] += 1
-    
-    # Calculate success rate
-    success_rate = (successful_queries / total_queries) * 100 if total_queries > 0 else 0
-    results["total"] = successful_queries
-    
     # Print summary
+    summary = summarize(case_results, wall_seconds)
+    success_rate = (summary["passed"] / summary["total"]) * 100 if summary["total"] > 0 else 0
     print_section("Evaluation Summary")
-    print(f"Total queries: {total_queries}")
-    print(f"Successful queries: {successful_queries}")
+    print(f"Total queries: {summary['total']}")
+    print(f"Successful queries: {summary['passed']}")
     print(f"Success rate: {success_rate:.2f}%")
+    print(f"Wall time: {wall_seconds:.1f}s (sum of latencies: {summary['latency_seconds']:.1f}s)")
+    print(f"Tokens: {summary['tokens']['total_tokens']}")
     print("\nResults by category:")
-    print(f"- Film queries: {results['film_queries']}/3")
-    print(f"- Actor queries: {results['actor_queries']}/3")
-    print(f"- Category queries: {results['category_queries']}/3")
-    print(f"- Customer queries: {results['customer_queries']}/3")
-    print(f"- Complex queries: {results['complex_queries']}/3")
-    
+    for group, title in GROUPS.items():
+        group_total = sum(1 for case in cases if case["group"] == group)
+        if group_total:
+            print(f"- {title.split()[0]} queries: {results[group]}/{group_total}")
+
     return results
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate the Pagila agent")
+    parser.add_argument("--concurrency", type=int, default=EVAL_CONCURRENCY, help="cases run at the same time")
+    parser.add_argument("--cases", help="comma-separated case ids to run (default: all)")
+    parser.add_argument("--json", dest="json_report", default="eval_report.json", help="JSON report path")
+    parser.add_argument("--junit", help="JUnit XML report path")
+    parser.add_argument("--rerun-failed", metavar="REPORT",
+                        help="only re-run the failed cases of this JSON report, and update it")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
     print_section("Agent Evaluation")
     print("Evaluating agent's ability to handle various query types...")
-    results = run_evaluations()
-    
+
+    previous = None
+    case_ids = set(args.cases.split(",")) if args.cases else None
+    if args.rerun_failed:
+        previous = load_report(args.rerun_failed)
+        case_ids = set(failed_case_ids(previous))
+        if not case_ids:
+            print("\nNo failed cases to re-run.")
+            sys.exit(0)
+    results = run_evaluations(args.concurrency, case_ids)
+
+    case_results = results["cases"]
+    if previous is not None:
+        case_results = merge_results(previous["results"], case_results)
+    json_path = args.rerun_failed or args.json_report
+    report = write_json_report(json_path, case_results, results["wall_seconds"])
+    print(f"\nJSON report: {json_path}")
+    if args.junit:
+        write_junit_report(args.junit, case_results)
+        print(f"JUnit report: {args.junit}")
+
     # Exit with status code based on success rate
-    if results["total"] == 15:
+    passed, total = report["summary"]["passed"], report["summary"]["total"]
+    if passed == total:
         print("\n🎉 All tests passed! The agent is working perfectly.")
         sys.exit(0)
-    elif results["total"] >= 10:
+    elif passed >= total * 2 / 3:
         print("\n✅ Most tests passed. The agent is working well but could be improved.")
         sys.exit(0)
     else:
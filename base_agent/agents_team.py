@@ -2,14 +2,27 @@ import os
 os.environ["OPENROUTER_API_KEY"] = "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"
 from agno.agent import Agent, RunResponse
 from agno.models.openrouter import OpenRouter
-from agno.tools.api import CustomApiTools
+from api_tools import PagilaApiTools
+from semantic_cache import SemanticCache
+from answer_stream import agno_events, stream_answer
+import replay
+from tool_retrieval import ToolCatalogClient
 from agno.team.team import Team
+from fan_out import DECOMPOSER_INSTRUCTIONS, FanOutTeam, ResearchPlan
 import json
+import threading
 from pprint import pprint
 
 # Base URL of your API
 BASE_URL = "http://127.0.0.1:8000"
 
+# Live, recorded, replayed or scripted model and API exchanges (AGENT_REPLAY_MODE, see replay.py)
+replay.install()
+
+# "coordinate": the planner Team calls researcher and writer in turn;
+# "fan_out": independent sub-questions are researched in parallel (see fan_out.py)
+TEAM_MODE = os.getenv("TEAM_MODE", "coordinate")
+
 def print_section(title):
     """Print a section header"""
     print("\n" + "=" * 50)
@@ -17,51 +30,30 @@ def print_section(title):
     print("=" * 50)
 
 # Create the API toolkit
-api_toolkit = CustomApiTools(
+api_toolkit = PagilaApiTools(
     base_url=BASE_URL,
     verify_ssl=True,
-    timeout=30
 )
 
-researcher = Agent(
-    model=OpenRouter(id="openai/gpt-4o-2024-11-20"),
-    tools=[
-        api_toolkit,  # Add the API toolkit for making API calls to our FastAPI server
-    ],
-    description="You are a movie database and data engineer assistant that queries the Pagila DVD rental database",
-    instructions=[
-        "You have access to a movie database API through the make_request tool.",
+# Static part of the researcher instructions; the endpoints for each question
+# come from the API's tool catalog (see make_researcher())
+RESEARCHER_INSTRUCTIONS = [
+        "You have access to a movie database API through the make_request and batch_request tools.",
         "Use this tool to query the API and provide informative responses to user queries.",
         "Format responses in a clear, structured way.",
-        
-        "Available endpoints:",
-        "- GET /health - Health check",
-        "- GET /actors - List actors (params: skip, limit)",
-        "- GET /films - List films (params: skip, limit)",
-        "- GET /search/actors-in-film - Find actors in a film (params: film_title)",
-        "- GET /search/top-actors-by-category - Find top actors in a category (params: category_name)",
-        "- GET /analysis/film-length-by-year - Film length analysis by year",
-        "- GET /analysis/customer-payments - Customer payment analysis",
-        "- GET /database/schema - Database schema information",
-        "- GET /database/schema-diagram - Database schema diagram",
-        "- POST /execute-query - Custom SQL query (params: query, params)",
-        
-        "Query type detection:",
-        "- When asked about actors in a film, use the /search/actors-in-film endpoint with film_title parameter",
-        "- When asked about films, use the /films endpoint",
-        "- When asked about actors, use the /actors endpoint",
-        "- When asked about top actors in a category, use the /search/top-actors-by-category endpoint with category_name parameter",
-        "- When asked about film length or duration analysis, use the /analysis/film-length-by-year endpoint",
-        "- When asked about customer payments or spending, use the /analysis/customer-payments endpoint",
-        "- When asked about database structure or schema, use the /database/schema endpoint",
-        "- When asked about database diagram or visualization, use the /database/schema-diagram endpoint",
-        "- When asked to run a custom SQL query, use the /execute-query endpoint with POST method",
-        
+
+        "General rules:",
+        "- For long listings or large query results pass shape='table' (params, or json_data for /execute-query) to get {columns, rows} instead of one object per row",
+        "- /execute-query results are capped: check `truncated` in the response",
+        "- Before writing SQL, call GET /sql-templates with a short intent; when a template fits, run it with make_request(endpoint='execute-query', method='POST', json_data={'template_id': ..., 'params': {...}}) instead of writing SQL",
+        "- When you do write SQL for /execute-query, add a short 'intent' to json_data saying what it answers (e.g. 'top paying customers in a district') so it can be reused",
+        "- When a question needs several endpoints (e.g. who paid most, who paid least, and their favourite categories), call batch_request once with all the sub-requests instead of calling make_request repeatedly",
+
         "How to use the make_request tool:",
         "1. Determine the appropriate endpoint based on the user's query",
         "2. Call the make_request tool with the endpoint, method, and any required parameters",
         "3. Parse the JSON response and provide a clear, informative answer to the user",
-        
+
         "Example workflow:",
         "1. User asks: 'Find actors in CHOCOLAT'",
         "2. You determine this requires the /search/actors-in-film endpoint",
@@ -71,16 +63,36 @@ researcher = Agent(
         "   INCORRECT: make_request(endpoint='search/actors-in-film', method='GET', film_title='CHOCOLAT')",
         "4. You receive a JSON response with actor information",
         "5. You format and present this information to the user in a clear, structured way",
-        
+
         "Always process the API response to provide a clear, informative answer. Don't just return raw JSON data.",
-        "If the API request fails, explain the issue to the user and suggest alternatives if possible."
-    ],
-    markdown=True,
-    show_tool_calls=True  # Show tool calls in the agent's response for debugging
-)
+        "If the API request fails, explain the issue to the user and suggest alternatives if possible.",
+        "If /execute-query answers with error 'query_rejected', apply its suggestions (add a LIMIT, add a join condition, filter on the listed indexed columns) and retry with the rewritten query."
+]
+
+# Endpoints of the API, picked per question
+tool_catalog = ToolCatalogClient(BASE_URL)
+
+def make_researcher(question=None, **kwargs):
+    """
+    A new researcher agent, told about the endpoints relevant to `question`;
+    fan-out runs need one per parallel sub-question
+    """
+    return Agent(
+        model=OpenRouter(id="openai/gpt-4o-2024-11-20", http_client=replay.model_http_client()),
+        tools=[
+            api_toolkit,  # Add the API toolkit for making API calls to our FastAPI server
+        ],
+        description="You are a movie database and data engineer assistant that queries the Pagila DVD rental database",
+        instructions=RESEARCHER_INSTRUCTIONS + (tool_catalog.instructions(question) if question else []),
+        markdown=True,
+        show_tool_calls=True,  # Show tool calls in the agent's response for debugging
+        **kwargs
+    )
+
+researcher = make_researcher()
 
 writer = Agent(
-    model=OpenRouter(id="openai/gpt-4o-2024-11-20"),
+    model=OpenRouter(id="openai/gpt-4o-2024-11-20", http_client=replay.model_http_client()),
     name="Writer",
     role="Writes a high-quality answer",
     description=(
@@ -100,7 +112,7 @@ writer = Agent(
 planner = Team(
     name="Reasoning Movies analysis leader",
     mode="coordinate",
-    model=OpenRouter(id="anthropic/claude-3.7-sonnet"),
+    model=OpenRouter(id="anthropic/claude-3.7-sonnet", http_client=replay.model_http_client()),
     members=[researcher, writer],
     description="You are a senior Movie editor and database angineer. Given a query, your goal is to write a useful and onpoint answer .",
     instructions=[
@@ -118,9 +130,66 @@ planner = Team(
     show_members_responses=True,
 )
 
+decomposer = Agent(
+    model=OpenRouter(id="openai/gpt-4o-2024-11-20", http_client=replay.model_http_client()),
+    name="Decomposer",
+    role="Splits a question into independent research sub-questions",
+    instructions=DECOMPOSER_INSTRUCTIONS,
+    response_model=ResearchPlan,
+)
+
+fan_out_team = FanOutTeam(decomposer, make_researcher, writer)
+
+def prepare(question):
+    """Give the team's researcher the endpoints relevant to `question` (see tool_retrieval.py)"""
+    researcher.instructions = RESEARCHER_INSTRUCTIONS + tool_catalog.instructions(question)
+
+# Semantic answer cache: a rephrasing of a question already answered against the
+# same API data version is answered without going through the LLM again; film
+# titles, like categories, must then match exactly
+answer_cache = SemanticCache(load_names=api_toolkit.film_titles)
+
+# One run at a time, for run(), ask() and stream() alike: the team keeps per-run
+# state (its instructions, the tool call memoization and the API timings)
+run_lock = threading.Lock()
+
+def run(question):
+    """One team run, with fresh per-run tool call memoization and its hit rates in the run metrics"""
+    with run_lock:
+        api_toolkit.start_run()
+        prepare(question)
+        if TEAM_MODE == "fan_out":
+            answer = fan_out_team.run(question)
+            api_toolkit.record_cache_metrics(writer.run_response)
+            if writer.run_response is not None:
+                writer.run_response.metrics["fan_out"] = fan_out_team.metrics
+            return answer
+        planner.print_response(question, stream=True)
+        api_toolkit.record_cache_metrics(planner.run_response)
+        return planner.run_response.content
 
+def ask(question):
+    """Print the answer to `question`, from the semantic cache when possible"""
+    data_version = api_toolkit.data_version()
+    if data_version is None:
+        run(question)
+        return
 
+    result = answer_cache.answer(question, run, data_version)
+    if result["cached"]:
+        print(f"(cached answer to \"{result['question']}\", similarity {result['similarity']}, "
+              f"data version {result['data_version']})")
+        print(result["answer"])
 
+def stream(question):
+    """Async generator of the answer events to `question` (see answer_stream.py), for the gateway"""
+    def events(question):
+        prepare(question)
+        if TEAM_MODE == "fan_out":
+            return fan_out_team.events(question)
+        return agno_events(planner.run(question, stream=True, stream_intermediate_steps=True))
+    return stream_answer(question, events, api_toolkit, answer_cache, run_lock)
 
-query = "“A common criticism of modern movies is that they are too long. Can you analyze film lengths over time and determine if that criticism is fair” "
-planner.print_response(query)
\ No newline at end of file
+if __name__ == "__main__":
+    query = "“A common criticism of modern movies is that they are too long. Can you analyze film lengths over time and determine if that criticism is fair” "
+    ask(query)
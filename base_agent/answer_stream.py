@@ -0,0 +1,132 @@
+"""
+Streaming agent answers.
+
+print_response() only returns once the whole answer is written. Here an
+answer is an async generator of small event dicts, produced while the agent
+works:
+
+- {"event": "token", "content": "..."}: a piece of the answer
+- {"event": "tool_call", "tool": ..., "args": {...}} / {"event": "tool_result", "tool": ...}
+- {"event": "research", ...}: fan-out progress (see fan_out.py)
+- {"event": "done", "cached": bool, "metrics": {...}}: always the last event
+- {"event": "error", "message": "..."}: the run failed (followed by done)
+
+agno runs and the API tools are synchronous, so the run iterates on a worker
+thread and hands its events to the event loop, which is never blocked by it.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import nullcontext
+
+_END = object()
+
+
+def _field(item, name):
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+
+def agno_events(chunks):
+    """
+    Events from an agno Agent or Team stream, run with stream=True and
+    stream_intermediate_steps=True
+    """
+    for chunk in chunks:
+        name = str(getattr(chunk, "event", "") or "")
+        if name.endswith("ToolCallStarted") or name.endswith("ToolCallCompleted"):
+            kind = "tool_call" if name.endswith("Started") else "tool_result"
+            tools = getattr(chunk, "tools", None) or [getattr(chunk, "tool", None)]
+            for tool in tools:
+                if tool is not None:
+                    yield {"event": kind, "tool": _field(tool, "tool_name"), "args": _field(tool, "tool_args")}
+        elif name.endswith("RunResponse") or name.endswith("RunResponseContent") or name.endswith("RunContent"):
+            if isinstance(chunk.content, str) and chunk.content:
+                yield {"event": "token", "content": chunk.content}
+
+
+async def aiterate(make_events, lock=None):
+    """
+    Iterate the synchronous iterator returned by make_events() on a worker
+    thread, holding `lock` (a threading.Lock) there for the whole iteration
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            with lock or nullcontext():
+                for item in make_events():
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+                    # The consumer went away: stop pulling more events out of the run
+                    if stop.is_set():
+                        break
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        loop.call_soon_threadsafe(queue.put_nowait, _END)
+
+    threading.Thread(target=produce, name="answer-stream", daemon=True).start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+async def stream_answer(question, make_events, toolkit=None, cache=None, lock=None):
+    """
+    Stream the answer to `question`. `make_events(question)` returns the
+    synchronous event iterator of one run. With a semantic `cache` (and the
+    `toolkit` to learn the data version from), cached answers come back as a
+    single token; fresh answers are stored once complete. `lock` (a
+    threading.Lock) serializes runs of an agent that can't run twice at the
+    same time; waiting for it never blocks the event loop.
+    """
+    started = time.monotonic()
+    loop = asyncio.get_running_loop()
+    data_version = None
+    if cache is not None and toolkit is not None:
+        data_version = await loop.run_in_executor(None, toolkit.data_version)
+    if data_version is not None:
+        hit = await loop.run_in_executor(None, cache.lookup, question, data_version)
+        if hit is not None:
+            yield {"event": "token", "content": hit["answer"]}
+            yield {"event": "done", "cached": True, "similar_question": hit["question"],
+                   "similarity": hit["similarity"], "metrics": {"total_seconds": time.monotonic() - started}}
+            return
+
+    # The run's tool stats are read while `lock` is still held, before the next run resets them
+    run_stats = {}
+
+    def run_events():
+        if toolkit is not None:
+            toolkit.start_run()
+        try:
+            yield from make_events(question)
+        finally:
+            if toolkit is not None:
+                run_stats.update(tool_cache=toolkit.tool_cache.stats(), api_timing=toolkit.api_timing.stats())
+
+    tokens, first_token_at, failed = [], None, False
+    try:
+        async for event in aiterate(run_events, lock):
+            if event["event"] == "token":
+                if first_token_at is None:
+                    first_token_at = time.monotonic() - started
+                tokens.append(event["content"])
+            yield event
+    except Exception as e:
+        failed = True
+        yield {"event": "error", "message": str(e)}
+
+    metrics = {"time_to_first_token": first_token_at, "total_seconds": time.monotonic() - started}
+    metrics.update(run_stats)
+    if data_version is not None and tokens and not failed:
+        await loop.run_in_executor(None, cache.store, question, "".join(tokens), data_version)
+    yield {"event": "done", "cached": False, "metrics": metrics}
@@ -0,0 +1,88 @@
+"""
+Where the time of the agent's API calls goes.
+
+The Pagila API can report its own side of each request in a Server-Timing
+header (SERVER_TIMING=true on the API): `db` is the time its SQL statements
+spent executing, `fetch` the time spent reading rows from server-side
+cursors and `app` the whole handler up to the response headers. Together
+with the latency measured here (retries included), each call splits into
+SQL, the rest of the API, and network plus transfer:
+
+    {"calls": 3, "total_ms": 41.2, "app_ms": 30.5, "db_ms": 22.1, "fetch_ms": 1.4, "network_ms": 10.7}
+
+Without the header only calls and total_ms are filled in; network_ms only
+counts the calls that came with one.
+"""
+
+import re
+import threading
+
+# name;dur=12.3;desc="..." entries, comma separated
+SERVER_TIMING_ENTRY = re.compile(r'\s*([\w-]+)((?:\s*;\s*[\w-]+(?:=(?:"[^"]*"|[^;,]*))?)*)\s*(?:,|$)')
+DURATION = re.compile(r";\s*dur=([\d.]+)")
+
+
+def parse_server_timing(header) -> dict:
+    """{name: milliseconds} of a Server-Timing header (entries without a duration are skipped)"""
+    timings = {}
+    for match in SERVER_TIMING_ENTRY.finditer(header or ""):
+        duration = DURATION.search(match.group(2))
+        if duration:
+            try:
+                timings[match.group(1)] = timings.get(match.group(1), 0.0) + float(duration.group(1))
+            except ValueError:
+                continue
+    return timings
+
+
+def _empty():
+    # reported/reported_ms: the calls that came with Server-Timing
+    return {"calls": 0, "total_ms": 0.0, "app_ms": 0.0, "db_ms": 0.0, "fetch_ms": 0.0,
+            "reported": 0, "reported_ms": 0.0}
+
+
+class ApiTiming:
+    """Per-run latency of the API calls, split by endpoint and by where the time went"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def start_run(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def record(self, endpoint, seconds, header=None):
+        """One call to `endpoint` that took `seconds`, with the API's Server-Timing header if it sent one"""
+        server = parse_server_timing(header)
+        with self._lock:
+            entry = self._endpoints.setdefault(endpoint.strip("/"), _empty())
+            entry["calls"] += 1
+            entry["total_ms"] += seconds * 1000
+            if "app" in server:
+                entry["reported"] += 1
+                entry["reported_ms"] += seconds * 1000
+                entry["app_ms"] += server["app"]
+                entry["db_ms"] += server.get("db", 0.0)
+                entry["fetch_ms"] += server.get("fetch", 0.0)
+
+    @staticmethod
+    def _summary(entry):
+        summary = {"calls": entry["calls"], "total_ms": round(entry["total_ms"], 1)}
+        if entry["reported"]:
+            summary.update(app_ms=round(entry["app_ms"], 1), db_ms=round(entry["db_ms"], 1),
+                           fetch_ms=round(entry["fetch_ms"], 1),
+                           network_ms=round(max(entry["reported_ms"] - entry["app_ms"], 0.0), 1))
+        return summary
+
+    def stats(self):
+        with self._lock:
+            endpoints = {name: dict(entry) for name, entry in self._endpoints.items()}
+        total = _empty()
+        for entry in endpoints.values():
+            for name in total:
+                total[name] += entry[name]
+        return {
+            **self._summary(total),
+            "endpoints": {name: self._summary(entry) for name, entry in sorted(endpoints.items())},
+        }
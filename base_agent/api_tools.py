@@ -0,0 +1,200 @@
+import json
+import time
+from typing import Any, Dict, List, Literal, Optional
+
+import httpx
+from agno.tools.api import CustomApiTools
+
+import http_client
+from api_timing import ApiTiming
+from tool_cache import ToolCallCache, cache_key, is_cacheable
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+def decode_response(response) -> Any:
+    """Response body as Python data, whether the API answered in msgpack or JSON"""
+    content_type = response.headers.get("content-type", "")
+    if content_type.startswith(MSGPACK_MEDIA_TYPE) and msgpack is not None:
+        return msgpack.unpackb(response.content)
+    try:
+        return response.json()
+    except ValueError:
+        return {"text": response.text}
+
+
+def _succeeded(result) -> bool:
+    """Whether a tool result (and, for a batch, each of its calls) is a 2xx answer worth reusing"""
+    if "error" in result or not 200 <= result.get("status_code", 0) < 300:
+        return False
+    data = result.get("data")
+    if isinstance(data, dict) and isinstance(data.get("results"), list):
+        return all(200 <= item.get("status_code", 0) < 300 for item in data["results"] if isinstance(item, dict))
+    return True
+
+
+class PagilaApiTools(CustomApiTools):
+    """CustomApiTools for the Pagila API, with a batch_request tool on top of make_request
+
+    Calls go through the shared pooled client (see http_client.py), with
+    keep-alive connections, retries and per-endpoint read timeouts. `timeout`
+    overrides the read timeout of every endpoint.
+
+    With compact=True (the default, when msgpack is installed) responses travel as
+    msgpack and the tool output is minified JSON that only keeps the API's own
+    X-* headers, which keeps both the transfer and the model context small.
+
+    Successful read-only calls are memoized (see tool_cache.py): per run by
+    default, across runs with cache_across_runs=True. Call start_run() before
+    each agent run and record_cache_metrics() after it.
+
+    The latency of every call is recorded per run too, split into SQL, API
+    and network time when the API sends Server-Timing (see api_timing.py).
+    """
+
+    def __init__(self, compact: bool = True, cache_across_runs: bool = False, timeout: Optional[float] = None, **kwargs):
+        super().__init__(timeout=timeout, **kwargs)
+        self.compact = compact and msgpack is not None
+        self.tool_cache = ToolCallCache(across_runs=cache_across_runs)
+        self.api_timing = ApiTiming()
+        self.register(self.batch_request)
+
+    def start_run(self):
+        self.tool_cache.start_run()
+        self.api_timing.start_run()
+
+    def record_cache_metrics(self, run_response):
+        """Add the tool cache hit rates and API call timings of the run to its metrics"""
+        if run_response is None:
+            return
+        if run_response.metrics is None:
+            run_response.metrics = {}
+        run_response.metrics["tool_cache"] = self.tool_cache.stats()
+        run_response.metrics["api_timing"] = self.api_timing.stats()
+
+    def make_request(
+        self,
+        endpoint: str,
+        method: Literal["GET", "POST", "PUT", "DELETE", "PATCH"] = "GET",
+        params: Optional[Dict[str, Any]] = None,
+        data: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        json_data: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Make an HTTP request to the API.
+
+        Args:
+            method (str): HTTP method (GET, POST, PUT, DELETE, PATCH)
+            endpoint (str): API endpoint (will be combined with base_url if set)
+            params (Optional[Dict[str, Any]]): Query parameters
+            data (Optional[Dict[str, Any]]): Form data to send
+            headers (Optional[Dict[str, str]]): Additional headers
+            json_data (Optional[Dict[str, Any]]): JSON data to send
+
+        Returns:
+            str: JSON string containing response data or error message
+        """
+        key = None
+        if data is None and not headers and is_cacheable(endpoint, method, json_data):
+            key = cache_key(endpoint, method, params, json_data)
+            cached = self.tool_cache.get(key)
+            if cached is not None:
+                return cached
+
+        # Read-only POSTs (queries, batches of reads) are as safe to resend as GETs
+        idempotent = is_cacheable(endpoint, method, json_data)
+        result = self._send(endpoint, method, params, data, headers, json_data, idempotent)
+        if key is not None and _succeeded(json.loads(result)):
+            self.tool_cache.set(key, result)
+        return result
+
+    def _send(self, endpoint, method, params, data, headers, json_data, idempotent) -> str:
+        url = f"{self.base_url.rstrip('/')}/{endpoint.lstrip('/')}" if self.base_url else endpoint
+        accept = f"{MSGPACK_MEDIA_TYPE}, application/json;q=0.9" if self.compact else "application/json"
+        request_headers = {"Accept": accept}
+        request_headers.update(headers or {})
+        started = time.perf_counter()
+        try:
+            response = http_client.request(
+                method,
+                url,
+                params=params,
+                data=data,
+                json=json_data,
+                headers=self._get_headers(request_headers, include_api_key=bool(self.base_url)),
+                auth=self._get_auth(),
+                timeout=self.timeout,
+                idempotent=idempotent,
+            )
+        except httpx.HTTPError as e:
+            self.api_timing.record(endpoint, time.perf_counter() - started)
+            return json.dumps({"error": f"Request failed: {str(e)}"})
+        self.api_timing.record(endpoint, time.perf_counter() - started, response.headers.get("server-timing"))
+
+        if self.compact:
+            response_headers = {name: value for name, value in response.headers.items() if name.lower().startswith("x-")}
+        else:
+            response_headers = dict(response.headers)
+        result = {"status_code": response.status_code, "headers": response_headers, "data": decode_response(response)}
+        if not response.is_success:
+            result["error"] = "Request failed"
+        if self.compact:
+            return json.dumps(result, separators=(",", ":"), default=str)
+        return json.dumps(result, indent=2, default=str)
+
+    def _get_auth(self):
+        """Basic auth credentials in the form httpx takes them"""
+        if self.username and self.password:
+            return (self.username, self.password)
+        return None
+
+    def data_version(self) -> Optional[str]:
+        """Current /database/version of the API data, or None when it can't be fetched (not a tool)"""
+        try:
+            response = http_client.request(
+                "GET",
+                f"{self.base_url.rstrip('/')}/database/version",
+                headers=self._get_headers({"Accept": "application/json"}),
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            return response.json()["version"]
+        except (httpx.HTTPError, ValueError, KeyError):
+            return None
+
+    def film_titles(self) -> Optional[List[str]]:
+        """Titles of all films, or None when they can't be fetched (not a tool)"""
+        try:
+            response = http_client.request(
+                "GET",
+                f"{self.base_url.rstrip('/')}/films",
+                params={"limit": 100000, "shape": "columns"},
+                headers=self._get_headers({"Accept": "application/json"}),
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            return response.json()["data"]["title"]
+        except (httpx.HTTPError, ValueError, KeyError, TypeError):
+            return None
+
+    def batch_request(self, requests: List[Dict[str, Any]]) -> str:
+        """Run several Pagila API calls in a single round trip (POST /batch).
+
+        Use this instead of several make_request calls when a question needs more
+        than one endpoint, e.g. top payers, lowest payers and the top actors of a category.
+
+        Args:
+            requests (List[Dict[str, Any]]): One entry per call, each with
+                "endpoint" (e.g. "analysis/customer-payments"), optional "method"
+                ("GET" by default, "POST" only for "execute-query"), optional
+                "params" (query parameters) and optional "json_data" (POST body).
+
+        Returns:
+            str: JSON string with one {"endpoint", "status_code", "data"} result per request, in order
+        """
+        return self.make_request(endpoint="batch", method="POST", json_data={"requests": requests})
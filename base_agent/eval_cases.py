@@ -0,0 +1,139 @@
+"""
+Evaluation cases for agent_evaluation.py.
+
+Each case is a user query with the endpoint (and the parameters, when given)
+the agent is expected to pick. `id` is stable so reports of different runs
+can be compared and failed cases re-run.
+"""
+
+# Report group -> section title, in display order
+GROUPS = {
+    "film_queries": "Film-specific Queries",
+    "actor_queries": "Actor-specific Queries",
+    "category_queries": "Category-based Queries",
+    "customer_queries": "Customer Analysis Queries",
+    "complex_queries": "Complex Analysis Queries",
+}
+
+EVAL_CASES = [
+    {
+        "id": "film-1",
+        "group": "film_queries",
+        "query": "What are the 5 longest films in the database?",
+        "expected_endpoint": "films",
+        "expected_params": {"limit": 5, "sort_by": "length", "sort_order": "desc"},
+        "description": "Testing film sorting by length",
+    },
+    {
+        "id": "film-2",
+        "group": "film_queries",
+        "query": "List all films with a rating of 'PG-13'",
+        "expected_endpoint": "films",
+        "expected_params": {"rating": "PG-13"},
+        "description": "Testing film filtering by rating",
+    },
+    {
+        "id": "film-3",
+        "group": "film_queries",
+        "query": "Find films released in 2006 with a rental duration longer than 5 days",
+        "expected_endpoint": "films",
+        "expected_params": {"release_year": 2006, "min_rental_duration": 5},
+        "description": "Testing film filtering by multiple criteria",
+    },
+    {
+        "id": "actor-1",
+        "group": "actor_queries",
+        "query": "Which actor has appeared in the most Comedy films?",
+        "expected_endpoint": "search/top-actors-by-category",
+        "expected_params": {"category_name": "Comedy", "limit": 1},
+        "description": "Testing finding top actor in a specific category",
+    },
+    {
+        "id": "actor-2",
+        "group": "actor_queries",
+        "query": "Find all actors who have appeared in more than 30 films",
+        "expected_endpoint": "actors",
+        "expected_params": {"min_film_count": 30},
+        "description": "Testing actor filtering by film count",
+    },
+    {
+        "id": "actor-3",
+        "group": "actor_queries",
+        "query": "List actors who have appeared in both Action and Drama films",
+        "expected_endpoint": "search/actors-in-multiple-categories",
+        "expected_params": {"categories": ["Action", "Drama"]},
+        "description": "Testing finding actors in multiple categories",
+    },
+    {
+        "id": "category-1",
+        "group": "category_queries",
+        "query": "What is the most popular film category based on rental count?",
+        "expected_endpoint": "analysis/category-popularity",
+        "expected_params": {"sort_by": "rental_count", "limit": 1},
+        "description": "Testing category popularity analysis",
+    },
+    {
+        "id": "category-2",
+        "group": "category_queries",
+        "query": "Compare the average film length between Horror and Comedy categories",
+        "expected_endpoint": "analysis/category-comparison",
+        "expected_params": {"categories": ["Horror", "Comedy"], "metric": "avg_length"},
+        "description": "Testing category comparison",
+    },
+    {
+        "id": "category-3",
+        "group": "category_queries",
+        "query": "Which category has the highest average rental rate?",
+        "expected_endpoint": "analysis/category-comparison",
+        "expected_params": {"sort_by": "avg_rental_rate", "sort_order": "desc", "limit": 1},
+        "description": "Testing category sorting by rental rate",
+    },
+    {
+        "id": "customer-1",
+        "group": "customer_queries",
+        "query": "Who are the top 5 customers by rental frequency?",
+        "expected_endpoint": "analysis/customer-payments",
+        "expected_params": {"sort_by": "rental_count", "limit": 5},
+        "description": "Testing customer sorting by rental frequency",
+    },
+    {
+        "id": "customer-2",
+        "group": "customer_queries",
+        "query": "Find customers who have never returned a film",
+        "expected_endpoint": "customers",
+        "expected_params": {"unreturned_rentals": True},
+        "description": "Testing customer filtering by rental status",
+    },
+    {
+        "id": "customer-3",
+        "group": "customer_queries",
+        "query": "What's the average payment amount for customers in district 'Alberta'?",
+        "expected_endpoint": "analysis/customer-payments",
+        "expected_params": {"district": "Alberta", "metric": "avg_payment"},
+        "description": "Testing customer payment analysis by district",
+    },
+    {
+        "id": "complex-1",
+        "group": "complex_queries",
+        "query": "Which month had the highest rental activity in the database?",
+        "expected_endpoint": "analysis/rental-activity",
+        "expected_params": {"group_by": "month", "sort_by": "count", "sort_order": "desc", "limit": 1},
+        "description": "Testing time-based rental analysis",
+    },
+    {
+        "id": "complex-2",
+        "group": "complex_queries",
+        "query": "What's the correlation between film length and rental rate?",
+        "expected_endpoint": "analysis/film-correlation",
+        "expected_params": {"metric1": "length", "metric2": "rental_rate"},
+        "description": "Testing correlation analysis",
+    },
+    {
+        "id": "complex-3",
+        "group": "complex_queries",
+        "query": "Find films that have never been rented",
+        "expected_endpoint": "films",
+        "expected_params": {"never_rented": True},
+        "description": "Testing film filtering by rental status",
+    },
+]
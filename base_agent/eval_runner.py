@@ -0,0 +1,208 @@
+"""
+Concurrent runner for the agent evaluation cases.
+
+Cases run on a pool of EVAL_CONCURRENCY worker threads. Each worker has its
+own copy of the agent, because agents keep per-run state. Model calls are
+scheduled to stay under EVAL_REQUESTS_PER_MINUTE. When the provider still
+answers with a rate limit error, the whole pool pauses (for Retry-After
+when it was given, else with jittered exponential backoff) and the case is
+retried.
+
+Results are written as a JSON report (the input of --rerun-failed) and
+optionally as JUnit XML for CI.
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "4"))
+EVAL_REQUESTS_PER_MINUTE = float(os.getenv("EVAL_REQUESTS_PER_MINUTE", "60"))
+EVAL_MAX_RETRIES = int(os.getenv("EVAL_MAX_RETRIES", "4"))
+EVAL_BACKOFF_BASE = float(os.getenv("EVAL_BACKOFF_BASE", "2"))
+EVAL_BACKOFF_MAX = float(os.getenv("EVAL_BACKOFF_MAX", "60"))
+
+RATE_LIMIT_MESSAGE = re.compile(r"rate.?limit|too many requests|\b429\b", re.IGNORECASE)
+
+
+class RateLimiter:
+    """
+    Spaces model calls evenly to stay under a requests-per-minute budget, and
+    holds every worker back after the provider reported a rate limit
+    """
+
+    def __init__(self, requests_per_minute=EVAL_REQUESTS_PER_MINUTE):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - time.monotonic()))
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def is_rate_limit_error(error) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError" or bool(RATE_LIMIT_MESSAGE.search(str(error)))
+
+
+def retry_after(error, attempt) -> float:
+    """Retry-After of the provider's answer when there is one, else jittered exponential backoff"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return min(float(headers.get("retry-after")), EVAL_BACKOFF_MAX)
+    except (TypeError, ValueError):
+        return random.uniform(0.5, 1.0) * min(EVAL_BACKOFF_MAX, EVAL_BACKOFF_BASE * 2 ** attempt)
+
+
+def token_counts(run_response):
+    """Input, output and total tokens of a run, from its metrics (per-call lists or totals)"""
+    metrics = getattr(run_response, "metrics", None) or {}
+    counts = {}
+    for name in ("input_tokens", "output_tokens", "total_tokens"):
+        value = metrics.get(name, 0)
+        counts[name] = sum(value) if isinstance(value, list) else (value or 0)
+    return counts
+
+
+class EvalRunner:
+    """
+    Runs `check(case, run_response)` for every case against a per-worker copy
+    of the agent made by `make_agent()`. `check` returns a dict with at
+    least "passed". `prepare(agent, case)`, when given, is called before each
+    run (e.g. to set the instructions for the case's question).
+    """
+
+    def __init__(self, make_agent, check, concurrency=EVAL_CONCURRENCY, limiter=None, max_retries=EVAL_MAX_RETRIES,
+                 prepare=None):
+        self.make_agent = make_agent
+        self.check = check
+        self.prepare = prepare
+        self.concurrency = max(1, concurrency)
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self._local = threading.local()
+
+    def _agent(self):
+        if getattr(self._local, "agent", None) is None:
+            self._local.agent = self.make_agent()
+        return self._local.agent
+
+    def run_case(self, case):
+        result = {"id": case["id"], "group": case["group"], "query": case["query"]}
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                agent = self._agent()
+                if self.prepare is not None:
+                    self.prepare(agent, case)
+                run_response = agent.run(case["query"])
+            except Exception as e:
+                if is_rate_limit_error(e) and attempt < self.max_retries:
+                    self.limiter.pause(retry_after(e, attempt))
+                    continue
+                result.update(passed=False, error=f"{type(e).__name__}: {e}", attempts=attempt + 1,
+                              latency_seconds=round(time.monotonic() - started, 3))
+                return result
+            result.update(latency_seconds=round(time.monotonic() - started, 3), attempts=attempt + 1,
+                          tokens=token_counts(run_response))
+            try:
+                result.update(self.check(case, run_response))
+            except Exception as e:
+                result.update(passed=False, error=f"{type(e).__name__}: {e}")
+            return result
+
+    def run(self, cases, on_result=None):
+        """Results of all `cases`, in case order; on_result(result) is called as each one finishes"""
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="eval") as pool:
+            futures = {pool.submit(self.run_case, case): case["id"] for case in cases}
+            for future in as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                if on_result is not None:
+                    on_result(result)
+        return [results[case["id"]] for case in cases]
+
+
+def summarize(results, wall_seconds=None):
+    summary = {
+        "total": len(results),
+        "passed": sum(1 for r in results if r["passed"]),
+        "errors": sum(1 for r in results if r.get("error")),
+        "latency_seconds": round(sum(r.get("latency_seconds", 0) for r in results), 3),
+        "tokens": {
+            name: sum(r.get("tokens", {}).get(name, 0) for r in results)
+            for name in ("input_tokens", "output_tokens", "total_tokens")
+        },
+    }
+    summary["failed"] = summary["total"] - summary["passed"]
+    if wall_seconds is not None:
+        summary["wall_seconds"] = round(wall_seconds, 3)
+    return summary
+
+
+def write_json_report(path, results, wall_seconds=None, extra=None):
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "summary": summarize(results, wall_seconds),
+        "results": results,
+    }
+    report.update(extra or {})
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    return report
+
+
+def write_junit_report(path, results, suite_name="agent_evaluation"):
+    summary = summarize(results)
+    suite = ET.Element(
+        "testsuite",
+        name=suite_name,
+        tests=str(summary["total"]),
+        failures=str(summary["failed"] - summary["errors"]),
+        errors=str(summary["errors"]),
+        time=str(summary["latency_seconds"]),
+    )
+    for result in results:
+        case = ET.SubElement(
+            suite, "testcase", classname=f"{suite_name}.{result['group']}", name=result["id"],
+            time=str(result.get("latency_seconds", 0)),
+        )
+        if result.get("error"):
+            ET.SubElement(case, "error", message=result["error"])
+        elif not result["passed"]:
+            failure = ET.SubElement(case, "failure", message=result.get("message", "failed"))
+            failure.text = result.get("response", "")
+        ET.SubElement(case, "system-out").text = result["query"]
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def failed_case_ids(report):
+    return [result["id"] for result in report["results"] if not result["passed"]]
+
+
+def merge_results(previous, rerun):
+    """Previous report results with the re-run cases replaced"""
+    rerun_by_id = {result["id"]: result for result in rerun}
+    return [rerun_by_id.get(result["id"], result) for result in previous]
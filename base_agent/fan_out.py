@@ -0,0 +1,160 @@
+"""
+Parallel fan-out execution for the research team.
+
+In "coordinate" mode the team leader calls the researcher and the writer one
+after the other, so a question needing four lookups waits for four research
+turns in a row. Here the question is first split into independent
+sub-questions, each one is handed to its own researcher instance (with its
+own tool call budget) on a thread pool, and the writer starts as soon as
+enough research has arrived: all of it, a FANOUT_QUORUM share of it, or
+whatever is in when FANOUT_DEADLINE expires. Research that arrives later is
+left out of the answer.
+"""
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List
+
+from pydantic import BaseModel, Field
+
+FANOUT_MAX_RESEARCHERS = int(os.getenv("FANOUT_MAX_RESEARCHERS", "4"))
+FANOUT_TOOL_BUDGET = int(os.getenv("FANOUT_TOOL_BUDGET", "6"))
+# Share of the research the writer waits for before it starts
+FANOUT_QUORUM = float(os.getenv("FANOUT_QUORUM", "1.0"))
+# Seconds after the first research result the writer waits for the rest
+FANOUT_DEADLINE = float(os.getenv("FANOUT_DEADLINE", "60"))
+
+
+class ResearchPlan(BaseModel):
+    sub_questions: List[str] = Field(
+        ...,
+        description="Independent sub-questions whose answers together answer the question; one if it can't be split",
+    )
+
+
+DECOMPOSER_INSTRUCTIONS = [
+    "Split the user's question into independent research sub-questions for the Pagila DVD rental database API.",
+    f"Use at most {FANOUT_MAX_RESEARCHERS} sub-questions, each answerable on its own without the answers of the others.",
+    "Keep film titles, category names, dates and numbers exactly as the user wrote them.",
+    "If the question can't be split, return it as the only sub-question.",
+]
+
+
+def research_prompt(question, sub_question):
+    return (
+        f"Overall question (for context only): {question}\n"
+        f"Your sub-question: {sub_question}\n"
+        "Answer only your sub-question, with the figures and names the API returned. No article, no introduction."
+    )
+
+
+def writer_prompt(question, findings, missing):
+    sections = [f"## {sub_question}\n{answer}" for sub_question, answer in findings]
+    if missing:
+        sections.append("## Not researched in time\n" + "\n".join(f"- {sub_question}" for sub_question in missing))
+    return f"Question: {question}\n\nResearch findings:\n\n" + "\n\n".join(sections)
+
+
+class FanOutTeam:
+    """
+    Decomposer, parallel researchers and a streaming writer.
+
+    `make_researcher(sub_question, tool_call_limit=...)` must return a new
+    researcher Agent on every call: agents keep per-run state and can't be
+    shared between threads. Their tools can be: the researchers of one run
+    share the PagilaApiTools instance, whose tool call cache and API timings
+    are lock-protected and add up the calls of every researcher, and whose
+    requests go through the thread-safe shared client (see http_client.py).
+    """
+
+    def __init__(self, decomposer, make_researcher, writer, max_researchers=FANOUT_MAX_RESEARCHERS,
+                 tool_budget=FANOUT_TOOL_BUDGET, quorum=FANOUT_QUORUM, deadline=FANOUT_DEADLINE):
+        self.decomposer = decomposer
+        self.make_researcher = make_researcher
+        self.writer = writer
+        self.max_researchers = max_researchers
+        self.tool_budget = tool_budget
+        self.quorum = quorum
+        self.deadline = deadline
+        self.metrics = {}
+
+    def plan(self, question) -> List[str]:
+        plan = self.decomposer.run(question).content
+        sub_questions = [q.strip() for q in getattr(plan, "sub_questions", []) if q and q.strip()]
+        return sub_questions[:self.max_researchers] or [question]
+
+    def _research(self, question, sub_question):
+        started = time.monotonic()
+        researcher = self.make_researcher(sub_question, tool_call_limit=self.tool_budget)
+        answer = researcher.run(research_prompt(question, sub_question)).content
+        return sub_question, answer, time.monotonic() - started
+
+    def research(self, question, sub_questions):
+        """Run the researchers in parallel, yielding (sub_question, answer) as each one is done, until enough are"""
+        # A pool per call, so researchers still running past the deadline don't take the next run's workers
+        pool = ThreadPoolExecutor(max_workers=len(sub_questions), thread_name_prefix="researcher")
+        try:
+            yield from self._collect(pool, question, sub_questions)
+        finally:
+            # Researchers that haven't started are cancelled, running ones finish in the background and are ignored
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _collect(self, pool, question, sub_questions):
+        futures = {pool.submit(self._research, question, q): q for q in sub_questions}
+        needed = max(1, min(len(futures), round(len(futures) * self.quorum)))
+        pending, done, deadline = set(futures), 0, None
+        while pending and done < needed:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            finished, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not finished:
+                break
+            for future in finished:
+                try:
+                    sub_question, answer, seconds = future.result()
+                except Exception as e:
+                    sub_question, answer, seconds = futures[future], f"Research failed: {e}", None
+                done += 1
+                self.metrics["research_seconds"][sub_question] = seconds
+                yield sub_question, answer
+            if deadline is None:
+                deadline = time.monotonic() + self.deadline
+
+    def events(self, question):
+        """
+        Answer `question` as a stream of events (see answer_stream.py): the
+        plan, each finished research and then the writer's tokens
+        """
+        started = time.monotonic()
+        self.metrics = {"research_seconds": {}}
+        sub_questions = self.plan(question)
+        self.metrics["sub_questions"] = sub_questions
+        self.metrics["plan_seconds"] = time.monotonic() - started
+        yield {"event": "research", "stage": "planned", "sub_questions": sub_questions}
+
+        done = {}
+        for sub_question, answer in self.research(question, sub_questions):
+            done[sub_question] = answer
+            yield {"event": "research", "stage": "done", "sub_question": sub_question}
+        # Keep the sub-question order
+        findings = [(q, done[q]) for q in sub_questions if q in done]
+        missing = [q for q in sub_questions if q not in done]
+        self.metrics["missing"] = missing
+        self.metrics["writer_started_after"] = time.monotonic() - started
+
+        for chunk in self.writer.run(writer_prompt(question, findings, missing), stream=True):
+            if isinstance(chunk.content, str) and chunk.content:
+                yield {"event": "token", "content": chunk.content}
+        self.metrics["total_seconds"] = time.monotonic() - started
+
+    def run(self, question, show=True) -> str:
+        """Answer `question`, printing the writer's answer as it streams when show=True"""
+        chunks = []
+        for event in self.events(question):
+            if event["event"] == "token":
+                chunks.append(event["content"])
+                if show:
+                    print(event["content"], end="", flush=True)
+        if show:
+            print()
+        return "".join(chunks)
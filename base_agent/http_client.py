@@ -0,0 +1,207 @@
+"""
+Shared, pooled HTTP clients for the Pagila API.
+
+The agents' API toolkit and the test scripts all go through one keep-alive
+httpx.Client (and one httpx.AsyncClient per event loop), so tool calls reuse
+open connections instead of paying for a new TCP connection each time.
+HTTP/2 is used when the h2 package is installed and the server offers it
+(over TLS); plain http:// stays on keep-alive HTTP/1.1.
+
+Failed calls are retried with exponential backoff and full jitter, and a
+Retry-After header from the API wins over the computed delay:
+- connection errors, for every method (the request never reached the server)
+- 429 and 503, for every method (the API refused the request before running it)
+- timeouts, dropped connections, 502 and 504, for idempotent requests only
+
+Read timeouts depend on the endpoint (ENDPOINT_TIMEOUTS).
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.2"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "5"))
+# TLS verification is a property of the pool, not of single requests
+HTTP_VERIFY_SSL = os.getenv("HTTP_VERIFY_SSL", "true").lower() != "false"
+
+# Read timeouts (seconds) by endpoint path prefix; the longest matching prefix wins
+ENDPOINT_TIMEOUTS = {
+    "health": 5,
+    "actors": 15,
+    "films": 15,
+    "search": 15,
+    "database": 15,
+    "analysis": 30,
+    # Admission queueing (up to 10s) plus the statement timeout
+    "execute-query": 30,
+    "batch": 60,
+    "admin": 120,
+}
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Answers that mean the request was refused before it ran
+REFUSED_STATUSES = {429, 503}
+GATEWAY_STATUSES = {502, 504}
+# Errors raised before the request was sent
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Errors after which the request may or may not have run
+IN_FLIGHT_ERRORS = (httpx.ReadTimeout, httpx.WriteTimeout, httpx.RemoteProtocolError, httpx.ReadError)
+
+
+def endpoint_timeout(url, read=None) -> httpx.Timeout:
+    """Timeout for a call to `url`: `read` if given, else the endpoint's read timeout"""
+    if read is None:
+        path = urlsplit(url).path.strip("/") if "://" in url else url.strip("/")
+        matches = [prefix for prefix in ENDPOINT_TIMEOUTS if path == prefix or path.startswith(prefix + "/")]
+        read = ENDPOINT_TIMEOUTS[max(matches, key=len)] if matches else HTTP_READ_TIMEOUT
+    return httpx.Timeout(read, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def backoff_delay(attempt, response=None) -> float:
+    """Full-jitter exponential backoff, or the API's Retry-After when it sent one"""
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+        except ValueError:
+            try:
+                return min(max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0), HTTP_BACKOFF_MAX)
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+def _should_retry(method, idempotent, response=None, error=None) -> bool:
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    if error is not None:
+        return isinstance(error, NOT_SENT_ERRORS) or (idempotent and isinstance(error, IN_FLIGHT_ERRORS))
+    return response.status_code in REFUSED_STATUSES or (idempotent and response.status_code in GATEWAY_STATUSES)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+_client = None
+_async_clients = {}
+_lock = threading.Lock()
+# Custom httpx transports (record/replay, see replay.py); None means the network
+_transport = None
+_async_transport = None
+
+
+def configure(transport=None, async_transport=None):
+    """Send later requests through these transports (the pooled clients are rebuilt)"""
+    global _transport, _async_transport
+    close()
+    _transport, _async_transport = transport, async_transport
+    _async_clients.clear()
+
+
+def get_client() -> httpx.Client:
+    """The process-wide pooled client"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(
+                    http2=HTTP2, verify=HTTP_VERIFY_SSL, limits=_limits(), timeout=endpoint_timeout(""),
+                    transport=_transport,
+                )
+    return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """The pooled async client of the running event loop (connections can't move between loops)"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        # Drop the clients of loops that are gone
+        for stale in [other for other in _async_clients if other.is_closed()]:
+            del _async_clients[stale]
+        client = _async_clients[loop] = httpx.AsyncClient(
+            http2=HTTP2, verify=HTTP_VERIFY_SSL, limits=_limits(), timeout=endpoint_timeout(""),
+            transport=_async_transport,
+        )
+    return client
+
+
+def request(method, url, *, timeout=None, retries=HTTP_RETRIES, idempotent=None, **kwargs) -> httpx.Response:
+    """
+    Send a request through the pooled client, retrying as described above.
+    `timeout` overrides the endpoint's read timeout and `idempotent` whether
+    a request that may have run is safe to send again (by default, from the
+    method). Other keyword arguments go to httpx.Client.request.
+    """
+    client = get_client()
+    timeout = endpoint_timeout(url, timeout)
+    for attempt in range(retries + 1):
+        try:
+            response = client.request(method, url, timeout=timeout, **kwargs)
+        except httpx.TransportError as e:
+            if attempt == retries or not _should_retry(method, idempotent, error=e):
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        if attempt == retries or not _should_retry(method, idempotent, response=response):
+            return response
+        response.close()
+        time.sleep(backoff_delay(attempt, response))
+
+
+async def arequest(method, url, *, timeout=None, retries=HTTP_RETRIES, idempotent=None, **kwargs) -> httpx.Response:
+    """Async version of request()"""
+    client = get_async_client()
+    timeout = endpoint_timeout(url, timeout)
+    for attempt in range(retries + 1):
+        try:
+            response = await client.request(method, url, timeout=timeout, **kwargs)
+        except httpx.TransportError as e:
+            if attempt == retries or not _should_retry(method, idempotent, error=e):
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+        if attempt == retries or not _should_retry(method, idempotent, response=response):
+            return response
+        await response.aclose()
+        await asyncio.sleep(backoff_delay(attempt, response))
+
+
+def close():
+    """Close the pooled sync client"""
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+async def aclose():
+    """Close the pooled async client of the running event loop"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
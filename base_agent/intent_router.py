@@ -0,0 +1,422 @@
+"""
+Local intent router for the common question types.
+
+Most questions are one of a few known shapes ("What actors were in Chocolat
+Harry?", "Top 3 actors in the Children category", ...) that a single
+endpoint answers. The router answers those without the LLM:
+
+- keyword patterns propose the intents a question may be, and pull the
+  endpoint's parameters (film title, category, counts, filters) out of it
+- a nearest-neighbour classifier over labelled questions confirms one: the
+  intents' examples plus the agent evaluation cases (see eval_cases.py),
+  where cases no intent can answer are examples of questions for the LLM.
+  It uses the semantic cache's hashing vectorizer, so it is built in
+  milliseconds, on CPU, when the router is created.
+
+A question that no pattern matches, that asks for more than one thing (two
+sentences, a conjunction, "... with their film titles"), that lacks a
+required parameter, whose film title is a category ("comedies") or no real
+film (checked against the API's titles once they are fetched), that scores
+under INTENT_ROUTER_THRESHOLD or that is closer to a question for the LLM
+falls back to the LLM agent, as does any failed API call: one endpoint call
+would silently drop the rest.
+"""
+
+import json
+import os
+import re
+from datetime import date, timedelta
+from difflib import get_close_matches
+
+from eval_cases import EVAL_CASES
+from semantic_cache import CATEGORIES, cosine, embed
+
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Minimum similarity to an intent's labelled questions for it to be answered locally
+INTENT_ROUTER_THRESHOLD = float(os.getenv("INTENT_ROUTER_THRESHOLD", "0.45"))
+
+# Label of the questions left to the LLM
+FALLBACK = "llm"
+
+CATEGORY = re.compile(
+    r"\b(" + "|".join(re.escape(name) for name in CATEGORIES) + r"|science fiction|scifi)\b", re.IGNORECASE
+)
+# Category names as a question may say them ("comedies", "dramas"): never a film title
+GENRE_WORDS = {name.lower() for name in CATEGORIES} | {
+    name.lower()[:-1] + "ies" if name.endswith("y") else name.lower() + "s"
+    for name in CATEGORIES if not name.endswith("s")
+} | {"science fiction", "scifi"}
+# How close a title with a typo must be to a real one ("Chocolat Hary")
+TITLE_CUTOFF = 0.8
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+COUNT = re.compile(r"\b(?:top|first|best|bottom|last|the)\s+(\d{1,3}|" + "|".join(NUMBER_WORDS) + r")\b",
+                   re.IGNORECASE)
+QUOTED = re.compile(r"[\"“'‘](?P<text>[^\"”'’]{2,}?)[\"”'’](?:\s|[?.!,]|$)")
+# Where a clause ends: a title stops there, and a question going on past one asks for more
+CLAUSE_END = r"(?:[?!.,;:]|\b(?:and|or|but|also|plus|then|with|when|where|why|how|who|which|what|that|as well as|" \
+             r"along with|together with|including)\b)"
+FILM_TITLE = (
+    re.compile(r"\b(?:in|of|from|for)\s+(?:the\s+)?(?:film|movie)\s+(?P<text>.+?)\s*(?=" + CLAUSE_END + r"|$)",
+               re.IGNORECASE),
+    re.compile(r"\b(?:actors?|cast|starred|stars|acted|appeared|played|were|was)\b.*?\b(?:in|of|from)\s+"
+               r"(?:the\s+)?(?P<text>.+?)\s*(?=" + CLAUSE_END + r"|$)", re.IGNORECASE),
+)
+# Conjunctions and extra clauses: asks for more than one endpoint call answers
+COMPOUND = re.compile(r"(?:[,;:]|\b(?:and|or|but|also|plus|then|when|where|why|as well as|along with|together with|"
+                      r"including|with (?:their|its|his|her|the|each|all))\b)", re.IGNORECASE)
+# "... and ..." that still asks one thing of one endpoint
+SINGLE_ASK = re.compile(r"\bbetween\s+\d{4}-\d{2}-\d{2}\s+and\s+\d{4}-\d{2}-\d{2}\b"
+                        r"|\b(?:most|top|highest)\s+and\s+(?:the\s+)?(?:least|bottom|lowest)\b", re.IGNORECASE)
+DISTRICT = re.compile(r"\bdistrict\s+(?:of\s+)?(?:[\"'](?P<quoted>[^\"']+)[\"']|(?P<name>[A-Z][\w-]*(?:\s+[A-Z][\w-]*)*))")
+STORE = re.compile(r"\bstore\s*(?:#|id|number|no\.?)?\s*(\d+)\b", re.IGNORECASE)
+DATE = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+END_DATE = re.compile(r"\b(before|until|till|up to|through|to)\s+$", re.IGNORECASE)
+
+
+def count(question, default=None):
+    """The number of results asked for ("top 3", "the five ..."), or `default`"""
+    match = COUNT.search(question)
+    if match is None:
+        return default
+    value = match.group(1).lower()
+    return NUMBER_WORDS.get(value) or int(value)
+
+
+def category(question):
+    match = CATEGORY.search(question)
+    if match is None:
+        return None
+    name = match.group(1).lower()
+    if name in ("science fiction", "scifi"):
+        return "Sci-Fi"
+    return next(c for c in CATEGORIES if c.lower() == name)
+
+
+def compound(question) -> bool:
+    """Whether `question` asks for more than one thing: several sentences, conjunctions or extra clauses"""
+    text = SINGLE_ASK.sub(" ", QUOTED.sub(" ", question)).strip().rstrip("?!. ")
+    return bool(re.search(r"[?!.]\s+\S", text) or COMPOUND.search(text))
+
+
+def film_title(question):
+    """The film a question is about: quoted, or what follows "actors in ..." / "the film ..." """
+    quoted = QUOTED.search(question)
+    if quoted:
+        return quoted.group("text").strip()
+    for pattern in FILM_TITLE:
+        match = pattern.search(question.strip())
+        if match:
+            title = match.group("text").strip(" ?!.,")
+            if title and not title.lower().startswith(("the most", "most ", "all ", "which ", "what ")):
+                return title
+    return None
+
+
+def is_genre(title) -> bool:
+    """Whether a captured "title" is a category ("comedies", "Horror films")"""
+    words = re.sub(r"\s+(?:films?|movies?)$", "", title.lower().strip())
+    return words in GENRE_WORDS
+
+
+def _actors_in_film_params(question):
+    title = film_title(question)
+    return {"film_title": title} if title else None
+
+
+def _top_actors_params(question):
+    name = category(question)
+    if name is None:
+        return None
+    # "Which actor has appeared in the most Comedy films?" asks for one
+    singular = re.search(r"\bactor\b", question, re.IGNORECASE) and not re.search(r"\bactors\b", question,
+                                                                                    re.IGNORECASE)
+    return {"category_name": name, "limit": count(question, 1 if singular else 3)}
+
+
+def _customer_payments_params(question):
+    params = {"top_count": count(question, 5)}
+    district = DISTRICT.search(question)
+    if district:
+        params["district"] = (district.group("quoted") or district.group("name")).strip()
+    store = STORE.search(question)
+    if store:
+        params["store_id"] = int(store.group(1))
+    dates = DATE.findall(question)
+    if len(dates) >= 2:
+        params["start_date"], params["end_date"] = sorted(dates[:2])
+    elif dates:
+        end = END_DATE.search(question[:question.index(dates[0])])
+        if end is None:
+            params["start_date"] = dates[0]
+        elif end.group(1).lower() == "before":
+            # end_date is inclusive
+            params["end_date"] = (date.fromisoformat(dates[0]) - timedelta(days=1)).isoformat()
+        else:
+            params["end_date"] = dates[0]
+    return params
+
+
+def _category_rentals_params(question):
+    # Rows come most rented first: a question about the least rented needs them all
+    if re.search(r"\b(least|fewest|lowest|bottom)\b", question, re.IGNORECASE):
+        return {}
+    singular = re.search(r"\bcategory\b", question, re.IGNORECASE) and not re.search(r"\bcategories\b", question,
+                                                                                       re.IGNORECASE)
+    limit = count(question, 1 if singular else None)
+    return {"limit": limit} if limit else {}
+
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    return str(int(number)) if number.is_integer() else f"{number:.2f}"
+
+
+def _name(row):
+    return f"{row['first_name']} {row['last_name']}".title()
+
+
+def markdown_table(rows, columns):
+    lines = ["| " + " | ".join(title for _, title in columns) + " |", "|" + "---|" * len(columns)]
+    for row in rows:
+        lines.append("| " + " | ".join(_number(row[key]) if key != "name" else _name(row) for key, _ in columns) + " |")
+    return "\n".join(lines)
+
+
+def _render_actors_in_film(params, data, headers):
+    films = json.loads(headers.get("x-matched-films") or "[]") or [params["film_title"]]
+    if not data:
+        return f"No actors found for a film matching \"{params['film_title']}\"."
+    lines = [f"Actors in {', '.join(title.title() for title in films)}:", ""]
+    lines += [f"- {_name(row)}" for row in sorted(data, key=lambda row: (row["last_name"], row["first_name"]))]
+    return "\n".join(lines)
+
+
+def _render_top_actors(params, data, headers):
+    if not data:
+        return f"No actors found in the {params['category_name']} category."
+    lines = [f"Top {len(data)} actor{'s' if len(data) > 1 else ''} by number of {params['category_name']} films:", ""]
+    lines += [f"{i}. {_name(row)} ({row['film_count']} films)" for i, row in enumerate(data, 1)]
+    return "\n".join(lines)
+
+
+def _render_film_length(params, data, headers):
+    columns = [("year", "Year"), ("film_count", "Films"), ("avg_length", "Average length (min)"),
+               ("min_length", "Shortest"), ("max_length", "Longest")]
+    return "Film lengths by release year:\n\n" + markdown_table(data, columns)
+
+
+def _render_customer_payments(params, data, headers):
+    columns = [("name", "Customer"), ("total_paid", "Total paid"), ("payment_count", "Payments")]
+    filters = [f"{name.replace('_', ' ')} {value}" for name, value in params.items() if name != "top_count"]
+    scope = f" ({', '.join(filters)})" if filters else ""
+    return "\n\n".join([
+        f"Customers who paid the most{scope}:", markdown_table(data["top_customers"], columns),
+        f"Customers who paid the least{scope}:", markdown_table(data["bottom_customers"], columns),
+    ])
+
+
+def _render_category_rentals(params, data, headers):
+    columns = [("category", "Category"), ("rental_count", "Rentals"), ("rented_film_count", "Films rented")]
+    return "Film categories by number of rentals:\n\n" + markdown_table(data, columns)
+
+
+class Intent:
+    """
+    A question type answered by one GET endpoint: `triggers` (all must match)
+    propose it unless one of `excludes` matches, params(question) extracts the endpoint's parameters (None
+    when a required one is missing), render(params, data, headers) writes
+    the answer. `accepts` are the parameters the router can fill in.
+    """
+
+    def __init__(self, name, endpoint, triggers, excludes, params, render, accepts, examples):
+        self.name = name
+        self.endpoint = endpoint
+        self.triggers = [re.compile(trigger, re.IGNORECASE) for trigger in triggers]
+        self.excludes = [re.compile(exclude, re.IGNORECASE) for exclude in excludes]
+        self.params = params
+        self.render = render
+        self.accepts = set(accepts)
+        self.examples = examples
+
+    def matches(self, question) -> bool:
+        return (all(trigger.search(question) for trigger in self.triggers)
+                and not any(exclude.search(question) for exclude in self.excludes))
+
+
+INTENTS = [
+    Intent(
+        "actors_in_film", "search/actors-in-film",
+        [r"\b(actors?|cast|starred|stars|acted|appeared|played)\b"],
+        [r"\b(most|top|never|both|categor(y|ies)|how many)\b"],
+        _actors_in_film_params, _render_actors_in_film, ["film_title"],
+        [
+            "What actors were in Chocolat Harry?",
+            "Who starred in Academy Dinosaur?",
+            "Find actors in CHOCOLAT",
+            "List the cast of the film Ace Goldfinger",
+            "Which actors appeared in the movie 'Alien Center'?",
+            "Who acted in Zorro Ark?",
+        ],
+    ),
+    Intent(
+        "top_actors_by_category", "search/top-actors-by-category",
+        [r"\bactors?\b", r"\b(top|most|best|leading)\b", CATEGORY.pattern],
+        [r"\b(both|never|least|fewest|rented|rentals?|revenue|customers?)\b"],
+        _top_actors_params, _render_top_actors, ["category_name", "limit"],
+        [
+            "Display the top 3 actors who have most appeared in films in the Children category",
+            "Who are the top 5 actors in Horror films?",
+            "Which actors appeared in the most Action movies?",
+            "Top actors by number of Comedy films",
+            "Which actor has been in the most Drama films?",
+        ],
+    ),
+    Intent(
+        "film_length_by_year", "analysis/film-length-by-year",
+        [r"\b(length|lengths|long|longer|shorter|duration|runtime|running time)\b",
+         r"\b(year|years|yearly|over time|trend|trends|release)\b"],
+        [r"\b(rating|categor(y|ies)|actors?|rental duration|language)\b"],
+        lambda question: {}, _render_film_length, [],
+        [
+            "Can you analyze film lengths over time and determine if that criticism is fair",
+            "How has the average film length changed over the years?",
+            "Are films getting longer over time?",
+            "Show the average movie duration by release year",
+            "Film length trend per year",
+        ],
+    ),
+    Intent(
+        "customer_payments", "analysis/customer-payments",
+        [r"\bcustomers?\b", r"\b(paid|pay|pays|paying|payments?|spent|spend|spending|spenders?)\b"],
+        [CATEGORY.pattern, r"\b(average|avg|films?|movies?|actors?|rented|month|monthly)\b"],
+        _customer_payments_params, _render_customer_payments,
+        ["top_count", "start_date", "end_date", "store_id", "district"],
+        [
+            "Which customer has paid the most for rentals? What about least?",
+            "Who are the top 10 paying customers?",
+            "Show the customers who spent the most and the least",
+            "Which customers paid the most between 2022-01-01 and 2022-03-31?",
+            "Top 5 customers by total payments in store 2",
+        ],
+    ),
+    Intent(
+        "category_rentals", "analysis/category-rentals",
+        [r"\bcategor(y|ies)\b", r"\b(rent|rents|rented|rentals?|popular)\b"],
+        [r"\b(average|avg|rate|length|revenue|customers?|actors?|store|month)\b"],
+        _category_rentals_params, _render_category_rentals, ["limit"],
+        [
+            "Which film categories are rented the most?",
+            "How many rentals does each category have?",
+            "What are the 3 most rented categories?",
+            "Rank the film categories by number of rentals",
+            "Which category is rented the least?",
+        ],
+    ),
+]
+
+# Questions the endpoints above can't answer, on top of the unroutable eval cases
+FALLBACK_EXAMPLES = [
+    "Run this SQL query: SELECT count(*) FROM rental",
+    "What tables are in the database and how are they related?",
+    "Show me the database schema diagram",
+    "Which actors have never appeared in a Horror film?",
+    "Which customers rented the most films in the Comedy category?",
+    "What is the average rental duration per category?",
+    "Which store made more money last month?",
+    "What actors appeared in comedies?",
+]
+
+
+def _labelled_questions(intents, cases):
+    """(label, question) pairs: the intents' examples, and the eval cases labelled by their endpoint"""
+    labelled = [(intent.name, example) for intent in intents for example in intent.examples]
+    labelled += [(FALLBACK, example) for example in FALLBACK_EXAMPLES]
+    by_endpoint = {intent.endpoint: intent for intent in intents}
+    for case in cases:
+        intent = by_endpoint.get(case["expected_endpoint"])
+        # A case whose expected parameters the router can't fill in is a question for the LLM
+        if intent is not None and set(case.get("expected_params") or {}) <= intent.accepts:
+            labelled.append((intent.name, case["query"]))
+        else:
+            labelled.append((FALLBACK, case["query"]))
+    return labelled
+
+
+class IntentRouter:
+    """Picks the intent of a question and answers it with one API call, or leaves it to the LLM"""
+
+    def __init__(self, intents=INTENTS, cases=EVAL_CASES, threshold=INTENT_ROUTER_THRESHOLD,
+                 enabled=INTENT_ROUTER_ENABLED, titles=None):
+        self.intents = {intent.name: intent for intent in intents}
+        self.threshold = threshold
+        self.enabled = enabled
+        # Lowercased film titles once known (see answer()); until then any non-category title goes
+        self.titles = [title.lower() for title in titles] if titles is not None else None
+        self.examples = [(label, embed(question)) for label, question in _labelled_questions(intents, cases)]
+
+    def scores(self, question):
+        """Similarity of `question` to the closest labelled question of each label"""
+        vector = embed(question)
+        scores = {}
+        for label, example in self.examples:
+            scores[label] = max(scores.get(label, 0.0), cosine(vector, example))
+        return scores
+
+    def known_title(self, title) -> bool:
+        """Whether `title` names a real film: a part of one, or a close misspelling"""
+        if is_genre(title):
+            return False
+        if self.titles is None:
+            return True
+        title = title.lower()
+        return any(title in known for known in self.titles) or bool(
+            get_close_matches(title, self.titles, n=1, cutoff=TITLE_CUTOFF))
+
+    def route(self, question):
+        """
+        {"intent", "endpoint", "params", "confidence"} for a question that can be
+        answered locally, else None
+        """
+        if not self.enabled or compound(question):
+            return None
+        candidates = [intent for intent in self.intents.values() if intent.matches(question)]
+        if not candidates:
+            return None
+        scores = self.scores(question)
+        intent = max(candidates, key=lambda intent: scores.get(intent.name, 0.0))
+        confidence = scores.get(intent.name, 0.0)
+        if confidence < self.threshold or confidence <= scores.get(FALLBACK, 0.0):
+            return None
+        params = intent.params(question)
+        # A film title that isn't one is a question for the LLM ("actors in comedies")
+        if params is None or ("film_title" in params and not self.known_title(params["film_title"])):
+            return None
+        return {"intent": intent.name, "endpoint": intent.endpoint, "params": params,
+                "confidence": round(confidence, 3)}
+
+    def answer(self, question, toolkit):
+        """
+        The route of `question` plus the "answer" written from its API call
+        through `toolkit` (PagilaApiTools), or None to ask the LLM
+        """
+        if self.titles is None and self.enabled:
+            titles = toolkit.film_titles()
+            if titles is not None:
+                self.titles = [title.lower() for title in titles]
+        route = self.route(question)
+        if route is None:
+            return None
+        try:
+            result = json.loads(toolkit.make_request(route["endpoint"], "GET", params=route["params"]))
+            if result.get("error") or "data" not in result:
+                return None
+            headers = {name.lower(): value for name, value in result.get("headers", {}).items()}
+            answer = self.intents[route["intent"]].render(route["params"], result["data"], headers)
+        except (ValueError, KeyError, TypeError):
+            return None
+        return dict(route, answer=answer)
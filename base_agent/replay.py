@@ -0,0 +1,301 @@
+"""
+Offline model and API exchanges for agent runs.
+
+Both the model (OpenRouter, through the OpenAI client) and the Pagila API
+(through http_client.py) speak HTTP via httpx, so recording and replaying
+happens at the transport level and works the same for agents, teams,
+streaming and tool calls. AGENT_REPLAY_MODE picks what is used:
+
+- off (default): live model and API
+- record: live, and every exchange is appended to the AGENT_CASSETTE file
+- replay: exchanges are answered from AGENT_CASSETTE, with no network at all
+- fake: the model is a ScriptedModel (AGENT_FAKE_SCRIPT, a JSON list of
+  replies); API calls are replayed from AGENT_CASSETTE when it exists and
+  go to the live API otherwise
+
+A cassette is gzip-compressed JSON lines, one exchange per line. Requests
+are matched on method, path, query and body, with timestamps blanked out
+(instructions carry the current date). Identical requests are answered in
+the order they were recorded.
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+
+AGENT_REPLAY_MODE = os.getenv("AGENT_REPLAY_MODE", "off")
+AGENT_CASSETTE = os.getenv(
+    "AGENT_CASSETTE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes", "default.jsonl.gz")
+)
+AGENT_FAKE_SCRIPT = os.getenv("AGENT_FAKE_SCRIPT")
+
+# Timestamps that differ between otherwise identical runs
+VOLATILE = re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?([+-]\d{2}:?\d{2}|Z)?")
+# Response headers worth keeping; the rest only bloats the cassette
+KEPT_HEADERS = ("content-type", "retry-after", "etag", "x-")
+
+
+class CassetteMiss(httpx.TransportError):
+    """A replayed request that was never recorded"""
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, str):
+        return VOLATILE.sub("<timestamp>", value)
+    return value
+
+
+def request_key(request: httpx.Request) -> str:
+    """Stable key of a request: method, path, query and body, without host or timestamps"""
+    url = urlsplit(str(request.url))
+    body = request.content
+    try:
+        body = json.dumps(_normalize(json.loads(body)), sort_keys=True) if body else ""
+    except ValueError:
+        body = VOLATILE.sub("<timestamp>", body.decode("utf-8", "replace"))
+    raw = f"{request.method} {url.path}?{url.query}\n{body}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _encode_body(content: bytes):
+    try:
+        return {"text": content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(content).decode("ascii")}
+
+
+def _decode_body(body) -> bytes:
+    return body["text"].encode("utf-8") if "text" in body else base64.b64decode(body["base64"])
+
+
+class Cassette:
+    """Recorded exchanges, appended to a gzip JSON lines file as they happen"""
+
+    def __init__(self, path=AGENT_CASSETTE):
+        self.path = path
+        self.exchanges = {}
+        self._played = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    exchange = json.loads(line)
+                    self.exchanges.setdefault(exchange["key"], []).append(exchange)
+
+    def record(self, request: httpx.Request, response: httpx.Response, content: bytes):
+        exchange = {
+            "key": request_key(request),
+            "method": request.method,
+            "url": str(request.url),
+            "status": response.status_code,
+            "headers": {
+                name: value for name, value in response.headers.items()
+                if name.lower().startswith(KEPT_HEADERS)
+            },
+            "body": _encode_body(content),
+        }
+        with self._lock:
+            self.exchanges.setdefault(exchange["key"], []).append(exchange)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Appending a gzip member per exchange keeps the file a valid gzip stream
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(exchange, separators=(",", ":")) + "\n")
+
+    def play(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request)
+        with self._lock:
+            recorded = self.exchanges.get(key)
+            if not recorded:
+                raise CassetteMiss(f"No recorded exchange for {request.method} {request.url} in {self.path}",
+                                   request=request)
+            # Replay repeats in order, then keep answering with the last one
+            index = self._played.get(key, 0)
+            self._played[key] = index + 1
+            exchange = recorded[min(index, len(recorded) - 1)]
+        return httpx.Response(
+            exchange["status"], headers=exchange["headers"], content=_decode_body(exchange["body"]), request=request
+        )
+
+
+def _buffered(response, content):
+    """
+    A response carrying `content`, the already read (and decoded) body of
+    `response`; recording buffers whole responses, streamed ones included
+    """
+    headers = [(name, value) for name, value in response.headers.items()
+               if name.lower() not in ("content-encoding", "content-length", "transfer-encoding")]
+    return httpx.Response(response.status_code, headers=headers, content=content, extensions=response.extensions)
+
+
+class RecordingTransport(httpx.BaseTransport):
+    def __init__(self, cassette, transport=None):
+        self.cassette = cassette
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request):
+        response = self.transport.handle_request(request)
+        content = response.read()
+        self.cassette.record(request, response, content)
+        return _buffered(response, content)
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette, transport=None):
+        self.cassette = cassette
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request):
+        response = await self.transport.handle_async_request(request)
+        content = await response.aread()
+        self.cassette.record(request, response, content)
+        return _buffered(response, content)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class ReplayTransport(httpx.BaseTransport):
+    def __init__(self, cassette):
+        self.cassette = cassette
+
+    def handle_request(self, request):
+        return self.cassette.play(request)
+
+
+class AsyncReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette):
+        self.cassette = cassette
+
+    async def handle_async_request(self, request):
+        return self.cassette.play(request)
+
+
+class ScriptedModel(httpx.BaseTransport):
+    """
+    Deterministic stand-in for an OpenAI-compatible chat completions API.
+
+    Replies are taken from `script` in order (the last one repeats). A reply
+    is either a string, answered as assistant text, or
+    {"tool_calls": [{"name": ..., "arguments": {...}}]}, answered as a tool
+    call turn. Streaming and non-streaming requests are both supported.
+    """
+
+    def __init__(self, script=None, model="fake-model"):
+        self.script = list(script or ["This is a scripted answer from the offline fake model."])
+        self.model = model
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def next_reply(self):
+        with self._lock:
+            reply = self.script[min(self.calls, len(self.script) - 1)]
+            self.calls += 1
+            return reply, self.calls
+
+    def handle_request(self, request):
+        body = json.loads(request.content or b"{}")
+        reply, number = self.next_reply()
+        if isinstance(reply, str):
+            message, finish_reason = {"role": "assistant", "content": reply}, "stop"
+        else:
+            message = {"role": "assistant", "content": None, "tool_calls": [
+                {"id": f"call_{number}_{i}", "type": "function",
+                 "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments", {}))}}
+                for i, call in enumerate(reply["tool_calls"])
+            ]}
+            finish_reason = "tool_calls"
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        base = {"id": f"fake-{number}", "created": 0, "model": self.model}
+
+        if not body.get("stream"):
+            completion = dict(base, object="chat.completion", usage=usage,
+                              choices=[{"index": 0, "message": message, "finish_reason": finish_reason}])
+            return httpx.Response(200, json=completion, request=request)
+
+        delta = dict(message)
+        if delta.get("tool_calls"):
+            delta["tool_calls"] = [dict(call, index=i) for i, call in enumerate(delta["tool_calls"])]
+        chunks = [
+            dict(base, object="chat.completion.chunk",
+                 choices=[{"index": 0, "delta": delta, "finish_reason": None}]),
+            dict(base, object="chat.completion.chunk", usage=usage,
+                 choices=[{"index": 0, "delta": {}, "finish_reason": finish_reason}]),
+        ]
+        events = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=events.encode(),
+                              request=request)
+
+
+def load_script(path=AGENT_FAKE_SCRIPT):
+    if not path:
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+_cassette = None
+_fake_model = None
+_lock = threading.Lock()
+
+
+def cassette() -> Cassette:
+    global _cassette
+    with _lock:
+        if _cassette is None:
+            _cassette = Cassette(AGENT_CASSETTE)
+    return _cassette
+
+
+def fake_model() -> ScriptedModel:
+    """The scripted model, shared by every agent so the script plays once across a team"""
+    global _fake_model
+    with _lock:
+        if _fake_model is None:
+            _fake_model = ScriptedModel(load_script())
+    return _fake_model
+
+
+def offline() -> bool:
+    """Whether model calls stay on this machine (and need no rate limiting)"""
+    return AGENT_REPLAY_MODE in ("replay", "fake")
+
+
+def model_http_client():
+    """httpx client for the models (OpenRouter(http_client=...)), or None for the SDK's default"""
+    if AGENT_REPLAY_MODE == "record":
+        return httpx.Client(transport=RecordingTransport(cassette()))
+    if AGENT_REPLAY_MODE == "replay":
+        return httpx.Client(transport=ReplayTransport(cassette()))
+    if AGENT_REPLAY_MODE == "fake":
+        return httpx.Client(transport=fake_model())
+    return None
+
+
+def api_transports():
+    """(sync, async) transports for the Pagila API client, or (None, None) for the network"""
+    if AGENT_REPLAY_MODE == "record":
+        return RecordingTransport(cassette()), AsyncRecordingTransport(cassette())
+    if AGENT_REPLAY_MODE == "replay" or (AGENT_REPLAY_MODE == "fake" and os.path.exists(AGENT_CASSETTE)):
+        return ReplayTransport(cassette()), AsyncReplayTransport(cassette())
+    return None, None
+
+
+def install():
+    """Route the Pagila API client (http_client.py) through the transports of AGENT_REPLAY_MODE"""
+    import http_client
+
+    http_client.configure(*api_transports())
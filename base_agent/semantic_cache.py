@@ -0,0 +1,242 @@
+"""
+Semantic answer cache for the Pagila agents.
+
+Questions are embedded locally with a signed hashing vectorizer (words, word
+bigrams and character trigrams; no model download, CPU only) and compared by
+cosine similarity with the questions answered before. A close enough earlier
+question that was answered against the same API data version is served from
+the cache instead of going through the LLM and its tool calls again.
+
+Bag-of-words similarity can't tell "top actors in Children" from "top actors
+in Comedy", nor the most paying customers from the least paying ones, so a
+question's key terms must also match exactly for a hit: its numbers,
+capitalized names, known category and film names (in any case) and its
+polarity and comparison words (most/least, longer/shorter, never/not, ...).
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+
+SEMANTIC_CACHE_PATH = os.getenv(
+    "SEMANTIC_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".semantic_cache.json")
+)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", str(7 * 24 * 3600)))
+
+VECTOR_DIMENSIONS = 2 ** 16
+
+STOP_WORDS = {
+    "a", "about", "an", "and", "are", "as", "at", "be", "by", "can", "could", "did", "do", "does", "for",
+    "from", "give", "have", "how", "i", "in", "is", "it", "me", "of", "on", "or", "please", "show", "tell",
+    "that", "the", "their", "them", "there", "these", "this", "to", "us", "was", "we", "were", "what",
+    "which", "who", "with", "would", "you",
+}
+
+CATEGORIES = (
+    "Action", "Animation", "Children", "Classics", "Comedy", "Documentary", "Drama", "Family", "Foreign",
+    "Games", "Horror", "Music", "New", "Sci-Fi", "Sports", "Travel",
+)
+
+# Words that flip or direct what a question asks for while barely moving its vector
+POLARITY_WORDS = {
+    "most", "least", "more", "less", "fewer", "fewest", "top", "bottom", "best", "worst", "first", "last",
+    "highest", "lowest", "high", "low", "max", "maximum", "min", "minimum", "largest", "smallest",
+    "biggest", "longest", "shortest", "longer", "shorter", "oldest", "newest", "earliest", "latest",
+    "before", "after", "above", "below", "over", "under", "ascending", "descending", "asc", "desc",
+    "never", "not", "no", "without", "none",
+}
+
+# Feature weights: whole words dominate, trigrams absorb plurals and typos
+WORD_WEIGHT = 1.0
+BIGRAM_WEIGHT = 0.5
+TRIGRAM_WEIGHT = 0.3
+
+
+def tokenize(question):
+    return [token for token in re.findall(r"[a-z0-9]+", question.lower()) if token not in STOP_WORDS]
+
+
+def names_pattern(names):
+    """Regex finding any of `names` as whole words, in any case (longest names first)"""
+    names = sorted({name.lower() for name in names if name}, key=len, reverse=True)
+    if not names:
+        return None
+    return re.compile(r"(?<![a-z0-9])(" + "|".join(re.escape(name) for name in names) + r")(?![a-z0-9])")
+
+
+CATEGORY_NAMES = names_pattern(CATEGORIES)
+
+
+def key_terms(question, names=CATEGORY_NAMES):
+    """
+    Terms that must match exactly: numbers, capitalized names (not counting
+    sentence-initial words), the known `names` found in the question and its
+    polarity words ("hasn't" counts as "not")
+    """
+    terms = set()
+    for sentence in re.split(r"[.?!]+", question):
+        words = re.findall(r"[A-Za-z0-9]+", sentence)
+        terms.update(word for word in words if word.isdigit())
+        terms.update(word.lower() for word in words[1:] if word[0].isupper() and word.lower() not in STOP_WORDS)
+    lowered = question.lower().replace("’", "'")
+    if names is not None:
+        terms.update(match.group(1) for match in names.finditer(lowered))
+    terms.update(word for word in re.findall(r"[a-z]+", lowered) if word in POLARITY_WORDS)
+    if re.search(r"[a-z]n't\b", lowered):
+        terms.add("not")
+    return sorted(terms)
+
+
+def _features(tokens):
+    for token in tokens:
+        yield "w:" + token, WORD_WEIGHT
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            yield "c:" + padded[i:i + 3], TRIGRAM_WEIGHT
+    for first, second in zip(tokens, tokens[1:]):
+        yield f"b:{first} {second}", BIGRAM_WEIGHT
+
+
+def embed(question):
+    """L2-normalized sparse vector {dimension: weight} of a question"""
+    vector = {}
+    for feature, weight in _features(tokenize(question)):
+        digest = zlib.crc32(feature.encode())
+        # The top bit picks the sign so colliding features tend to cancel out
+        sign = -1.0 if digest & 0x80000000 else 1.0
+        index = digest % VECTOR_DIMENSIONS
+        vector[index] = vector.get(index, 0.0) + sign * weight
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    return {index: value / norm for index, value in vector.items() if value} if norm else {}
+
+
+def cosine(left, right):
+    if len(left) > len(right):
+        left, right = right, left
+    return sum(value * right.get(index, 0.0) for index, value in left.items())
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache of answers, persisted as JSON.
+
+    `load_names` returns more names that must match exactly (e.g. the film
+    titles), or None while they can't be had; it is called until it
+    succeeds. Entries stored before the names were known simply miss.
+    """
+
+    def __init__(self, path=SEMANTIC_CACHE_PATH, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES, ttl=SEMANTIC_CACHE_TTL, load_names=None):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = []
+        self.hits = 0
+        self.misses = 0
+        self.load_names = load_names
+        self.names = CATEGORY_NAMES
+        self._lock = threading.Lock()
+        self._load()
+
+    def key_terms(self, question):
+        if self.load_names is not None:
+            names = self.load_names()
+            if names is not None:
+                self.names = names_pattern(list(CATEGORIES) + list(names))
+                self.load_names = None
+        return key_terms(question, self.names)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        for entry in entries:
+            entry["vector"] = {int(index): value for index, value in entry["vector"].items()}
+        self.entries = entries
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, question, data_version=None):
+        """
+        Best cached entry for `question` above the similarity threshold, or
+        None. With a data_version, entries computed against another version
+        don't count.
+        """
+        vector = embed(question)
+        terms = self.key_terms(question)
+        now = time.time()
+        best, best_score = None, self.threshold
+        with self._lock:
+            for entry in self.entries:
+                if now - entry["created_at"] > self.ttl or entry["key_terms"] != terms:
+                    continue
+                if data_version is not None and entry["data_version"] != data_version:
+                    continue
+                score = cosine(vector, entry["vector"])
+                if score >= best_score:
+                    best, best_score = entry, score
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {
+            "answer": best["answer"],
+            "question": best["question"],
+            "similarity": round(best_score, 4),
+            "data_version": best["data_version"],
+            "created_at": best["created_at"],
+        }
+
+    def store(self, question, answer, data_version=None):
+        entry = {
+            "question": question,
+            "vector": embed(question),
+            "key_terms": self.key_terms(question),
+            "answer": answer,
+            "data_version": data_version,
+            "created_at": time.time(),
+        }
+        with self._lock:
+            now = time.time()
+            self.entries = [e for e in self.entries if now - e["created_at"] <= self.ttl]
+            self.entries.append(entry)
+            del self.entries[:-self.max_entries]
+            self._save()
+
+    def answer(self, question, run, data_version=None):
+        """
+        Cached answer for `question`, or the result of `run(question)` (then
+        cached). Returns {"answer", "cached", "data_version", ...}.
+        """
+        hit = self.lookup(question, data_version)
+        if hit is not None:
+            return dict(hit, cached=True)
+        answer = run(question)
+        self.store(question, answer, data_version)
+        return {"answer": answer, "cached": False, "data_version": data_version}
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
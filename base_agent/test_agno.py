@@ -4,14 +4,18 @@ from agno.agent import Agent
 from agno.models.openrouter import OpenRouter
 from agno.agent import Agent, RunResponse
 
+import http_client
+import replay
 
-import requests
 import json
 from pprint import pprint
 
 # Base URL of your API
 BASE_URL = "http://127.0.0.1:8000"
 
+# Live, recorded, replayed or scripted model and API exchanges (AGENT_REPLAY_MODE, see replay.py)
+replay.install()
+
 def print_section(title):
     """Print a section header"""
     print("\n" + "=" * 50)
@@ -24,10 +28,7 @@ def test_endpoint(endpoint, params=None):
     print(f"Making request to: {url}")
     
     try:
-        if params:
-            response = requests.get(url, params=params)
-        else:
-            response = requests.get(url)
+        response = http_client.request("GET", url, params=params)
         
         if response.status_code == 200:
             print(f"Status: ✅ {response.status_code} OK")
@@ -41,7 +42,7 @@ def test_endpoint(endpoint, params=None):
         return None
 
 agent = Agent(
-    model=OpenRouter(id="openai/gpt-4o-2024-11-20"),
+    model=OpenRouter(id="openai/gpt-4o-2024-11-20", http_client=replay.model_http_client()),
     # tools=[
     #     ReasoningTools(add_instructions=True),  # Add reasoning capabilities
     #     # CustomApiTools(base_url=API_BASE_URL),  # For making API calls to our FastAPI server
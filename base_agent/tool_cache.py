@@ -0,0 +1,120 @@
+"""
+Memoization of Pagila API tool calls.
+
+Within an agent run the researcher often repeats a call (the schema first,
+then again after a failed query). Results of calls that can't change the
+database are kept in a bounded LRU with a TTL and reused. GET calls are
+cacheable. /execute-query is cacheable only when its SQL is a single
+read-only statement, and /batch only when every call in it is cacheable.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "256"))
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "300"))
+
+READ_ONLY_STATEMENT = re.compile(r"^\s*(select|with|values|table|show|explain)\b", re.IGNORECASE)
+# Anything that writes, locks or has side effects, anywhere in the statement
+SIDE_EFFECTS = re.compile(
+    r"\b(insert|update|delete|merge|create|drop|alter|truncate|grant|revoke|copy|call|do|lock|vacuum|analyze|"
+    r"refresh|reindex|cluster|comment|nextval|setval|pg_advisory\w*|pg_terminate_backend|pg_cancel_backend|"
+    r"set_config|for\s+(update|share|no\s+key\s+update|key\s+share))\b",
+    re.IGNORECASE,
+)
+COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+STRING_LITERALS = re.compile(r"'(?:[^']|'')*'")
+
+
+def is_read_only_sql(sql) -> bool:
+    """True for a single statement that can't change anything (string contents are ignored)"""
+    if not isinstance(sql, str):
+        return False
+    statement = STRING_LITERALS.sub("''", COMMENTS.sub(" ", sql)).strip().rstrip(";")
+    if ";" in statement or not READ_ONLY_STATEMENT.match(statement):
+        return False
+    return SIDE_EFFECTS.search(statement) is None
+
+
+def is_cacheable(endpoint, method="GET", json_data=None) -> bool:
+    path = endpoint.strip("/")
+    if method == "GET":
+        return True
+    if method != "POST" or not isinstance(json_data, dict):
+        return False
+    if path == "execute-query":
+        # Templates are only ever made from read-only queries
+        if json_data.get("query") is None:
+            return bool(json_data.get("template_id"))
+        return is_read_only_sql(json_data.get("query"))
+    if path == "batch":
+        items = json_data.get("requests") or []
+        return bool(items) and all(
+            isinstance(item, dict)
+            and is_cacheable(item.get("endpoint", ""), item.get("method", "GET"), item.get("json_data"))
+            for item in items
+        )
+    return False
+
+
+def cache_key(endpoint, method="GET", params=None, json_data=None) -> str:
+    return json.dumps([method, endpoint.strip("/"), params or {}, json_data], sort_keys=True, default=str)
+
+
+class ToolCallCache:
+    """Bounded LRU of tool results with a TTL and per-run and lifetime hit counters"""
+
+    def __init__(self, max_entries=TOOL_CACHE_MAX_ENTRIES, ttl=TOOL_CACHE_TTL, across_runs=False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.across_runs = across_runs
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._run = {"hits": 0, "misses": 0}
+        self._total = {"hits": 0, "misses": 0}
+
+    def start_run(self):
+        """Reset the per-run counters (and the entries, unless they are shared across runs)"""
+        with self._lock:
+            if not self.across_runs:
+                self._entries.clear()
+            self._run = {"hits": 0, "misses": 0}
+
+    def _count(self, outcome):
+        self._run[outcome] += 1
+        self._total[outcome] += 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self._entries.pop(key, None)
+                self._count("misses")
+                return None
+            self._entries.move_to_end(key)
+            self._count("hits")
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _with_rate(counters):
+        lookups = counters["hits"] + counters["misses"]
+        return dict(counters, hit_rate=counters["hits"] / lookups if lookups else 0.0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "run": self._with_rate(self._run),
+                "total": self._with_rate(self._total),
+            }
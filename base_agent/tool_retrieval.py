@@ -0,0 +1,109 @@
+"""
+Per-question endpoint selection from the API's tool catalog.
+
+The Pagila API publishes its endpoints as a compact catalog generated from
+its routes (GET /tools/catalog). Instead of pasting every endpoint into
+every prompt, the agents get a one-line description of the few endpoints
+closest to the question: the catalog entries are embedded locally with the
+semantic cache's hashing vectorizer and ranked by cosine similarity. The
+generic fallbacks (custom SQL, its cached templates and the schema) are
+always offered.
+"""
+
+import os
+import threading
+import time
+
+import httpx
+
+import http_client
+from semantic_cache import cosine, embed
+
+TOOL_CATALOG_TOP_K = int(os.getenv("TOOL_CATALOG_TOP_K", "4"))
+# How long the fetched catalog is used before it is revalidated (with its ETag)
+TOOL_CATALOG_TTL = float(os.getenv("TOOL_CATALOG_TTL", "3600"))
+
+ALWAYS_INCLUDED = ("execute-query", "sql-templates", "database/schema")
+
+
+def render_param(name, spec) -> str:
+    text = f"{name}:{spec['type']}"
+    if spec.get("required"):
+        return text + "!"
+    if "default" in spec:
+        return f"{text}={spec['default']}"
+    return text
+
+
+def render_tool(tool) -> str:
+    """One line per tool, e.g. GET /search/actors-in-film params(film_title:str!, shape:...=records) - summary"""
+    parts = [f"{tool['method']} /{tool['endpoint']}"]
+    for field in ("params", "json_data"):
+        if tool.get(field):
+            parts.append(f"{field}(" + ", ".join(render_param(n, s) for n, s in tool[field].items()) + ")")
+    return " ".join(parts) + f" - {tool['summary']}"
+
+
+def tool_text(tool) -> str:
+    """What a tool is matched on: its path words, summary, examples and parameter names"""
+    words = tool["endpoint"].replace("/", " ").replace("-", " ")
+    names = " ".join(list(tool.get("params", {})) + list(tool.get("json_data", {})))
+    return " ".join([words, tool["summary"], *tool.get("examples", []), names.replace("_", " ")])
+
+
+class ToolCatalogClient:
+    """Fetches the catalog of the API at base_url and picks the endpoints for a question"""
+
+    def __init__(self, base_url, top_k=TOOL_CATALOG_TOP_K, ttl=TOOL_CATALOG_TTL):
+        self.base_url = base_url.rstrip("/")
+        self.top_k = top_k
+        self.ttl = ttl
+        # (tools, vectors), replaced as a whole
+        self._index = ([], [])
+        self._etag = None
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def tools(self):
+        """The catalog tools, fetched when missing or older than the TTL (the last good copy on errors)"""
+        if self._fetched_at is not None and time.monotonic() - self._fetched_at < self.ttl:
+            return self._index[0]
+        # Never wait here: another thread is already fetching, use what is there
+        if not self._lock.acquire(blocking=False):
+            return self._index[0]
+        try:
+            headers = {"Accept": "application/json"}
+            if self._etag:
+                headers["If-None-Match"] = self._etag
+            response = http_client.request("GET", f"{self.base_url}/tools/catalog", headers=headers)
+            if response.status_code == 200:
+                tools = response.json()["tools"]
+                self._index = (tools, [embed(tool_text(tool)) for tool in tools])
+                self._etag = response.headers.get("etag")
+            if response.status_code in (200, 304):
+                self._fetched_at = time.monotonic()
+        except (httpx.HTTPError, ValueError, KeyError):
+            pass
+        finally:
+            self._lock.release()
+        return self._index[0]
+
+    def select(self, question, top_k=None):
+        """The top_k tools closest to `question` plus the fallbacks, in catalog order"""
+        self.tools()
+        tools, vectors = self._index
+        vector = embed(question)
+        ranked = sorted(range(len(tools)), key=lambda i: cosine(vector, vectors[i]), reverse=True)
+        chosen = set(ranked[:top_k or self.top_k])
+        chosen.update(i for i, tool in enumerate(tools) if tool["endpoint"] in ALWAYS_INCLUDED)
+        return [tools[i] for i in sorted(chosen)]
+
+    def instructions(self, question):
+        """Prompt lines describing the endpoints to use for `question`"""
+        tools = self.select(question)
+        if not tools:
+            return ["The API's tool catalog is unavailable: call GET /tools/catalog to list the endpoints."]
+        return [
+            "Endpoints for this question (! = required; params go in 'params', POST bodies in 'json_data'):",
+            *(f"- {render_tool(tool)}" for tool in tools),
+        ]
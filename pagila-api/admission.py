@@ -0,0 +1,188 @@
+"""
+EXPLAIN-based admission control for agent-written SQL.
+
+Before /execute-query runs a statement, its plan is estimated with
+EXPLAIN (FORMAT JSON). Plans over the hard cost/row limits are rejected with a
+structured reason and concrete rewrite suggestions; plans over the queue cost
+threshold wait for one of a few "heavy query" slots before running.
+"""
+
+import asyncio
+import json
+import os
+
+from sqlalchemy import text
+
+EXPLAIN_MAX_COST = float(os.getenv("EXPLAIN_MAX_COST", "500000"))
+EXPLAIN_MAX_ROWS = float(os.getenv("EXPLAIN_MAX_ROWS", "1000000"))
+EXPLAIN_QUEUE_COST = float(os.getenv("EXPLAIN_QUEUE_COST", "50000"))
+EXPLAIN_QUEUE_CONCURRENCY = int(os.getenv("EXPLAIN_QUEUE_CONCURRENCY", "2"))
+EXPLAIN_QUEUE_TIMEOUT = float(os.getenv("EXPLAIN_QUEUE_TIMEOUT", "10"))
+
+# Sequential scans estimated above this many rows get an "indexed column" hint
+LARGE_SCAN_ROWS = 10000
+
+INDEXED_COLUMNS_QUERY = text("""
+    SELECT DISTINCT c.relname, a.attname
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+    WHERE n.nspname = 'public' AND c.relname = ANY(:tables)
+    ORDER BY c.relname, a.attname
+""")
+
+
+class QueryRejected(Exception):
+    """Raised with a structured, agent-readable reason when a plan is refused"""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail["reason"])
+        self.status_code = status_code
+        self.detail = detail
+
+
+def explain(connection, sql, params):
+    """
+    Return the JSON plan of `sql`, or None when it can't be explained
+    (e.g. SHOW). Runs in a savepoint so a failure doesn't abort the
+    surrounding transaction.
+    """
+    savepoint = connection.begin_nested()
+    try:
+        plan = connection.execute(text("EXPLAIN (FORMAT JSON) " + sql), params).scalar()
+    except Exception:
+        savepoint.rollback()
+        return None
+    savepoint.commit()
+    # psycopg2 decodes json columns, asyncpg hands back the text
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def indexed_columns(connection, tables):
+    columns = {}
+    for table, column in connection.execute(INDEXED_COLUMNS_QUERY, {"tables": list(tables)}):
+        columns.setdefault(table, []).append(column)
+    return columns
+
+
+def _walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def _relation(node):
+    """Relation a plan node reads, looking through wrappers like Materialize or Hash"""
+    while "Relation Name" not in node and len(node.get("Plans", [])) == 1:
+        node = node["Plans"][0]
+    return node.get("Relation Name", node["Node Type"])
+
+
+def analyze_plan(plan):
+    """Summarize a JSON plan: estimated cost/rows and the patterns worth flagging"""
+    root = plan[0]["Plan"]
+    nodes = list(_walk(root))
+    cross_joins = []
+    for node in nodes:
+        if node["Node Type"] != "Nested Loop" or "Join Filter" in node:
+            continue
+        children = node.get("Plans", [])
+        if not any("Index Cond" in child or "Filter" in child for child in children):
+            cross_joins.append([_relation(child) for child in children])
+    return {
+        "estimated_cost": root["Total Cost"],
+        "estimated_rows": root["Plan Rows"],
+        "has_limit": root["Node Type"] == "Limit",
+        "cross_joins": cross_joins,
+        "large_scans": sorted({
+            node["Relation Name"]
+            for node in nodes
+            if node["Node Type"] == "Seq Scan" and node["Plan Rows"] >= LARGE_SCAN_ROWS
+        }),
+    }
+
+
+def suggestions(summary, indexes):
+    """Concrete rewrites the agent can apply to get the query admitted"""
+    hints = []
+    for relations in summary["cross_joins"]:
+        hints.append({
+            "action": "add_join_condition",
+            "message": f"Join {' and '.join(relations)} on a key column instead of a cross join"
+        })
+    if not summary["has_limit"]:
+        hints.append({
+            "action": "add_limit",
+            "message": "Add a LIMIT (or aggregate the rows) to bound the result size"
+        })
+    for table in summary["large_scans"]:
+        columns = indexes.get(table)
+        hint = {"action": "filter_indexed_column", "table": table}
+        if columns:
+            hint["indexed_columns"] = columns
+            hint["message"] = f"Filter {table} on an indexed column: {', '.join(columns)}"
+        else:
+            hint["message"] = f"Filter {table} to avoid scanning the whole table"
+        hints.append(hint)
+    return hints
+
+
+class AdmissionController:
+    """Rejects or queues expensive plans before they reach the executor"""
+
+    def __init__(self, max_cost=EXPLAIN_MAX_COST, max_rows=EXPLAIN_MAX_ROWS, queue_cost=EXPLAIN_QUEUE_COST,
+                 queue_concurrency=EXPLAIN_QUEUE_CONCURRENCY, queue_timeout=EXPLAIN_QUEUE_TIMEOUT):
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.queue_cost = queue_cost
+        self.queue_timeout = queue_timeout
+        self.heavy_slots = asyncio.Semaphore(queue_concurrency)
+
+    def limits(self):
+        return {"max_cost": self.max_cost, "max_rows": self.max_rows, "queue_cost": self.queue_cost}
+
+    async def admit(self, runner, query):
+        """
+        EXPLAIN `query` on its guarded connection and decide. Returns a release
+        callable (a no-op unless the query took a heavy slot); raises
+        QueryRejected when it must not run.
+        """
+        plan = await runner.call(explain, query.connection, query.sql, query.params)
+        if plan is None:
+            return lambda: None
+
+        summary = analyze_plan(plan)
+        over = []
+        if summary["estimated_cost"] > self.max_cost:
+            over.append(f"estimated cost {summary['estimated_cost']:.0f} exceeds {self.max_cost:.0f}")
+        if summary["estimated_rows"] > self.max_rows:
+            over.append(f"estimated rows {summary['estimated_rows']:.0f} exceed {self.max_rows:.0f}")
+        if over:
+            indexes = {}
+            if summary["large_scans"]:
+                indexes = await runner.call(indexed_columns, query.connection, summary["large_scans"])
+            raise QueryRejected(422, {
+                "error": "query_rejected",
+                "reason": "; ".join(over),
+                "estimated_cost": summary["estimated_cost"],
+                "estimated_rows": summary["estimated_rows"],
+                "limits": self.limits(),
+                "suggestions": suggestions(summary, indexes),
+            })
+
+        if summary["estimated_cost"] <= self.queue_cost:
+            return lambda: None
+        try:
+            await asyncio.wait_for(self.heavy_slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise QueryRejected(503, {
+                "error": "query_queue_full",
+                "reason": f"all heavy-query slots stayed busy for {self.queue_timeout:.0f}s",
+                "estimated_cost": summary["estimated_cost"],
+                "estimated_rows": summary["estimated_rows"],
+                "limits": self.limits(),
+                "suggestions": [{"action": "retry_later", "message": "Retry shortly, or make the query cheaper"}]
+                + suggestions(summary, {}),
+            })
+        return self.heavy_slots.release
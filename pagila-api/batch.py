@@ -0,0 +1,135 @@
+"""
+Batch endpoint support: run several API sub-requests in one round trip.
+
+Each sub-request is dispatched in-process through the ASGI app itself, so it
+goes through the same validation, caching, guards and serialization as a
+normal call and gets its own pooled database session. Sub-requests run
+concurrently, bounded by BATCH_MAX_CONCURRENCY.
+"""
+
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Literal, Optional
+from urllib.parse import urlencode
+
+from pydantic import BaseModel, Field
+
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+# Routes a batch may not call (recursion, admin and operational surfaces)
+BLOCKED_PREFIXES = ("/batch", "/admin", "/metrics", "/docs", "/redoc", "/openapi.json")
+# The only POST route a batch may call
+ALLOWED_POSTS = ("/execute-query",)
+
+
+class BatchItem(BaseModel):
+    endpoint: str
+    method: Literal["GET", "POST"] = "GET"
+    params: Optional[Dict[str, Any]] = None
+    json_data: Optional[Dict[str, Any]] = None
+
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem] = Field(..., min_length=1)
+
+
+def _query_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple)):
+        return [_query_value(v) for v in value]
+    return value
+
+
+def validate_item(item: BatchItem) -> Optional[str]:
+    """Reason the sub-request is not allowed, or None"""
+    path = "/" + item.endpoint.lstrip("/")
+    if path.startswith(BLOCKED_PREFIXES):
+        return f"{path} can't be called from a batch"
+    if item.method == "POST" and path not in ALLOWED_POSTS:
+        return f"POST is only allowed for {', '.join(ALLOWED_POSTS)}"
+    return None
+
+
+async def dispatch(app, item: BatchItem) -> Dict[str, Any]:
+    """Call the app in-process for one sub-request and collect its response"""
+    path = "/" + item.endpoint.lstrip("/")
+    params = {name: _query_value(value) for name, value in (item.params or {}).items() if value is not None}
+    body = json.dumps(item.json_data).encode() if item.json_data is not None else b""
+    headers = [(b"accept", b"application/json"), (b"host", b"batch")]
+    if body:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": item.method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": urlencode(params, doseq=True).encode(),
+        "headers": headers,
+        "client": ("batch", 0),
+        "server": ("batch", 80),
+    }
+
+    done = asyncio.Event()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Only report a disconnect once the response is complete, otherwise
+        # streaming responses would stop early
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    status_code = 500
+    response_headers = {}
+    chunks = []
+
+    async def send(message):
+        nonlocal status_code, response_headers
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+            response_headers = {k.decode().lower(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                done.set()
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        done.set()
+
+    raw = b"".join(chunks)
+    result = {"endpoint": item.endpoint, "status_code": status_code}
+    if "json" in response_headers.get("content-type", ""):
+        result["data"] = json.loads(raw) if raw else None
+    else:
+        result["data"] = raw.decode(errors="replace")
+    return result
+
+
+async def run_batch(app, batch: BatchRequest) -> Dict[str, Any]:
+    """Run all sub-requests concurrently and return their results in order"""
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def run_one(item):
+        reason = validate_item(item)
+        if reason is not None:
+            return {"endpoint": item.endpoint, "status_code": 400, "data": {"detail": reason}}
+        async with semaphore:
+            try:
+                return await dispatch(app, item)
+            except Exception as e:
+                return {"endpoint": item.endpoint, "status_code": 500, "data": {"detail": f"Batch error: {str(e)}"}}
+
+    results = await asyncio.gather(*(run_one(item) for item in batch.requests))
+    return {"results": list(results)}
@@ -0,0 +1,164 @@
+"""
+Fuzzy film title search.
+
+When the pg_trgm extension is available, titles are matched with the trigram
+`%` operator (and ILIKE for substrings), both served by a GIN trigram index on
+film.title. Otherwise an in-process trigram + prefix index over all titles is
+built at startup and used instead.
+"""
+
+import bisect
+import logging
+import re
+from collections import defaultdict
+
+from sqlalchemy import text
+
+from prepared import STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+# Same default as pg_trgm.similarity_threshold
+SIMILARITY_THRESHOLD = 0.3
+
+SETUP_STATEMENTS = [
+    text("CREATE EXTENSION IF NOT EXISTS pg_trgm"),
+    text("CREATE INDEX IF NOT EXISTS film_title_trgm_idx ON film USING gin (title gin_trgm_ops)"),
+]
+
+HAS_TRGM_QUERY = text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+
+TRGM_SEARCH_QUERY = STATEMENTS.register("film_title_search", """
+    SELECT film_id, title, similarity(title, :title) AS score, title ILIKE :pattern AS contains
+    FROM film
+    WHERE title % :title OR title ILIKE :pattern
+    ORDER BY contains DESC, score DESC, film_id
+    LIMIT :limit
+""")
+
+# Every film whose title contains the text: unbounded, unlike the ranked search
+TITLE_CONTAINS_QUERY = STATEMENTS.register("film_title_contains", """
+    SELECT film_id, title
+    FROM film
+    WHERE title ILIKE :pattern
+    ORDER BY film_id
+""")
+
+ALL_TITLES_QUERY = text("SELECT film_id, title FROM film")
+
+
+def _like_pattern(title):
+    escaped = title.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def trigrams(value):
+    """Trigrams the way pg_trgm builds them: per lowercased word, padded with two spaces in front and one behind"""
+    grams = set()
+    for word in re.findall(r"[0-9a-z]+", value.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class LocalTitleIndex:
+    """In-process trigram and prefix index over film titles"""
+
+    def __init__(self, films):
+        self.titles = {}
+        self.grams = {}
+        self.postings = defaultdict(set)
+        for film_id, title in films:
+            self.titles[film_id] = title
+            self.grams[film_id] = trigrams(title)
+            for gram in self.grams[film_id]:
+                self.postings[gram].add(film_id)
+        self.sorted_titles = sorted((title.lower(), film_id) for film_id, title in self.titles.items())
+
+    def _prefix_matches(self, prefix):
+        start = bisect.bisect_left(self.sorted_titles, (prefix,))
+        for lowered, film_id in self.sorted_titles[start:]:
+            if not lowered.startswith(prefix):
+                break
+            yield film_id
+
+    def containing(self, title):
+        query = title.lower()
+        return [{"film_id": film_id, "title": self.titles[film_id]}
+                for film_id in sorted(self.titles) if query in self.titles[film_id].lower()]
+
+    def search(self, title, limit, threshold=SIMILARITY_THRESHOLD):
+        query = title.lower().strip()
+        query_grams = trigrams(title)
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for film_id in self.postings.get(gram, ()):
+                shared[film_id] += 1
+
+        candidates = set(shared) | set(self._prefix_matches(query))
+        matches = []
+        for film_id in candidates:
+            common = shared.get(film_id, 0)
+            union = len(query_grams) + len(self.grams[film_id]) - common
+            score = common / union if union else 0.0
+            contains = bool(query) and query in self.titles[film_id].lower()
+            if contains or score >= threshold:
+                matches.append({
+                    "film_id": film_id,
+                    "title": self.titles[film_id],
+                    "score": round(score, 4),
+                    "contains": contains
+                })
+        matches.sort(key=lambda m: (not m["contains"], -m["score"], m["film_id"]))
+        return matches[:limit]
+
+
+class FilmSearch:
+    """Picks the pg_trgm path or the local index and answers title lookups"""
+
+    def __init__(self):
+        self.mode = None
+        self.local_index = None
+
+    def setup(self, db):
+        """Create the trigram index if possible, otherwise build the local index"""
+        try:
+            for statement in SETUP_STATEMENTS:
+                db.execute(statement)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.info("Could not create the pg_trgm title index: %s", e)
+
+        if db.execute(HAS_TRGM_QUERY).scalar():
+            self.mode = "trigram"
+        else:
+            self.local_index = LocalTitleIndex(db.execute(ALL_TITLES_QUERY).all())
+            self.mode = "local"
+        logger.info("Film title search mode: %s", self.mode)
+        return self.mode
+
+    def containing(self, db, title):
+        """Every film whose title contains `title` (case-insensitive), by film_id"""
+        if self.mode is None:
+            self.setup(db)
+        if self.mode == "local":
+            return self.local_index.containing(title)
+        result = STATEMENTS.execute(db, TITLE_CONTAINS_QUERY, {"pattern": _like_pattern(title)})
+        return [{"film_id": row[0], "title": row[1]} for row in result]
+
+    def search(self, db, title, limit=5):
+        """
+        Ranked matches for `title`: titles containing it first, then by
+        trigram similarity ("Chocolat Harry" finds "CHOCOLATE HARRY").
+        """
+        if self.mode is None:
+            self.setup(db)
+        if self.mode == "local":
+            return self.local_index.search(title, limit)
+        result = STATEMENTS.execute(db, TRGM_SEARCH_QUERY,
+                                    {"title": title, "pattern": _like_pattern(title), "limit": limit})
+        return [
+            {"film_id": row[0], "title": row[1], "score": round(float(row[2]), 4), "contains": row[3]}
+            for row in result
+        ]
@@ -0,0 +1,213 @@
+"""
+Request and SQL timing for the Pagila API.
+
+TimingMiddleware records the latency of every request in a histogram per
+route template (not per raw path, which would make a series per actor id)
+and status code. SQLAlchemy cursor events time the execution of every
+statement, labelled with its registered name (see prepared.py) or its
+leading keyword, and the loops reading server-side cursors report their
+fetch time and row counts. All of it is exported to /metrics.
+
+The SQL work is also added up per request. With SERVER_TIMING on it goes
+back to the client as a Server-Timing header, e.g.
+
+    Server-Timing: db;dur=12.4;desc="3 statements", fetch;dur=1.2, app;dur=15.9
+
+so the agent side can tell the SQL from the rest of the handler and from the
+HTTP hop. For streamed bodies the header leaves with the first chunk and
+covers the work done up to that point.
+"""
+
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from metrics import REGISTRY
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").strip().lower() in ("1", "true", "yes", "on")
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "pagila_http_request_duration_seconds",
+    "Latency of HTTP requests until the response body is complete, per route template",
+    ("method", "route", "status")
+)
+SQL_EXECUTE_SECONDS = REGISTRY.histogram(
+    "pagila_db_statement_execute_seconds",
+    "Time spent executing SQL statements (cursor execute, including buffered rows)",
+    ("statement",)
+)
+SQL_FETCH_SECONDS = REGISTRY.histogram(
+    "pagila_db_statement_fetch_seconds",
+    "Time spent fetching rows from server-side cursors",
+    ("statement",)
+)
+SQL_ROWS = REGISTRY.counter(
+    "pagila_db_statement_rows_total",
+    "Rows returned or affected by SQL statements",
+    ("statement",)
+)
+SQL_ERRORS = REGISTRY.counter(
+    "pagila_db_statement_errors_total",
+    "SQL statements that failed",
+    ("statement",)
+)
+
+LEADING_KEYWORD = re.compile(r"\s*(?:--[^\n]*\n\s*)*(\w+)")
+
+_request_timing = ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    """SQL work of one request; handlers reach it from the threadpool too, hence the lock"""
+
+    def __init__(self):
+        self.statements = 0
+        self.execute_seconds = 0.0
+        self.fetch_seconds = 0.0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def add(self, statements=0, execute_seconds=0.0, fetch_seconds=0.0, rows=0):
+        with self._lock:
+            self.statements += statements
+            self.execute_seconds += execute_seconds
+            self.fetch_seconds += fetch_seconds
+            self.rows += rows
+
+    def merge(self, other):
+        self.add(other.statements, other.execute_seconds, other.fetch_seconds, other.rows)
+
+    def header(self, total_seconds) -> str:
+        with self._lock:
+            return (f'db;dur={self.execute_seconds * 1000:.1f};desc="{self.statements} statements", '
+                    f"fetch;dur={self.fetch_seconds * 1000:.1f}, app;dur={total_seconds * 1000:.1f}")
+
+
+def current_timing():
+    """The RequestTiming of the request being served, or None outside of requests"""
+    return _request_timing.get()
+
+
+def statement_label(sql, execution_options=None) -> str:
+    """Registered statement name when there is one, else the statement's leading keyword"""
+    name = (execution_options or {}).get("statement_name")
+    if name:
+        return name
+    match = LEADING_KEYWORD.match(sql or "")
+    return match.group(1).lower() if match else "unknown"
+
+
+def record_fetch(label, seconds, rows):
+    """Report rows read from a server-side cursor"""
+    SQL_FETCH_SECONDS.observe(seconds, statement=label)
+    SQL_ROWS.inc(rows, statement=label)
+    timing = _request_timing.get()
+    if timing is not None:
+        timing.add(fetch_seconds=seconds, rows=rows)
+
+
+def timed_partitions(partitions, label):
+    """Iterate row chunks, reporting the time spent waiting for each one"""
+    iterator = iter(partitions)
+    while True:
+        started = time.perf_counter()
+        try:
+            rows = next(iterator)
+        except StopIteration:
+            return
+        record_fetch(label, time.perf_counter() - started, len(rows))
+        yield rows
+
+
+async def atimed_partitions(partitions, label):
+    """timed_partitions() for the async result of AsyncConnection.stream()"""
+    iterator = partitions.__aiter__()
+    while True:
+        started = time.perf_counter()
+        try:
+            rows = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        record_fetch(label, time.perf_counter() - started, len(rows))
+        yield rows
+
+
+def instrument_sql(engine):
+    """Time every statement run on `engine` (a sync Engine, or an async engine's sync_engine)"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._pagila_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._pagila_started
+        label = statement_label(statement, context.execution_options)
+        SQL_EXECUTE_SECONDS.observe(elapsed, statement=label)
+        # Server-side cursors don't know their rows yet: record_fetch() counts them
+        rows = 0
+        if not context.execution_options.get("stream_results") and cursor.rowcount is not None:
+            rows = max(cursor.rowcount, 0)
+            SQL_ROWS.inc(rows, statement=label)
+        timing = _request_timing.get()
+        if timing is not None:
+            timing.add(statements=1, execute_seconds=elapsed, rows=rows)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        context = exception_context.execution_context
+        label = statement_label(exception_context.statement, context.execution_options if context else None)
+        SQL_ERRORS.inc(statement=label)
+        started = getattr(context, "_pagila_started", None)
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            SQL_EXECUTE_SECONDS.observe(elapsed, statement=label)
+            timing = _request_timing.get()
+            if timing is not None:
+                timing.add(statements=1, execute_seconds=elapsed)
+
+
+class TimingMiddleware:
+    """
+    Per-route latency histograms, plus the Server-Timing header with
+    `server_timing`. Requests made in-process by /batch are measured on
+    their own and added to the batch request's SQL totals.
+    """
+
+    def __init__(self, app, server_timing=SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        parent = _request_timing.get()
+        timing = RequestTiming()
+        token = _request_timing.set(timing)
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    header = timing.header(time.perf_counter() - started).encode("latin-1")
+                    message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", header)])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _request_timing.reset(token)
+            # The route template (/search/films), set by the router once it matched
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope["method"], route=route,
+                                         status=str(status))
+            if parent is not None:
+                parent.merge(timing)
@@ -0,0 +1,164 @@
+"""
+Pre-aggregated per-customer payment totals.
+
+customer_payment_totals holds SUM(amount)/COUNT(*) per customer and is kept
+current incrementally: each refresh folds in only the payment rows it hasn't
+folded yet. payment_ids are taken from the sequence before their transaction
+commits, so a payment can become visible after a higher id was folded in.
+Each refresh therefore rescans from below the ids it folded during the last
+PAYMENT_TOTALS_RESCAN_SECONDS, and the ids folded in that window are kept in
+customer_payment_totals_folded so none is counted twice. Payments that are
+updated or deleted after being folded in are not picked up; run a full
+rebuild for those.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of seconds between two incremental refreshes from this process
+PAYMENT_TOTALS_REFRESH_INTERVAL = float(os.getenv("PAYMENT_TOTALS_REFRESH_INTERVAL", "30"))
+# How long after a higher payment_id was folded in a late-committing payment is still picked up
+PAYMENT_TOTALS_RESCAN_SECONDS = float(os.getenv("PAYMENT_TOTALS_RESCAN_SECONDS", "900"))
+
+# Every table a refresh writes; none of them may count as a data change (see schema_catalog.DERIVED_TABLES)
+TABLES = ("customer_payment_totals", "customer_payment_totals_state", "customer_payment_totals_folded")
+
+SETUP_STATEMENTS = [
+    text("""
+        CREATE TABLE IF NOT EXISTS customer_payment_totals (
+            customer_id integer PRIMARY KEY,
+            total_paid numeric(12, 2) NOT NULL,
+            payment_count integer NOT NULL
+        )
+    """),
+    text("""
+        CREATE INDEX IF NOT EXISTS customer_payment_totals_total_paid_idx
+        ON customer_payment_totals (total_paid, customer_id)
+    """),
+    text("""
+        CREATE TABLE IF NOT EXISTS customer_payment_totals_state (
+            id boolean PRIMARY KEY DEFAULT true CHECK (id),
+            last_payment_id integer NOT NULL,
+            refreshed_at timestamptz NOT NULL
+        )
+    """),
+    text("""
+        CREATE TABLE IF NOT EXISTS customer_payment_totals_folded (
+            payment_id integer PRIMARY KEY,
+            folded_at timestamptz NOT NULL DEFAULT now()
+        )
+    """),
+]
+
+# Serializes refreshes across workers so no payment is counted twice
+LOCK_QUERY = text("SELECT pg_advisory_xact_lock(hashtext('customer_payment_totals'))")
+
+WATERMARK_QUERY = text("SELECT last_payment_id FROM customer_payment_totals_state")
+
+# Rescan from just below the ids folded recently: a payment still in flight then has a lower id
+RESCAN_FROM_QUERY = text("""
+    SELECT MIN(payment_id) - 1 FROM customer_payment_totals_folded
+    WHERE folded_at > now() - make_interval(secs => :seconds)
+""")
+
+PRUNE_FOLDED_QUERY = text("DELETE FROM customer_payment_totals_folded WHERE payment_id <= :low")
+
+HIGH_WATER_QUERY = text("SELECT MAX(payment_id) FROM payment WHERE payment_id > :low")
+
+# Only the payments not folded yet make it through the ON CONFLICT DO NOTHING
+FOLD_QUERY = text("""
+    WITH folded AS (
+        INSERT INTO customer_payment_totals_folded (payment_id)
+        SELECT payment_id FROM payment
+        WHERE payment_id > :low AND payment_id <= :high
+        ON CONFLICT (payment_id) DO NOTHING
+        RETURNING payment_id
+    )
+    INSERT INTO customer_payment_totals AS t (customer_id, total_paid, payment_count)
+    SELECT p.customer_id, SUM(p.amount), COUNT(*)
+    FROM payment p
+    JOIN folded f ON f.payment_id = p.payment_id
+    GROUP BY p.customer_id
+    ON CONFLICT (customer_id) DO UPDATE
+    SET total_paid = t.total_paid + EXCLUDED.total_paid,
+        payment_count = t.payment_count + EXCLUDED.payment_count
+""")
+
+SAVE_WATERMARK_QUERY = text("""
+    INSERT INTO customer_payment_totals_state (id, last_payment_id, refreshed_at)
+    VALUES (true, :high, now())
+    ON CONFLICT (id) DO UPDATE
+    SET last_payment_id = EXCLUDED.last_payment_id, refreshed_at = EXCLUDED.refreshed_at
+""")
+
+
+class PaymentTotals:
+    """Maintains customer_payment_totals and tracks whether it can be used"""
+
+    def __init__(self, refresh_interval=PAYMENT_TOTALS_REFRESH_INTERVAL, rescan_seconds=PAYMENT_TOTALS_RESCAN_SECONDS):
+        self.refresh_interval = refresh_interval
+        self.rescan_seconds = rescan_seconds
+        self.available = None  # unknown until the first refresh
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def ensure_fresh(self, db) -> bool:
+        """
+        Fold in new payments if the last refresh is older than the interval.
+        Returns False when the totals table can't be used (e.g. no DDL rights),
+        in which case callers aggregate from payment directly until a later
+        refresh succeeds.
+        """
+        if time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return bool(self.available)
+        if not self._lock.acquire(blocking=False):
+            # Another request is refreshing; slightly stale totals are fine
+            return bool(self.available)
+        try:
+            self.refresh(db)
+        except Exception as e:
+            db.rollback()
+            # Retried after the interval, so a transient error doesn't disable the totals for good
+            self._refreshed_at = time.monotonic()
+            if not self.available:
+                logger.warning("customer_payment_totals unavailable, using live aggregation: %s", e)
+                self.available = False
+            else:
+                logger.warning("customer_payment_totals refresh failed: %s", e)
+            return bool(self.available)
+        finally:
+            self._lock.release()
+        return True
+
+    def refresh(self, db, full: bool = False):
+        """
+        Fold the payments not folded yet into the totals (or rebuild them from
+        scratch with full=True). Returns the range of payment_ids scanned.
+        """
+        db.execute(LOCK_QUERY)
+        for statement in SETUP_STATEMENTS:
+            db.execute(statement)
+        if full:
+            db.execute(text("TRUNCATE customer_payment_totals, customer_payment_totals_folded"))
+            watermark = low = 0
+        else:
+            watermark = db.execute(WATERMARK_QUERY).scalar() or 0
+            rescan_from = db.execute(RESCAN_FROM_QUERY, {"seconds": self.rescan_seconds}).scalar()
+            low = min(watermark, rescan_from) if rescan_from is not None else watermark
+            db.execute(PRUNE_FOLDED_QUERY, {"low": low})
+        high = db.execute(HIGH_WATER_QUERY, {"low": low}).scalar()
+        if high is not None:
+            db.execute(FOLD_QUERY, {"low": low, "high": high})
+        watermark = max(watermark, high or 0)
+        db.execute(SAVE_WATERMARK_QUERY, {"high": watermark})
+        db.commit()
+
+        self.available = True
+        self._refreshed_at = time.monotonic()
+        return {"from_payment_id": low, "to_payment_id": watermark, "full": full}
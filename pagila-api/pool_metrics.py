@@ -0,0 +1,106 @@
+"""
+Connection pool instrumentation for the Pagila API engines.
+
+Pool classes are subclassed so the time spent waiting in `connect()` (queueing
+for a free connection, plus the pre-ping) can be measured; pool events track
+connection churn and how long connections stay checked out.
+"""
+
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from metrics import REGISTRY
+
+POOL_CHECKOUT_WAIT = REGISTRY.histogram(
+    "pagila_db_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    ("engine",)
+)
+POOL_CHECKOUT_HELD = REGISTRY.histogram(
+    "pagila_db_pool_checkout_held_seconds",
+    "Time a connection stayed checked out before being returned",
+    ("engine",)
+)
+POOL_TIMEOUTS = REGISTRY.counter(
+    "pagila_db_pool_timeouts_total",
+    "Checkouts that gave up after pool_timeout",
+    ("engine",)
+)
+POOL_CONNECTION_EVENTS = REGISTRY.counter(
+    "pagila_db_pool_connection_events_total",
+    "DBAPI connection churn: opened, closed and invalidated connections",
+    ("engine", "event")
+)
+
+_pools = {}
+
+
+def _pool_state():
+    state = {}
+    for name, engine in _pools.items():
+        pool = engine.pool
+        state[(name, "size")] = pool.size()
+        state[(name, "checked_out")] = pool.checkedout()
+        state[(name, "checked_in")] = pool.checkedin()
+        state[(name, "overflow")] = max(pool.overflow(), 0)
+        state[(name, "max_connections")] = pool.size() + max(pool._max_overflow, 0)
+    return state
+
+
+REGISTRY.gauge(
+    "pagila_db_pool_connections",
+    "Current pool state: configured size, checked out/in, overflow and max connections",
+    ("engine", "state"),
+    _pool_state
+)
+
+
+class _InstrumentedMixin:
+    metrics_name = "sync"
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc(engine=self.metrics_name)
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start, engine=self.metrics_name)
+
+
+class InstrumentedQueuePool(_InstrumentedMixin, QueuePool):
+    metrics_name = "sync"
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedMixin, AsyncAdaptedQueuePool):
+    metrics_name = "async"
+
+
+def instrument_engine(engine, name):
+    """Register pool gauges and churn/hold-time listeners for `engine` (a sync Engine)"""
+    _pools[name] = engine
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        POOL_CONNECTION_EVENTS.inc(engine=name, event="opened")
+
+    @event.listens_for(engine, "close")
+    def on_close(dbapi_connection, connection_record):
+        POOL_CONNECTION_EVENTS.inc(engine=name, event="closed")
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        POOL_CONNECTION_EVENTS.inc(engine=name, event="invalidated")
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            POOL_CHECKOUT_HELD.observe(time.perf_counter() - checked_out_at, engine=name)
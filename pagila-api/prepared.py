@@ -0,0 +1,209 @@
+"""
+Server-side prepared statements on pooled connections.
+
+asyncpg already prepares every statement it runs and keeps the prepared
+statements in a cache per connection, so on the async engine a statement is
+simply executed. psycopg2 never prepares: there a statement is PREPAREd
+once per pooled connection (prepared statements live as long as the
+database session, whatever happens to transactions) and run with EXECUTE.
+Which statements a connection has prepared is kept in its `info` dict,
+which lives exactly as long as the DBAPI connection.
+
+The endpoints' fixed queries are registered in STATEMENTS, which also keeps
+per-statement execution counts and timings (GET /admin/statements and
+/metrics). Statements run with their name as the `statement_name`
+execution option, which labels them in the SQL timings of
+instrumentation.py.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from metrics import REGISTRY
+
+PREPARED_STATEMENTS = os.getenv("PREPARED_STATEMENTS", "true").strip().lower() in ("1", "true", "yes", "on")
+
+STATEMENT_SECONDS = REGISTRY.histogram(
+    "pagila_statement_duration_seconds",
+    "Execution time of the registered endpoint statements, rows included",
+    ("statement",),
+)
+STATEMENT_PREPARES = REGISTRY.counter(
+    "pagila_statement_prepares_total",
+    "Server-side PREPAREs of registered statements (one per pooled connection and statement)",
+    ("statement",),
+)
+STATEMENT_ERRORS = REGISTRY.counter(
+    "pagila_statement_errors_total",
+    "Failed executions of registered statements",
+    ("statement",),
+)
+
+# SQL split into the tokens that matter for rewriting it: literals, quoted
+# identifiers and comments are kept whole, so binds inside them are ignored.
+# E'...' strings take backslash escapes and $tag$...$tag$ strings take
+# anything, so they are read as Postgres reads them.
+TOKEN = re.compile(r"""
+    (?P<escape_string>[eE]'(?:[^'\\]|\\.|'')*')
+  | (?P<dollar_string>\$(?P<tag>[A-Za-z_]\w*|)\$.*?\$(?P=tag)\$)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<identifier>"(?:[^"]|"")*")
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<cast>::)
+  | (?P<bind>:[A-Za-z_]\w*)
+  | (?P<word>[A-Za-z_][\w$]*)
+  | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+
+def tokens(sql):
+    """(kind, text) pairs covering all of `sql`"""
+    return [(match.lastgroup, match.group()) for match in TOKEN.finditer(sql)]
+
+
+def positional(sql):
+    """`sql` with its :name binds turned into $1, $2, ... and the names in that order"""
+    names, parts = [], []
+    for kind, value in tokens(sql):
+        if kind == "bind":
+            name = value[1:]
+            if name not in names:
+                names.append(name)
+            value = f"${names.index(name) + 1}"
+        parts.append(value)
+    return "".join(parts), names
+
+
+def prepared_by_driver(connection) -> bool:
+    return connection.dialect.driver == "asyncpg"
+
+
+def _execute(connection, name, sql, params, execution_options, clause=None):
+    """(result, whether a PREPARE was sent) of running `sql` as the prepared statement `name`"""
+    if prepared_by_driver(connection):
+        statement = clause if clause is not None else text(sql)
+        return connection.execute(statement, params, execution_options=execution_options), False
+
+    prepared = connection.info.setdefault("prepared_statements", set())
+    positional_sql, names = positional(sql)
+    preparing = name not in prepared
+    if preparing:
+        # no_parameters: psycopg2 would read the % of LIKE patterns or pg_trgm as placeholders
+        connection.exec_driver_sql(f"PREPARE {name} AS {positional_sql}", execution_options={"no_parameters": True})
+        prepared.add(name)
+    arguments = ", ".join(f":{argument}" for argument in names)
+    statement = text(f"EXECUTE {name}({arguments})" if names else f"EXECUTE {name}")
+    # psycopg2 can't DECLARE a server-side cursor over EXECUTE, so no stream_results here
+    execution_options = {k: v for k, v in execution_options.items() if k != "stream_results"}
+    return connection.execute(statement, params, execution_options=execution_options), preparing
+
+
+def execute_prepared(connection, name, sql, params=None, **execution_options):
+    """
+    Run `sql` (with :name binds) as the prepared statement `name` on
+    `connection`, preparing it first when this connection hasn't yet
+    """
+    return _execute(connection, name, sql, params or {}, execution_options)[0]
+
+
+class Statement:
+    """A fixed query of the API, with its execution counters"""
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.clause = text(sql)
+        self.prepared_name = "stmt_" + re.sub(r"\W", "_", name)
+        self.executions = 0
+        self.errors = 0
+        self.prepares = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def stats(self):
+        return {
+            "executions": self.executions,
+            "errors": self.errors,
+            "prepares": self.prepares,
+            "total_seconds": round(self.total_seconds, 6),
+            "mean_seconds": round(self.total_seconds / self.executions, 6) if self.executions else 0.0,
+            "max_seconds": round(self.max_seconds, 6),
+        }
+
+
+class StatementRegistry:
+    """
+    The fixed queries of the endpoints, registered once at import. Each
+    runs as a server-side prepared statement on every pooled connection it
+    gets to (or as plain SQL with PREPARED_STATEMENTS off) and its executions
+    are counted and timed; the time includes reading the rows, which the
+    drivers buffer.
+    """
+
+    def __init__(self, enabled=PREPARED_STATEMENTS):
+        self.enabled = enabled
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, sql) -> Statement:
+        sql = " ".join(sql.split())
+        with self._lock:
+            statement = self._statements.get(name)
+            if statement is None:
+                statement = self._statements[name] = Statement(name, sql)
+            elif statement.sql != sql:
+                raise ValueError(f"statement {name} is already registered with other SQL")
+        return statement
+
+    def variant(self, name, sql) -> Statement:
+        """
+        Statement for SQL put together at runtime from a few fixed parts (e.g.
+        a rollup or its live fallback): one registered statement per text
+        """
+        digest = hashlib.sha1(" ".join(sql.split()).encode()).hexdigest()[:8]
+        return self.register(f"{name}_{digest}", sql)
+
+    def execute(self, db, statement: Statement, params=None):
+        """Run `statement` on a Session or Connection `db`"""
+        connection = db.connection() if isinstance(db, Session) else db
+        started = time.perf_counter()
+        preparing = False
+        try:
+            if self.enabled:
+                result, preparing = _execute(connection, statement.prepared_name, statement.sql, params or {},
+                                             {"statement_name": statement.name}, statement.clause)
+            else:
+                result = connection.execute(statement.clause, params or {},
+                                            execution_options={"statement_name": statement.name})
+        except Exception:
+            with self._lock:
+                statement.errors += 1
+            STATEMENT_ERRORS.inc(statement=statement.name)
+            raise
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            statement.executions += 1
+            statement.prepares += preparing
+            statement.total_seconds += elapsed
+            statement.max_seconds = max(statement.max_seconds, elapsed)
+        STATEMENT_SECONDS.observe(elapsed, statement=statement.name)
+        if preparing:
+            STATEMENT_PREPARES.inc(statement=statement.name)
+        return result
+
+    def stats(self):
+        with self._lock:
+            statements = {name: statement.stats() for name, statement in sorted(self._statements.items())}
+        return {"prepared": self.enabled, "statements": statements}
+
+
+# Registry of the endpoints' queries
+STATEMENTS = StatementRegistry()
@@ -0,0 +1,323 @@
+"""
+Guarded execution of agent-written SQL for /execute-query.
+
+Each query runs on its own connection in a read-only transaction with a
+statement_timeout, rows are fetched in fetchmany() chunks up to a server-side
+row cap, and the JSON body is streamed out chunk by chunk. msgpack and Arrow
+bodies are built from the same chunks once the capped result is complete.
+"""
+
+import json
+import os
+import time
+
+import anyio
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.concurrency import run_in_threadpool
+
+from admission import QueryRejected
+from instrumentation import record_fetch
+from prepared import execute_prepared, tokens
+from serialization import (ARROW_STREAM_MEDIA_TYPE, JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, ArrowStreamEncoder,
+                           dumps, packb)
+from shaping import convert_rows, shape_rows
+
+EXECUTE_QUERY_TIMEOUT_MS = int(os.getenv("EXECUTE_QUERY_TIMEOUT_MS", "5000"))
+EXECUTE_QUERY_MAX_ROWS = int(os.getenv("EXECUTE_QUERY_MAX_ROWS", "1000"))
+EXECUTE_QUERY_FETCH_SIZE = int(os.getenv("EXECUTE_QUERY_FETCH_SIZE", "500"))
+EXECUTE_QUERY_READ_ONLY = os.getenv("EXECUTE_QUERY_READ_ONLY", "true").strip().lower() in ("1", "true", "yes", "on")
+
+# SET LOCAL can't take a bind parameter; set_config(..., true) is its equivalent
+SET_TIMEOUT_QUERY = text("SELECT set_config('statement_timeout', :timeout, true)")
+
+
+def single_statement(sql):
+    """
+    `sql` without its trailing semicolons. psycopg2 sends queries over the
+    simple query protocol, which runs every statement of the string, so a
+    "; COMMIT; DELETE ..." would end the read-only transaction: any `;` left
+    outside literals and comments is refused, before EXPLAIN or execution.
+
+    Raises:
+        QueryRejected: (422) when `sql` holds more than one statement
+    """
+    parts = tokens(sql)
+    while parts and (parts[-1][0] in ("space", "comment") or parts[-1] == ("other", ";")):
+        parts.pop()
+    # Postgres nests /* */ comments, the tokenizer doesn't: it could end one too early
+    nested = any(kind == "comment" and "/*" in value[2:] for kind, value in parts)
+    if nested or ("other", ";") in parts:
+        raise QueryRejected(422, {
+            "error": "multiple_statements",
+            "reason": "single statement only: remove the ';' between statements"
+            + (" and the nested /* */ comments" if nested else ""),
+        })
+    return "".join(value for kind, value in parts)
+
+
+class GuardedQuery:
+    """
+    One agent query in its own guarded transaction.
+
+    All methods are synchronous and take/keep a sync Connection; the caller
+    drives them from the threadpool (sync engine) or through
+    AsyncConnection.run_sync (async engine).
+    """
+
+    def __init__(self, sql, params=None, max_rows=None, timeout_ms=None,
+                 read_only=EXECUTE_QUERY_READ_ONLY, fetch_size=EXECUTE_QUERY_FETCH_SIZE, shape="records",
+                 prepared=None):
+        self.sql = sql
+        self.params = params or {}
+        # Requests may tighten the server limits but never loosen them, nor go
+        # below 1 (a negative max_rows or timeout would end in a 500)
+        self.max_rows = max(1, min(max_rows, EXECUTE_QUERY_MAX_ROWS)) if max_rows else EXECUTE_QUERY_MAX_ROWS
+        self.timeout_ms = max(1, min(timeout_ms, EXECUTE_QUERY_TIMEOUT_MS)) if timeout_ms else EXECUTE_QUERY_TIMEOUT_MS
+        self.read_only = read_only
+        self.fetch_size = fetch_size
+        self.shape = shape
+        # Name of the server-side prepared statement to run `sql` as, if any
+        self.prepared = prepared
+        # Label of the query in the SQL timings
+        self.name = "sql_template" if prepared else "execute_query"
+        self.columns = []
+        self.row_count = 0
+        self.truncated = False
+        self.exhausted = False
+        self.connection = None
+        self.result = None
+        self.server_side = False
+
+    def begin(self, connection):
+        """Open the guarded transaction on `connection` and apply the limits"""
+        self.connection = connection
+        self.transaction = connection.begin()
+        if self.read_only:
+            connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+        connection.execute(SET_TIMEOUT_QUERY, {"timeout": f"{self.timeout_ms}ms"})
+
+    def run(self):
+        """Execute the query on a server-side cursor"""
+        if self.prepared:
+            self.result = execute_prepared(self.connection, self.prepared, self.sql, self.params, stream_results=True,
+                                           statement_name=self.name)
+        else:
+            self.result = self.connection.execute(text(self.sql), self.params,
+                                                  execution_options={"stream_results": True, "statement_name": self.name})
+        # psycopg2 runs prepared statements on a client-side cursor: its rows are counted at execution
+        self.server_side = bool(self.result.context.execution_options.get("stream_results"))
+        if self.result.returns_rows:
+            self.columns = list(self.result.keys())
+        else:
+            self.row_count = max(self.result.rowcount, 0)
+            self.exhausted = True
+
+    def fetch(self):
+        """Next chunk of rows, stopping at max_rows (and flagging truncation)"""
+        if self.exhausted:
+            return []
+        remaining = self.max_rows - self.row_count
+        # Ask for one row past the cap so truncation can be detected
+        started = time.perf_counter()
+        rows = self.result.fetchmany(min(self.fetch_size, remaining + 1))
+        record_fetch(self.name, time.perf_counter() - started, len(rows) if self.server_side else 0)
+        if len(rows) > remaining:
+            rows = rows[:remaining]
+            self.truncated = True
+            self.exhausted = True
+        elif len(rows) < min(self.fetch_size, remaining + 1):
+            self.exhausted = True
+        self.row_count += len(rows)
+        return rows
+
+    def end(self, success):
+        """Commit writes (only possible with read-only mode off), otherwise roll back"""
+        try:
+            if self.result is not None:
+                self.result.close()
+            if success and not self.read_only:
+                self.transaction.commit()
+            else:
+                self.transaction.rollback()
+        finally:
+            self.connection.close()
+
+    def metadata(self):
+        return {
+            "row_count": self.row_count,
+            "truncated": self.truncated,
+            "max_rows": self.max_rows,
+            "timeout_ms": self.timeout_ms,
+            "read_only": self.read_only,
+        }
+
+
+class QueryRunner:
+    """Drives a GuardedQuery on either engine without blocking the event loop"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.async_connection = None
+
+    async def open(self, query: GuardedQuery):
+        if isinstance(self.engine, AsyncEngine):
+            self.async_connection = await self.engine.connect()
+            await self.async_connection.run_sync(query.begin)
+        else:
+            connection = await run_in_threadpool(self.engine.connect)
+            await run_in_threadpool(query.begin, connection)
+
+    async def call(self, fn, *args):
+        if self.async_connection is not None:
+            return await self.async_connection.run_sync(lambda _: fn(*args))
+        return await run_in_threadpool(fn, *args)
+
+    async def close(self, query: GuardedQuery, success):
+        try:
+            if query.connection is not None:
+                await self.call(query.end, success)
+        finally:
+            if self.async_connection is not None:
+                await self.async_connection.close()
+
+
+class GuardedStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that runs `cleanup` however the response ends: the body
+    generator's own finally never runs if the client is gone before the body
+    is iterated, which would leak the connection and the admission slot
+    """
+
+    def __init__(self, content, cleanup, **kwargs):
+        super().__init__(content, **kwargs)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.cleanup()
+
+
+def _encode_rows(columns, rows, shape):
+    rows = convert_rows(rows)
+    if shape == "table":
+        return b",".join(dumps(list(row)) for row in rows)
+    return b",".join(dumps(dict(zip(columns, row))) for row in rows)
+
+
+def _metadata_headers(metadata):
+    return {"X-" + "-".join(part.title() for part in name.split("_")): json.dumps(value)
+            for name, value in metadata.items()}
+
+
+async def _buffered_response(runner, query: GuardedQuery, first_rows, release, media_type, on_success):
+    """
+    Whole-body response (msgpack, Arrow, or column-major JSON) for a query
+    whose first chunk is already fetched. The rest is read before responding
+    (it is capped at max_rows) so row_count and truncated can go in the
+    headers too.
+    """
+    success = False
+    chunks = []
+    arrow = ArrowStreamEncoder(query.columns) if media_type == ARROW_STREAM_MEDIA_TYPE else None
+    try:
+        rows = first_rows
+        while rows:
+            chunks.append(arrow.encode(rows) if arrow is not None else rows)
+            rows = await runner.call(query.fetch)
+        success = True
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query error: {str(e)}")
+    finally:
+        release()
+        await runner.close(query, success)
+    if on_success is not None:
+        on_success()
+
+    metadata = query.metadata()
+    if arrow is not None:
+        body = b"".join(chunks) + arrow.close()
+    else:
+        results = shape_rows(query.columns, [row for rows in chunks for row in rows], query.shape)
+        encode = packb if media_type == MSGPACK_MEDIA_TYPE else dumps
+        body = encode(dict(results=results, **metadata))
+    return Response(body, media_type=media_type, headers=_metadata_headers(metadata))
+
+
+async def guarded_response(engine, query: GuardedQuery, admission=None, media_type: str = JSON_MEDIA_TYPE,
+                           on_success=None):
+    """
+    Run `query` and stream `{"results": [...], "row_count", "truncated", ...}`.
+
+    `query` must be a single statement (422 otherwise). With an
+    AdmissionController the plan is estimated first and the query may
+    be rejected (422/503 with a structured reason) or queued. The query is
+    executed and its first chunk fetched before the response starts, so syntax
+    errors, timeouts and read-only violations still surface as HTTP errors. An
+    error in a later chunk ends the JSON with an "error" key. For msgpack the
+    same object is sent in one piece; for Arrow the rows are the record
+    batches and the metadata goes in X-Row-Count, X-Truncated, ... headers.
+    on_success() is called once all rows were read without error.
+    """
+    runner = QueryRunner(engine)
+    release = lambda: None
+    try:
+        query.sql = single_statement(query.sql)
+        await runner.open(query)
+        if admission is not None:
+            release = await admission.admit(runner, query)
+        await runner.call(query.run)
+        first_rows = await runner.call(query.fetch)
+    except Exception as e:
+        release()
+        await runner.close(query, success=False)
+        if isinstance(e, QueryRejected):
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        raise HTTPException(status_code=500, detail=f"Query error: {str(e)}")
+
+    if media_type in (MSGPACK_MEDIA_TYPE, ARROW_STREAM_MEDIA_TYPE) or query.shape == "columns":
+        # Column-major results can only be written once all rows are in, like the binary formats
+        return await _buffered_response(runner, query, first_rows, release, media_type, on_success)
+
+    closed = False
+
+    async def cleanup(success=False):
+        """Free the heavy-query slot and the connection, once, even if the request is being cancelled"""
+        nonlocal closed
+        if closed:
+            return
+        closed = True
+        with anyio.CancelScope(shield=True):
+            release()
+            await runner.close(query, success)
+
+    async def body():
+        success = False
+        error = None
+        try:
+            if query.shape == "table":
+                yield b'{"results": {"columns": ' + dumps(query.columns) + b', "rows": ['
+            else:
+                yield b'{"results": ['
+            rows, separator = first_rows, b""
+            while rows:
+                yield separator + _encode_rows(query.columns, rows, query.shape)
+                separator = b","
+                rows = await runner.call(query.fetch)
+            success = True
+        except Exception as e:
+            error = f"Query error: {str(e)}"
+        finally:
+            await cleanup(success)
+        trailer = query.metadata()
+        if error is not None:
+            trailer["error"] = error
+        elif on_success is not None:
+            on_success()
+        yield (b"]}, " if query.shape == "table" else b"], ") + dumps(trailer)[1:]
+
+    return GuardedStreamingResponse(body(), cleanup, media_type="application/json")
@@ -0,0 +1,207 @@
+"""
+Response cache for the expensive read-only endpoints of the Pagila API.
+
+Entries are keyed on the endpoint plus its normalized query parameters and
+expire after a per-endpoint TTL. Two backends are available: a bounded LRU
+kept in process memory (default) and a local on-disk store that survives
+restarts and is shared by all workers on the host.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Response
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".response_cache"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+# Per-endpoint TTLs in seconds; endpoints not listed use RESPONSE_CACHE_TTL
+CACHE_TTLS = {
+    "analysis/film-length-by-year": 3600,
+    "analysis/customer-payments": 300,
+    "search/top-actors-by-category": 1800,
+    "analysis/category-rentals": 1800,
+}
+
+
+class MemoryBackend:
+    """Bounded LRU held in process memory"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def purge(self, endpoint=None) -> int:
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if endpoint is None or e["endpoint"] == endpoint]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class DiskBackend:
+    """One JSON file per entry in a local directory"""
+
+    def __init__(self, directory=RESPONSE_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["key"] != key:
+            return None
+        if entry["expires_at"] <= time.time():
+            self._remove(self._path(key))
+            return None
+        return entry
+
+    def set(self, key, entry):
+        # Write to a temp file first so readers never see a partial entry
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(dict(entry, key=key), f)
+        os.replace(tmp_path, path)
+
+    def purge(self, endpoint=None) -> int:
+        removed = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            if endpoint is not None:
+                try:
+                    with open(path) as f:
+                        if json.load(f)["endpoint"] != endpoint:
+                            continue
+                except (OSError, ValueError, KeyError):
+                    pass
+            removed += self._remove(path)
+        return removed
+
+    def size(self) -> int:
+        return sum(1 for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    @staticmethod
+    def _remove(path) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+
+def normalize_params(params) -> str:
+    """
+    Canonical form of the query parameters: unset values dropped, keys sorted,
+    strings stripped and lowercased (the cached endpoints all compare text
+    case-insensitively).
+    """
+    normalized = {}
+    for name, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip().lower()
+        normalized[name] = value
+    return json.dumps(normalized, sort_keys=True, default=str)
+
+
+class ResponseCache:
+    """Get-or-compute cache with per-endpoint TTLs and hit/miss counters"""
+
+    def __init__(self, backend, ttls=None, default_ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _count(self, endpoint, outcome):
+        with self._lock:
+            counters = self._stats.setdefault(endpoint, {"hits": 0, "misses": 0})
+            counters[outcome] += 1
+
+    async def get_or_compute(self, endpoint, params, compute, response: Response = None):
+        """
+        Return the cached payload for endpoint+params, or await `compute()` and
+        cache its result. Sets an X-Cache header on `response` when given.
+        """
+        key = f"{endpoint}?{normalize_params(params)}"
+        entry = self.backend.get(key)
+        if entry is not None:
+            self._count(endpoint, "hits")
+            if response is not None:
+                response.headers["X-Cache"] = "HIT"
+            return entry["value"]
+
+        self._count(endpoint, "misses")
+        value = await compute()
+        ttl = self.ttls.get(endpoint, self.default_ttl)
+        if ttl > 0:
+            self.backend.set(key, {"endpoint": endpoint, "expires_at": time.time() + ttl, "value": value})
+        if response is not None:
+            response.headers["X-Cache"] = "MISS"
+        return value
+
+    def purge(self, endpoint=None) -> int:
+        """Remove all entries, or only those of one endpoint"""
+        return self.backend.purge(endpoint)
+
+    def stats(self):
+        with self._lock:
+            endpoints = {name: dict(counters) for name, counters in self._stats.items()}
+        for counters in endpoints.values():
+            lookups = counters["hits"] + counters["misses"]
+            counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "ttls": self.ttls,
+            "default_ttl": self.default_ttl,
+            "endpoints": endpoints,
+        }
+
+
+def create_response_cache() -> ResponseCache:
+    """Build the cache selected by RESPONSE_CACHE_BACKEND (memory or disk)"""
+    if RESPONSE_CACHE_BACKEND == "disk":
+        return ResponseCache(DiskBackend())
+    if RESPONSE_CACHE_BACKEND != "memory":
+        raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {RESPONSE_CACHE_BACKEND}")
+    return ResponseCache(MemoryBackend())
@@ -0,0 +1,221 @@
+"""
+Materialized analytics rollups for the film and category statistics.
+
+Each rollup is a materialized view over the catalog tables, indexed for the
+lookups the endpoints make, so ranking questions become index scans instead
+of joins and GROUP BYs over film_actor/film_category/rental. A refresh only
+touches the views whose source tables changed since their last refresh (per
+the pg_stat_user_tables write counters), and re-populated views are refreshed
+CONCURRENTLY so readers are never blocked. refreshed_at is kept per rollup
+in rollup_state and reported to clients as a freshness indicator.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of seconds between two change checks from this process
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "300"))
+
+
+class Rollup:
+    """A materialized view, the tables it is computed from and its indexes"""
+
+    def __init__(self, name, query, sources, unique_columns, indexes=()):
+        self.name = name
+        self.query = query
+        self.sources = sources
+        self.unique_columns = unique_columns
+        self.indexes = indexes
+
+    def setup_statements(self):
+        statements = [
+            f"CREATE MATERIALIZED VIEW IF NOT EXISTS {self.name} AS {self.query} WITH NO DATA",
+            # REFRESH ... CONCURRENTLY needs a unique index over plain columns
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {self.name}_key ON {self.name} ({self.unique_columns})",
+        ]
+        for suffix, columns in self.indexes:
+            statements.append(f"CREATE INDEX IF NOT EXISTS {self.name}_{suffix}_idx ON {self.name} ({columns})")
+        return [text(statement) for statement in statements]
+
+
+ROLLUPS = {
+    rollup.name: rollup
+    for rollup in [
+        Rollup(
+            "film_length_by_year_rollup",
+            """
+            SELECT release_year,
+                   AVG(length) AS avg_length,
+                   MIN(length) AS min_length,
+                   MAX(length) AS max_length,
+                   COUNT(*) AS film_count
+            FROM film
+            GROUP BY release_year
+            """,
+            sources=["film"],
+            unique_columns="release_year",
+        ),
+        Rollup(
+            "category_actor_film_counts_rollup",
+            """
+            SELECT c.category_id, LOWER(c.name) AS category_key,
+                   a.actor_id, a.first_name, a.last_name,
+                   COUNT(fa.film_id) AS film_count
+            FROM actor a
+            JOIN film_actor fa ON a.actor_id = fa.actor_id
+            JOIN film_category fc ON fa.film_id = fc.film_id
+            JOIN category c ON fc.category_id = c.category_id
+            GROUP BY c.category_id, c.name, a.actor_id, a.first_name, a.last_name
+            """,
+            sources=["actor", "film_actor", "film_category", "category"],
+            unique_columns="category_id, actor_id",
+            indexes=[("ranking", "category_key, film_count DESC, actor_id")],
+        ),
+        Rollup(
+            "category_rental_counts_rollup",
+            """
+            SELECT c.category_id, c.name,
+                   COUNT(r.rental_id) AS rental_count,
+                   COUNT(DISTINCT i.film_id) FILTER (WHERE r.rental_id IS NOT NULL) AS rented_film_count
+            FROM category c
+            LEFT JOIN film_category fc ON fc.category_id = c.category_id
+            LEFT JOIN inventory i ON i.film_id = fc.film_id
+            LEFT JOIN rental r ON r.inventory_id = i.inventory_id
+            GROUP BY c.category_id, c.name
+            """,
+            sources=["category", "film_category", "inventory", "rental"],
+            unique_columns="category_id",
+            indexes=[("ranking", "rental_count DESC, category_id")],
+        ),
+    ]
+}
+
+STATE_SETUP = text("""
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        name text PRIMARY KEY,
+        source_signature bigint NOT NULL,
+        refreshed_at timestamptz NOT NULL
+    )
+""")
+
+# Serializes refreshes across workers; the others just skip the round
+TRY_LOCK_QUERY = text("SELECT pg_try_advisory_xact_lock(hashtext('analytics_rollups'))")
+
+STATE_QUERY = text("SELECT name, source_signature, refreshed_at FROM rollup_state")
+
+# Cumulative write counters of the source tables: a refresh is only needed when they moved
+SIGNATURE_QUERY = text("""
+    SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0)
+    FROM pg_stat_user_tables
+    WHERE schemaname = 'public' AND relname = ANY(:tables)
+""")
+
+SAVE_STATE_QUERY = text("""
+    INSERT INTO rollup_state (name, source_signature, refreshed_at)
+    VALUES (:name, :signature, now())
+    ON CONFLICT (name) DO UPDATE
+    SET source_signature = EXCLUDED.source_signature, refreshed_at = EXCLUDED.refreshed_at
+""")
+
+
+class Rollups:
+    """Keeps the rollup views current and tracks whether they can be used"""
+
+    def __init__(self, refresh_interval=ROLLUP_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.available = None  # unknown until the first refresh
+        self.refreshed_at = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def ensure_fresh(self, db) -> bool:
+        """
+        Refresh the rollups whose sources changed if the last check is older
+        than the interval. Returns False when the views can't be used (e.g. no
+        DDL rights), in which case callers aggregate from the base tables until
+        a later check succeeds.
+        """
+        if time.monotonic() - self._checked_at < self.refresh_interval:
+            return bool(self.available)
+        if not self._lock.acquire(blocking=False):
+            # Another request is refreshing; the current views are fine meanwhile
+            return bool(self.available)
+        try:
+            self.refresh(db)
+        except Exception as e:
+            db.rollback()
+            # Retried after the interval, so a database that was down at startup is picked up later
+            self._checked_at = time.monotonic()
+            if not self.available:
+                logger.warning("Analytics rollups unavailable, using live aggregation: %s", e)
+                self.available = False
+            else:
+                logger.warning("Analytics rollup refresh failed: %s", e)
+            return bool(self.available)
+        finally:
+            self._lock.release()
+        return bool(self.available)
+
+    def refresh(self, db, force: bool = False):
+        """
+        Refresh every rollup whose source tables were written to since its last
+        refresh (all of them with force=True). Returns the names refreshed, or
+        None when another worker holds the refresh lock.
+        """
+        if not db.execute(TRY_LOCK_QUERY).scalar():
+            db.rollback()
+            self._load_state(db)
+            self._checked_at = time.monotonic()
+            return None
+        db.execute(STATE_SETUP)
+        for rollup in ROLLUPS.values():
+            for statement in rollup.setup_statements():
+                db.execute(statement)
+        state = {row[0]: row[1] for row in db.execute(STATE_QUERY)}
+
+        refreshed = []
+        for rollup in ROLLUPS.values():
+            signature = db.execute(SIGNATURE_QUERY, {"tables": rollup.sources}).scalar()
+            if not force and state.get(rollup.name) == signature:
+                continue
+            # A view without state has never been populated, and CONCURRENTLY needs populated views
+            concurrently = " CONCURRENTLY" if rollup.name in state else ""
+            db.execute(text(f"REFRESH MATERIALIZED VIEW{concurrently} {rollup.name}"))
+            db.execute(SAVE_STATE_QUERY, {"name": rollup.name, "signature": signature})
+            refreshed.append(rollup.name)
+        db.commit()
+
+        self._load_state(db)
+        self.available = True
+        self._checked_at = time.monotonic()
+        return refreshed
+
+    def _load_state(self, db):
+        try:
+            rows = db.execute(STATE_QUERY).all()
+        except Exception:
+            db.rollback()
+            return
+        db.commit()
+        self.refreshed_at = {row[0]: row[2] for row in rows}
+        if all(name in self.refreshed_at for name in ROLLUPS):
+            self.available = True
+
+    def source(self, name) -> str:
+        """FROM-clause item for a rollup: the view, or its defining query when views are unavailable"""
+        if self.available:
+            return name
+        return f"({ROLLUPS[name].query}) AS {name}"
+
+    def freshness(self, name):
+        """Where the data of `name` came from and when it was last refreshed"""
+        refreshed_at = self.refreshed_at.get(name) if self.available else None
+        if refreshed_at is None:
+            return {"source": "live", "refreshed_at": None}
+        return {"source": "rollup", "refreshed_at": refreshed_at.isoformat()}
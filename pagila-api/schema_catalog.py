@@ -0,0 +1,217 @@
+"""
+In-memory schema catalog for the Pagila API.
+
+The whole schema is loaded with a handful of set-based pg_catalog queries and
+kept as a snapshot. The snapshot is reused until its TTL expires or the DDL
+fingerprint (a hash over the catalog rows of the schema) changes.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from fastapi import Request, Response
+from sqlalchemy import text
+
+from serialization import NegotiatedResponse, rendered_media_type
+
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "3600"))
+# How often the (cheap) fingerprint query may run to detect DDL changes
+SCHEMA_FINGERPRINT_INTERVAL = float(os.getenv("SCHEMA_FINGERPRINT_INTERVAL", "5"))
+
+# Same relation kinds information_schema.tables reports: tables, partitioned
+# tables, views and foreign tables
+RELKINDS = "('r', 'p', 'v', 'f')"
+
+TABLES_QUERY = text(f"""
+    SELECT c.relname
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = :schema AND c.relkind IN {RELKINDS}
+    ORDER BY c.relname
+""")
+
+COLUMNS_QUERY = text(f"""
+    SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), NOT a.attnotnull
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = :schema AND c.relkind IN {RELKINDS}
+      AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY c.relname, a.attnum
+""")
+
+CONSTRAINTS_QUERY = text("""
+    SELECT con.contype, c.relname, a.attname, fc.relname, fa.attname
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, fattnum, ord)
+    JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+    LEFT JOIN pg_class fc ON fc.oid = con.confrelid
+    LEFT JOIN pg_attribute fa ON fa.attrelid = con.confrelid AND fa.attnum = k.fattnum
+    WHERE n.nspname = :schema AND con.contype IN ('p', 'f')
+    ORDER BY c.relname, con.conname, k.ord
+""")
+
+# Any DDL on the schema rewrites at least one of these catalog rows, which
+# gives it a new xmin
+FINGERPRINT_QUERY = text(f"""
+    SELECT md5(string_agg(entry, ',' ORDER BY entry))
+    FROM (
+        SELECT 'c' || c.oid || ':' || c.xmin::text AS entry
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :schema AND c.relkind IN {RELKINDS}
+        UNION ALL
+        SELECT 'a' || a.attrelid || '.' || a.attnum || ':' || a.xmin::text
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :schema AND c.relkind IN {RELKINDS} AND a.attnum > 0
+        UNION ALL
+        SELECT 'k' || con.oid || ':' || con.xmin::text
+        FROM pg_constraint con
+        JOIN pg_namespace n ON n.oid = con.connamespace
+        WHERE n.nspname = :schema
+    ) entries
+""")
+
+# Tables the API maintains itself; writing them doesn't change the data clients see
+DERIVED_TABLES = ["customer_payment_totals", "customer_payment_totals_state", "customer_payment_totals_folded",
+                  "rollup_state"]
+
+# Cumulative row writes to the schema's tables since the statistics were last reset
+TABLE_WRITES_QUERY = text("""
+    SELECT COALESCE(SUM(s.n_tup_ins + s.n_tup_upd + s.n_tup_del), 0)
+    FROM pg_stat_user_tables s
+    JOIN pg_class c ON c.oid = s.relid
+    WHERE s.schemaname = :schema AND c.relkind IN ('r', 'p') AND NOT s.relname = ANY(:derived)
+""")
+
+
+def _etag(payload) -> str:
+    digest = hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+class SchemaSnapshot:
+    """One consistent view of the schema plus everything derived from it"""
+
+    def __init__(self, tables, relationships, fingerprint):
+        self.tables = tables
+        self.relationships = relationships
+        self.fingerprint = fingerprint
+        self.loaded_at = time.monotonic()
+        self.etag = _etag(tables)
+
+        mermaid = ["erDiagram"]
+        for rel in relationships:
+            mermaid.append(f'    {rel["table"]} ||--o{{ {rel["foreign_table"]} : "{rel["column"]}"')
+        self.diagram = {"diagram": "\n".join(mermaid)}
+        self.diagram_etag = _etag(self.diagram)
+
+
+class SchemaCatalog:
+    """Caches the schema snapshot and reloads it on TTL expiry or DDL changes"""
+
+    def __init__(self, schema="public", ttl=SCHEMA_CACHE_TTL, check_interval=SCHEMA_FINGERPRINT_INTERVAL):
+        self.schema = schema
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Drop the snapshot so the next request reloads it"""
+        self._snapshot = None
+
+    def snapshot(self, db) -> SchemaSnapshot:
+        """Return the current snapshot, reloading it only when it is stale"""
+        snapshot = self._snapshot
+        if snapshot is not None and self._is_fresh(db, snapshot):
+            return snapshot
+
+        # Never wait on the lock: in async mode this runs on the event loop
+        # thread, so blocking here could deadlock against the loading request
+        if not self._lock.acquire(blocking=False):
+            return snapshot if snapshot is not None else self._load(db)
+        try:
+            self._snapshot = self._load(db)
+            self._checked_at = time.monotonic()
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+    def _is_fresh(self, db, snapshot) -> bool:
+        now = time.monotonic()
+        if now - snapshot.loaded_at >= self.ttl:
+            return False
+        if now - self._checked_at < self.check_interval:
+            return True
+        self._checked_at = now
+        return self._fingerprint(db) == snapshot.fingerprint
+
+    def _fingerprint(self, db) -> str:
+        return db.execute(FINGERPRINT_QUERY, {"schema": self.schema}).scalar()
+
+    def _load(self, db) -> SchemaSnapshot:
+        params = {"schema": self.schema}
+        fingerprint = self._fingerprint(db)
+
+        tables = {
+            row[0]: {"columns": [], "primary_keys": [], "foreign_keys": []}
+            for row in db.execute(TABLES_QUERY, params)
+        }
+        for table, name, data_type, nullable in db.execute(COLUMNS_QUERY, params):
+            tables[table]["columns"].append({"name": name, "type": data_type, "nullable": nullable})
+
+        relationships = []
+        for kind, table, column, foreign_table, foreign_column in db.execute(CONSTRAINTS_QUERY, params):
+            if table not in tables:
+                continue
+            if kind == "p":
+                tables[table]["primary_keys"].append(column)
+            else:
+                tables[table]["foreign_keys"].append({
+                    "column": column,
+                    "references": {"table": foreign_table, "column": foreign_column}
+                })
+                relationships.append({
+                    "table": table,
+                    "column": column,
+                    "foreign_table": foreign_table,
+                    "foreign_column": foreign_column
+                })
+
+        return SchemaSnapshot(tables, relationships, fingerprint)
+
+
+def data_version(db, snapshot: SchemaSnapshot, schema: str = "public"):
+    """
+    Version of the data behind the API: changes whenever the schema or any row
+    the endpoints read changes, so clients can tell whether an answer they
+    computed earlier still holds. Statistics resets also change it, which
+    only costs a spurious cache miss.
+    """
+    writes = int(db.execute(TABLE_WRITES_QUERY, {"schema": schema, "derived": DERIVED_TABLES}).scalar())
+    version = hashlib.md5(f"{snapshot.fingerprint}:{writes}".encode()).hexdigest()[:16]
+    return {"version": version, "schema_fingerprint": snapshot.fingerprint, "table_writes": writes}
+
+
+def etag_response(request: Request, content, etag: str):
+    """
+    Answer with 304 when the client already holds this version. `etag` is the
+    version of the content; the ETag sent also covers the negotiated media
+    type, so a JSON and a msgpack copy never validate each other.
+    """
+    media_type = rendered_media_type(content, request.headers.get("accept", ""))
+    etag = f'"{hashlib.md5(f"{etag}:{media_type}".encode()).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return NegotiatedResponse(content=content, headers=headers)
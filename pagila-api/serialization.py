@@ -0,0 +1,196 @@
+"""
+Response encodings for the Pagila API and the Accept-header negotiation
+between them.
+
+JSON is encoded with orjson. msgpack carries the same structure in a
+compact binary form. Arrow IPC streams (`application/vnd.apache.arrow.stream`)
+are built column by column straight from cursor chunks. Arrow needs the
+optional pyarrow package and is only offered when it is installed.
+"""
+
+import io
+from contextvars import ContextVar
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+import msgpack
+import orjson
+from fastapi.responses import JSONResponse
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Older spellings clients still send for msgpack
+MSGPACK_ALIASES = ("application/x-msgpack", "application/vnd.msgpack")
+
+# Accept header of the request being handled, set by NegotiationMiddleware
+request_accept: ContextVar[str] = ContextVar("request_accept", default="")
+
+
+def json_default(value):
+    """JSON encoding for the non-native types Postgres rows contain"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def dumps(value) -> bytes:
+    return orjson.dumps(value, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def packb(value) -> bytes:
+    # msgpack has a native bytes type, everything else non-native goes through json_default
+    return msgpack.packb(value, default=json_default, use_bin_type=True, datetime=False)
+
+
+def preferred_media_type(accept: str, offered) -> str:
+    """
+    Media type from `offered` that the Accept header ranks highest (ties go
+    to the one listed first), or None when the header names none of them.
+    """
+    best, best_q = None, 0.0
+    for part in accept.split(","):
+        media_type, *options = [piece.strip() for piece in part.split(";")]
+        media_type = media_type.lower()
+        if media_type in MSGPACK_ALIASES:
+            media_type = MSGPACK_MEDIA_TYPE
+        q = 1.0
+        for option in options:
+            if option.startswith("q="):
+                try:
+                    q = float(option[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type in offered and q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def binary_media_types():
+    """Non-JSON formats this process can produce"""
+    return (MSGPACK_MEDIA_TYPE, ARROW_STREAM_MEDIA_TYPE) if pa is not None else (MSGPACK_MEDIA_TYPE,)
+
+
+def negotiated_media_type(accept: str = None) -> str:
+    """JSON, or the binary format the client asked for"""
+    accept = request_accept.get() if accept is None else accept
+    return preferred_media_type(accept, binary_media_types()) or JSON_MEDIA_TYPE
+
+
+def _is_table(content) -> bool:
+    return isinstance(content, list) and all(isinstance(row, dict) for row in content)
+
+
+def rendered_media_type(content, accept: str = None) -> str:
+    """The media type NegotiatedResponse renders `content` in (Arrow only fits lists of rows)"""
+    media_type = negotiated_media_type(accept)
+    if media_type == ARROW_STREAM_MEDIA_TYPE and not _is_table(content):
+        return JSON_MEDIA_TYPE
+    return media_type
+
+
+class NegotiatedResponse(JSONResponse):
+    """
+    Default response class: orjson unless the request's Accept header asks for
+    msgpack, or for Arrow and the payload is a list of rows.
+    """
+
+    def render(self, content) -> bytes:
+        media_type = rendered_media_type(content)
+        if media_type == MSGPACK_MEDIA_TYPE:
+            self.media_type = MSGPACK_MEDIA_TYPE
+            return packb(content)
+        if media_type == ARROW_STREAM_MEDIA_TYPE:
+            self.media_type = ARROW_STREAM_MEDIA_TYPE
+            columns = list(content[0]) if content else []
+            encoder = ArrowStreamEncoder(columns)
+            return encoder.encode([tuple(row.get(name) for name in columns) for row in content]) + encoder.close()
+        return dumps(content)
+
+
+class NegotiationMiddleware:
+    """Makes the Accept header available to NegotiatedResponse"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"accept"), "")
+        token = request_accept.set(accept)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_accept.reset(token)
+
+
+class ArrowStreamEncoder:
+    """
+    Turns chunks of row tuples into one Arrow IPC stream. The schema is taken
+    from the first chunk; Decimal columns become float64 and all-NULL columns
+    strings, since later chunks must fit the same schema.
+    """
+
+    def __init__(self, columns, metadata=None):
+        self.columns = columns
+        self.metadata = metadata
+        self.schema = None
+        self.sink = None
+        self.writer = None
+        self.decimal_columns = set()
+
+    def _start(self, columns_values):
+        fields = []
+        for index, (name, values) in enumerate(zip(self.columns, columns_values)):
+            type_ = pa.array(values).type if values else pa.null()
+            if pa.types.is_decimal(type_):
+                self.decimal_columns.add(index)
+                type_ = pa.float64()
+            elif pa.types.is_null(type_):
+                type_ = pa.string()
+            fields.append(pa.field(name, type_))
+        self.schema = pa.schema(fields, metadata=self.metadata)
+        self.sink = io.BytesIO()
+        self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+    def _drain(self) -> bytes:
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def encode(self, rows) -> bytes:
+        """IPC bytes for one chunk of rows (preceded by the schema on the first call)"""
+        # Column-major in one pass instead of one dict per row
+        columns_values = list(zip(*rows)) if rows else [() for _ in self.columns]
+        if self.schema is None:
+            self._start(columns_values)
+        arrays = []
+        for index, values in enumerate(columns_values):
+            if index in self.decimal_columns:
+                values = [float(v) if v is not None else None for v in values]
+            arrays.append(pa.array(values, type=self.schema.field(index).type))
+        if rows:
+            self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        return self._drain()
+
+    def close(self) -> bytes:
+        """End-of-stream marker (and the schema, when no chunk was encoded)"""
+        if self.schema is None:
+            self._start([() for _ in self.columns])
+        self.writer.close()
+        return self._drain()
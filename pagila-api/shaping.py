@@ -0,0 +1,57 @@
+"""
+Result shaping for the Pagila API.
+
+Handlers hand over column names and row tuples straight from the cursor and
+the client picks the representation with `shape`:
+
+- records (default): `[{"col": value, ...}, ...]`, one object per row
+- table: `{"columns": [...], "rows": [[...], ...]}`, key names sent once
+- columns: `{"columns": [...], "data": {"col": [...], ...}}`, column-major
+
+Decimal columns are converted to float a column at a time rather than per
+value during encoding.
+"""
+
+from decimal import Decimal
+from typing import Literal
+
+Shape = Literal["records", "table", "columns"]
+
+
+def convert_columns(columns_values):
+    """Column-major values with every Decimal column turned into floats"""
+    converted = []
+    for values in columns_values:
+        sample = next((v for v in values if v is not None), None)
+        if isinstance(sample, Decimal):
+            values = [float(v) if v is not None else None for v in values]
+        converted.append(values)
+    return converted
+
+
+def convert_rows(rows):
+    """Row tuples with Decimal columns turned into floats (rows left as-is when there are none)"""
+    if not rows:
+        return rows
+    first = rows[0]
+    if not any(isinstance(v, Decimal) for v in first) and not any(v is None for v in first):
+        return rows
+    return list(zip(*convert_columns(list(zip(*rows)))))
+
+
+def shape_rows(columns, rows, shape: Shape = "records"):
+    """Represent `rows` (tuples in `columns` order) in the requested shape"""
+    columns = list(columns)
+    rows = list(rows)
+    if shape == "columns":
+        columns_values = convert_columns(list(zip(*rows))) if rows else [[] for _ in columns]
+        return {"columns": columns, "data": {name: list(values) for name, values in zip(columns, columns_values)}}
+    rows = convert_rows(rows)
+    if shape == "table":
+        return {"columns": columns, "rows": [list(row) for row in rows]}
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def shape_result(result, shape: Shape = "records"):
+    """shape_rows() for a SQLAlchemy result, using its column names"""
+    return shape_rows(result.keys(), result.all(), shape)
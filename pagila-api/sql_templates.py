@@ -0,0 +1,232 @@
+"""
+Plan cache of parameterized SQL templates for /execute-query.
+
+When an agent's read-only query succeeds and comes with an `intent` (a
+short description of what it answers, e.g. "top paying customers in a
+district"), its filter values are lifted out into bind parameters: the
+literals of the WHERE, HAVING, ON, LIMIT and OFFSET clauses become :p1,
+:p2, ... next to the binds the agent already used. "Top 5 customers in
+Alberta" and "in Ontario" then share one template, which the agent finds
+by intent (GET /sql-templates) and runs with new values
+(template_id + params) instead of generating the SQL again. Template runs
+go through server-side prepared statements (see prepared.py).
+
+Templates are kept in a bounded LRU in process memory, per worker.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from prepared import tokens
+
+SQL_TEMPLATE_MAX_ENTRIES = int(os.getenv("SQL_TEMPLATE_MAX_ENTRIES", "500"))
+# Intents remembered per template, most recent first
+SQL_TEMPLATE_MAX_INTENTS = 10
+
+# Clauses whose literals are values to filter on; the select list, GROUP BY
+# and ORDER BY keep theirs (ORDER BY 2 is a column, not a value)
+PARAMETERIZED_CLAUSES = {"where", "having", "on", "limit", "offset"}
+CLAUSES = PARAMETERIZED_CLAUSES | {"select", "from", "join", "group", "order", "window", "returning", "values"}
+# DATE '2024-01-01', INTERVAL '1 day': the literal is part of the syntax
+TYPED_LITERAL_PREFIXES = {"date", "time", "timestamp", "timestamptz", "interval"}
+READ_STATEMENTS = {"select", "with", "values", "table"}
+
+INTENT_WORDS = re.compile(r"[a-z0-9]+")
+INTENT_STOP_WORDS = {"a", "an", "and", "by", "for", "in", "of", "on", "the", "to", "with", "per", "each"}
+
+
+class TemplateError(ValueError):
+    """A query that can't become a template, or template params that don't fit"""
+
+
+def _literal(kind, value):
+    if kind == "number":
+        return int(value) if re.fullmatch(r"\d+", value) else float(value)
+    return value[1:-1].replace("''", "'")
+
+
+def type_name(value) -> str:
+    return {bool: "bool", int: "int", float: "float", str: "str"}.get(type(value), "any")
+
+
+def parameterize(sql, params=None):
+    """
+    Template of a single read-only statement: (sql with literals lifted into
+    binds, {bind: value}) including the agent's own `params`
+
+    Raises:
+        TemplateError: when `sql` is not a single read-only statement
+    """
+    parts = tokens(sql.strip().rstrip(";").strip())
+    words = [value.lower() for kind, value in parts if kind == "word"]
+    if not words or words[0] not in READ_STATEMENTS:
+        raise TemplateError("only SELECT statements become templates")
+    if any(kind == "other" and value == ";" for kind, value in parts):
+        raise TemplateError("only single statements become templates")
+
+    values = dict(params or {})
+    counter = 0
+    # Clause of each open parenthesis level: a subquery's WHERE ends with it
+    clauses = [None]
+    previous_word = None
+    out = []
+    for i, (kind, value) in enumerate(parts):
+        if kind in ("space", "comment"):
+            # Whitespace and comments between tokens become one space; literals keep theirs
+            if out and out[-1] != " ":
+                out.append(" ")
+            continue
+        if kind == "word":
+            if value.lower() in CLAUSES:
+                clauses[-1] = value.lower()
+            previous_word = value.lower()
+        elif kind == "other" and value == "(":
+            clauses.append(clauses[-1])
+        elif kind == "other" and value == ")" and len(clauses) > 1:
+            clauses.pop()
+        elif kind in ("string", "number") and clauses[-1] in PARAMETERIZED_CLAUSES \
+                and not (kind == "string" and previous_word in TYPED_LITERAL_PREFIXES):
+            counter += 1
+            while f"p{counter}" in values:
+                counter += 1
+            name = f"p{counter}"
+            values[name] = _literal(kind, value)
+            value = f":{name}"
+            # ":p1::date" would read as a bind named "p"; ":p1 ::date" is fine
+            if i + 1 < len(parts) and parts[i + 1][0] == "cast":
+                value += " "
+        if kind != "word":
+            previous_word = None
+        out.append(value)
+    template = "".join(out).strip()
+    return template, values
+
+
+def intent_words(intent):
+    return {word for word in INTENT_WORDS.findall((intent or "").lower()) if word not in INTENT_STOP_WORDS}
+
+
+class Template:
+    """A parameterized query with the values it was last recorded with"""
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.template_id = hashlib.sha1(sql.encode()).hexdigest()[:12]
+        self.params = {name: {"type": type_name(value), "example": value} for name, value in params.items()}
+        self.intents = []
+        self.uses = 0
+        self.created_at = time.time()
+        self.last_used_at = self.created_at
+
+    @property
+    def statement_name(self):
+        return f"tpl_{self.template_id}"
+
+    def add_intent(self, intent):
+        intent = " ".join(intent.split())
+        if intent in self.intents:
+            self.intents.remove(intent)
+        self.intents.insert(0, intent)
+        del self.intents[SQL_TEMPLATE_MAX_INTENTS:]
+
+    def bind(self, params=None):
+        """
+        Values for a run: `params` over the recorded examples, converted to
+        the recorded types
+
+        Raises:
+            TemplateError: on unknown parameter names or values of the wrong type
+        """
+        params = params or {}
+        unknown = sorted(set(params) - set(self.params))
+        if unknown:
+            raise TemplateError(f"unknown parameters {unknown}; this template takes {sorted(self.params)}")
+        values = {}
+        for name, spec in self.params.items():
+            value = params.get(name, spec["example"])
+            try:
+                if spec["type"] == "int" and not isinstance(value, bool):
+                    value = int(value)
+                elif spec["type"] == "float":
+                    value = float(value)
+            except (TypeError, ValueError):
+                raise TemplateError(f"parameter {name} must be {spec['type']}, got {value!r}")
+            values[name] = value
+        return values
+
+    def score(self, words):
+        """How well `words` (of an intent) match the template's intents, 0 to 1"""
+        best = 0.0
+        for intent in self.intents:
+            known = intent_words(intent)
+            if known and words:
+                best = max(best, len(known & words) / len(known | words))
+        return best
+
+    def describe(self):
+        return {
+            "template_id": self.template_id,
+            "intents": self.intents,
+            "sql": self.sql,
+            "params": self.params,
+            "uses": self.uses,
+        }
+
+
+class TemplateCache:
+    """Bounded LRU of templates, keyed by template id"""
+
+    def __init__(self, max_entries=SQL_TEMPLATE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, sql, params, intent):
+        """Store the template of a successful query under `intent`; returns it"""
+        template_sql, values = parameterize(sql, params)
+        candidate = Template(template_sql, values)
+        with self._lock:
+            template = self._templates.get(candidate.template_id)
+            if template is None:
+                template = self._templates[candidate.template_id] = candidate
+            else:
+                # Latest values are the best defaults
+                template.params = candidate.params
+            template.add_intent(intent)
+            self._templates.move_to_end(template.template_id)
+            while len(self._templates) > self.max_entries:
+                self._templates.popitem(last=False)
+        return template
+
+    def get(self, template_id):
+        with self._lock:
+            return self._templates.get(template_id)
+
+    def used(self, template):
+        with self._lock:
+            template.uses += 1
+            template.last_used_at = time.time()
+            if template.template_id in self._templates:
+                self._templates.move_to_end(template.template_id)
+
+    def search(self, intent=None, limit=5):
+        """Templates best matching `intent` (all by use when no intent), best first"""
+        words = intent_words(intent)
+        with self._lock:
+            templates = list(self._templates.values())
+        if not words:
+            ranked = sorted(templates, key=lambda t: (t.uses, t.last_used_at), reverse=True)
+            return [t.describe() for t in ranked[:limit]]
+        scored = [(t.score(words), t) for t in templates]
+        ranked = sorted((item for item in scored if item[0] > 0), key=lambda item: (item[0], item[1].uses),
+                        reverse=True)
+        return [dict(t.describe(), score=round(score, 3)) for score, t in ranked[:limit]]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._templates), "max_entries": self.max_entries,
+                    "uses": sum(t.uses for t in self._templates.values())}
@@ -0,0 +1,70 @@
+"""
+Streaming helpers for the Pagila API.
+
+Rows are pulled from a server-side cursor in fixed-size chunks and written out
+as newline-delimited JSON or Arrow record batches, so memory stays flat no
+matter how many rows the client walks through.
+"""
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from instrumentation import atimed_partitions, statement_label, timed_partitions
+from serialization import ARROW_STREAM_MEDIA_TYPE, ArrowStreamEncoder, dumps, pa, preferred_media_type
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_CHUNK_SIZE = 500
+
+
+def streaming_media_type(request: Request):
+    """The row-streaming format the client asked for (NDJSON or Arrow), or None"""
+    offered = (NDJSON_MEDIA_TYPE, ARROW_STREAM_MEDIA_TYPE) if pa is not None else (NDJSON_MEDIA_TYPE,)
+    return preferred_media_type(request.headers.get("accept", ""), offered)
+
+
+def stream_response(engine, query, params=None, media_type: str = NDJSON_MEDIA_TYPE,
+                    chunk_size: int = STREAM_CHUNK_SIZE, name: str = None):
+    """
+    Stream the rows of `query` as NDJSON (one JSON object per line) or as an
+    Arrow IPC stream (one record batch per chunk).
+
+    The generator owns its own connection: request-scoped sessions are closed
+    before a streaming body is sent, so it can't reuse the one from get_db.
+    With an AsyncEngine the rows come from an asyncpg cursor instead.
+    `name` labels the query in the SQL timings.
+    """
+    arrow = None
+    name = name or statement_label(str(query))
+
+    def encode(columns, rows):
+        nonlocal arrow
+        if media_type == ARROW_STREAM_MEDIA_TYPE:
+            if arrow is None:
+                arrow = ArrowStreamEncoder(columns)
+            return arrow.encode(rows)
+        return b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+
+    def finish(columns):
+        if media_type != ARROW_STREAM_MEDIA_TYPE:
+            return b""
+        return (arrow or ArrowStreamEncoder(columns)).close()
+
+    async def agenerate():
+        async with engine.connect() as conn:
+            result = await conn.stream(query, params or {}, execution_options={"statement_name": name})
+            columns = list(result.keys())
+            async for rows in atimed_partitions(result.partitions(chunk_size), name):
+                yield encode(columns, rows)
+            yield finish(columns)
+
+    def generate():
+        with engine.connect() as conn:
+            result = conn.execution_options(yield_per=chunk_size, statement_name=name).execute(query, params or {})
+            columns = list(result.keys())
+            for rows in timed_partitions(result.partitions(), name):
+                yield encode(columns, rows)
+            yield finish(columns)
+
+    body = agenerate() if isinstance(engine, AsyncEngine) else generate()
+    return StreamingResponse(body, media_type=media_type)
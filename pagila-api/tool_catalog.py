@@ -0,0 +1,113 @@
+"""
+Compact tool catalog for agents, generated from the API's OpenAPI schema.
+
+One entry per route agents may call, with typed parameters and the examples
+taken from the route docstrings, so the agents' prompts never hand-copy
+(and never drift from) the route definitions in main.py. Admin and
+monitoring routes are left out.
+"""
+
+import hashlib
+import json
+import re
+
+# Routes that are not tools for agents
+EXCLUDED_PATHS = {"/", "/metrics", "/tools/catalog"}
+EXCLUDED_PREFIXES = ("/admin/",)
+
+EXAMPLE_LINE = re.compile(r"^Example:\s*(.+)$")
+
+
+def _resolve(schema, components):
+    if "$ref" in schema:
+        return _resolve(components[schema["$ref"].rsplit("/", 1)[-1]], components)
+    # Optional[X] comes out as anyOf [X, null]
+    if "anyOf" in schema:
+        variants = [_resolve(s, components) for s in schema["anyOf"] if s.get("type") != "null"]
+        if len(variants) == 1:
+            return dict(variants[0], **{k: v for k, v in schema.items() if k != "anyOf"})
+    return schema
+
+
+def type_name(schema, components) -> str:
+    """Short type of a JSON schema: str, int, date, records|table|columns, list[str], ..."""
+    schema = _resolve(schema, components)
+    if "enum" in schema:
+        return "|".join(str(value) for value in schema["enum"])
+    kind = schema.get("type")
+    if kind == "string" and schema.get("format") in ("date", "date-time"):
+        return schema["format"]
+    if kind == "array":
+        return f"list[{type_name(schema.get('items', {}), components)}]"
+    return {"string": "str", "integer": "int", "number": "float", "boolean": "bool", "object": "dict"}.get(kind, "any")
+
+
+def _param(schema, components, required):
+    entry = {"type": type_name(schema, components)}
+    if required:
+        entry["required"] = True
+    resolved = _resolve(schema, components)
+    if resolved.get("default") is not None:
+        entry["default"] = resolved["default"]
+    return entry
+
+
+def _describe(description):
+    """Summary (the first sentence), the rest of the text as notes, and the Example: lines"""
+    lines = [line.strip() for line in (description or "").strip().splitlines() if line.strip()]
+    examples = [EXAMPLE_LINE.match(line).group(1).strip("'\"") for line in lines if EXAMPLE_LINE.match(line)]
+    text = " ".join(line for line in lines if not EXAMPLE_LINE.match(line))
+    summary, _, notes = text.partition(". ")
+    return summary.rstrip("."), notes, examples
+
+
+def build_catalog(openapi):
+    """Tool entries for every agent-facing operation of an OpenAPI document"""
+    components = openapi.get("components", {}).get("schemas", {})
+    tools = []
+    for path, operations in openapi.get("paths", {}).items():
+        if path in EXCLUDED_PATHS or path.startswith(EXCLUDED_PREFIXES):
+            continue
+        for method, operation in operations.items():
+            summary, notes, examples = _describe(operation.get("description"))
+            tool = {
+                "endpoint": path.lstrip("/"),
+                "method": method.upper(),
+                "summary": summary or operation.get("summary", ""),
+            }
+            params = {
+                p["name"]: _param(p.get("schema", {}), components, p.get("required", False))
+                for p in operation.get("parameters", []) if p.get("in") == "query"
+            }
+            if params:
+                tool["params"] = params
+            body = operation.get("requestBody", {}).get("content", {}).get("application/json", {}).get("schema")
+            if body is not None:
+                body = _resolve(body, components)
+                required = set(body.get("required", []))
+                tool["json_data"] = {
+                    name: _param(schema, components, name in required)
+                    for name, schema in body.get("properties", {}).items()
+                }
+            if examples:
+                tool["examples"] = examples
+            if notes:
+                tool["notes"] = notes
+            tools.append(tool)
+    return tools
+
+
+class ToolCatalog:
+    """The catalog of an app, built on first use (routes don't change at runtime)"""
+
+    def __init__(self, app):
+        self.app = app
+        self._content = None
+        self.etag = None
+
+    def content(self):
+        if self._content is None:
+            content = {"version": self.app.version, "tools": build_catalog(self.app.openapi())}
+            self.etag = '"%s"' % hashlib.md5(json.dumps(content, sort_keys=True).encode()).hexdigest()
+            self._content = content
+        return self._content